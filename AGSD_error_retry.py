@@ -0,0 +1,99 @@
+import csv
+import os
+import re
+import time
+from AGSD_tax_updater import (APIClient, ClassificationTree, ResponseCache, fetch_user_key, iter_AGSD_records, log_to_txt, merge_delta,
+                              open_csv, remove_unneeded_columns, results_to_csv, run_pipeline)
+
+# Re-matching the records of a match_error_log .csv output of AGSD_tax_updater.py, and merging the results into the other
+# outputs of the same run, so that a few failed queries do not need a full re-run. The records are taken from the AGSD .sql
+# file the run was made on, by id (or by raw name, for error logs written before record ids were logged).
+
+# Loading the rows of a .csv (or .csv.gz) output file, or an empty list if there is none
+def load_csv_rows(csv_file):
+    if not os.path.exists(csv_file):
+        return []
+    with open_csv(csv_file) as file:
+        return(list(csv.DictReader(file)))
+
+# The AGSD records with a logged match error
+def failed_AGSD_records(AGSD_sql_file, error_rows):
+    error_ids = {row["id"] for row in error_rows if row.get("id")}
+    error_names = {row["raw_name"] for row in error_rows if not row.get("id") and row.get("raw_name")}
+    return([record for record in iter_AGSD_records(AGSD_sql_file) if record["id"] in error_ids or record.get("raw_name") in error_names])
+
+# Replacing the rows of the re-matched records in a .csv output file with their new results. Each new row takes the place of the
+# old row with the same id, and the rows of records that were not in the file before are put in the order of the ids in
+# record_order (the record order of the run), or at the end of the file without it.
+def update_output(csv_file, record_ids, new_rows, record_order=None):
+    new_lookup = {row["id"]: row for row in new_rows}
+    rows = []
+    for row in load_csv_rows(csv_file):
+        if row.get("id") in new_lookup:
+            rows.append(new_lookup.pop(row["id"]))
+        elif row.get("id") not in record_ids:
+            rows.append(row)
+
+    if new_lookup and record_order:
+        positions = {id: position for position, id in enumerate(record_order)}
+        rows = sorted(rows + list(new_lookup.values()), key=lambda row: positions.get(row.get("id"), len(positions)))
+    else:
+        rows += list(new_lookup.values())
+    results_to_csv(csv_file, rows)
+
+if __name__ == "__main__":
+
+    print("\n     " + "-"*38 + "\n      AGSD Taxonomy Updater - Error Retry \n     " + "-"*38 + "\n")
+
+    error_log = input("Please enter the match_error_log .csv file of the run you wish to retry (the other output files of the run should be in the same directory): ").strip()
+    AGSD_data = input("Please enter the AGSD .sql file the run was made on: ").strip()
+    dataset = input("Please enter the key of the ChecklistBank dataset the run was checked against (Eg. Col annual checklist = 310463): ").strip()
+
+    username = "dylanharding"
+    password = "mygbifpassword"
+
+    # The output files of a run share the date suffix (and compression) of its match error log
+    output_folder, error_log_name = os.path.split(error_log)
+    date_str, extension = re.match(r"^match_error_log_(.*?)(\.csv(?:\.gz)?)$", error_log_name).groups()
+
+    error_rows = load_csv_rows(error_log)
+    AGSD_records = failed_AGSD_records(AGSD_data, error_rows)
+    record_ids = {record["id"] for record in AGSD_records}
+    print(f"{len(AGSD_records)} AGSD records found for {len(error_rows)} logged match errors")
+    print("-"*15)
+
+    response_cache = ResponseCache()
+    client = APIClient(username, password, response_cache, classification_tree=ClassificationTree())
+    user_key = fetch_user_key(client)
+
+    results = run_pipeline(dataset, AGSD_records, client)
+
+    log_to_txt(results["tax_updates"], "tax_update_log_retry")
+    log_to_txt(results["tax_fills"], "tax_fill_log_retry")
+    log_to_txt(results["high_tax_updates"], "high_tax_update_log_retry")
+    log_to_txt(results["tax_reclass_log"], "tax_reclassification_log_retry")
+    print("Log file saved to 'merge_log_files' subfolder")
+
+    # The updated AGSD data keeps its record order, with the rows of the re-matched records replaced
+    genome_entries_file = os.path.join(output_folder, f"genome_entries_updated_{date_str}{extension}")
+    previous_rows = {row["id"]: row for row in load_csv_rows(genome_entries_file)}
+    final_data = remove_unneeded_columns(results["merged_data"])
+    if previous_rows:
+        final_data = merge_delta(list(previous_rows), previous_rows, final_data)
+    results_to_csv(genome_entries_file, final_data)
+
+    # The other outputs keep their record order too, with the rows of records new to an output put in the order of the updated AGSD data
+    record_order = list(previous_rows)
+    update_output(os.path.join(output_folder, f"low_order_matches_{date_str}{extension}"), record_ids, results["matches"], record_order)
+    update_output(os.path.join(output_folder, f"unmatched_records_{date_str}{extension}"), record_ids, results["family_unmatches"], record_order)
+    update_output(os.path.join(output_folder, f"family_level_matches_{date_str}{extension}"), record_ids, results["family_matches"], record_order)
+
+    # Logged errors of records that could not be found in the AGSD file are kept
+    raw_names = {record.get("raw_name") for record in AGSD_records}
+    remaining_errors = [row for row in error_rows if (row["id"] not in record_ids if row.get("id") else row.get("raw_name") not in raw_names)]
+    results_to_csv(error_log, remaining_errors + results["match_errors"] + results["family_match_errors"] + results["source_errors"])
+
+    client.metrics.write_report(os.path.join(output_folder, f"run_report_retry_{time.strftime('%d_%m_%Y')}.json"), results["records"], response_cache, results["summary"])
+    response_cache.report()
+    response_cache.close()
+    client.close()
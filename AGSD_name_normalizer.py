@@ -0,0 +1,112 @@
+import re
+
+# Canonical form of the taxon names of AGSD records, shared by extraction (query names and ranks), query grouping and caching,
+# and merging. A name is reduced to its genus and epithets: qualifiers (open nomenclature markers such as "cf.", "aff." and
+# "sp.", "ssp." parts, subgenera and bracketed designations such as "(4n)") are split off, author strings are removed and
+# whitespace and case are tidied, so that names differing only in those parts send the same ChecklistBank query.
+
+# Regex patterns for bracketed numbers+letters in names (eg. Bufo viridis (4n)) and "ssp.*"/"subsp.*" parts, also kept when
+# swapping species synonyms
+BRACKET_DESIGNATION = re.compile(r"\([0-9]+[A-Za-z]*\)")
+SSP_DESIGNATION = re.compile(r"\b(?:ssp|subsp)\..*")
+
+# Regex patterns for name tokens: open nomenclature markers (with or without a full stop, and eg. "sp.1" or "sp.A" for numbered
+# or lettered unnamed species), subgenera in brackets after the genus, and tokens starting an author string (a capitalised word,
+# a bracketed author, "&" or a year, or a particle such as "de" or "von" followed by one) and tokens following an author's
+# name (a year or "&")
+QUALIFIER_TOKEN = re.compile(r"^(cf|aff|nr|sp|spp|ssp|subsp|nov|indet)(?:\.[0-9A-Za-z-]*|[0-9]*)$|^\?$", re.IGNORECASE)
+SUBGENUS_TOKEN = re.compile(r"^\([A-Z][a-z]+\)$")
+AUTHOR_TOKEN = re.compile(r"^(?:\(?[A-Z]|&$|\(?[0-9]{4}\b)")
+AUTHOR_FOLLOWING_TOKEN = re.compile(r"^(?:&$|\(?[0-9]{4}\b)")
+AUTHOR_PARTICLES = frozenset(["d'", "da", "de", "del", "della", "der", "di", "du", "la", "le", "van", "von", "(de", "(van", "(von"])
+
+# Open nomenclature markers ending the name, by the rank of the query they leave (the rest of the name is kept with the marker):
+#   species - the record is a (possibly unnamed) subspecies of the species named
+#   genus   - the species is unnamed, new or only close to (aff., nr.) the species named, so only the genus can be matched
+# Other markers ("cf.", "?") only flag an uncertain identification, and the name is queried without them.
+SUBSPECIES_QUALIFIERS = frozenset(["ssp", "subsp"])
+GENUS_QUALIFIERS = frozenset(["sp", "spp", "aff", "nr", "nov", "indet"])
+
+# The marker of a qualifier token (eg. "sp" for "sp.1"), or None for any other token
+def qualifier_marker(token):
+    match = QUALIFIER_TOKEN.match(token)
+    if not match:
+        return None
+    return(match.group(1).lower() if match.group(1) else "?")
+
+# Whether a token starts the author string of a name. Straight after the genus, a capitalised word only does so when it reads
+# as an author (followed by a comma, year or "&"), and is otherwise taken as a wrongly capitalised epithet.
+def author_start(tokens, position, after_genus):
+    token = tokens[position]
+    next_token = tokens[position + 1] if position + 1 < len(tokens) else ""
+    if token.lower() in AUTHOR_PARTICLES:
+        return(bool(AUTHOR_TOKEN.match(next_token)))
+    if not AUTHOR_TOKEN.match(token):
+        return False
+    if not after_genus or token[0] in "(&" or token[0].isdigit():
+        return True
+    return(token.endswith(",") or bool(AUTHOR_FOLLOWING_TOKEN.match(next_token)))
+
+# Splitting a name into its canonical form and its qualifiers. Returns (name, qualifiers), with the qualifiers in the order
+# they appear in the name. A marker ending the name is kept as one qualifier with the rest of the name (eg. "ssp. minor",
+# "sp. A"), and author strings are dropped. Returns (None, ()) for an empty name.
+def normalize_name(name):
+    if not name:
+        return(None, ())
+
+    qualifiers = []
+    for designation in BRACKET_DESIGNATION.findall(name):
+        qualifiers.append(designation)
+    tokens = BRACKET_DESIGNATION.sub(" ", name).split()
+
+    name_tokens = []
+    for position, token in enumerate(tokens):
+        marker = qualifier_marker(token) if name_tokens else None
+        if marker in SUBSPECIES_QUALIFIERS or marker in GENUS_QUALIFIERS:
+            qualifiers.append(" ".join(tokens[position:]))
+            break
+        if marker:
+            qualifiers.append(token)
+        elif len(name_tokens) == 1 and SUBGENUS_TOKEN.match(token):
+            qualifiers.append(token)
+        elif name_tokens and author_start(tokens, position, len(name_tokens) == 1):
+            break
+        elif name_tokens:
+            name_tokens.append(token.lower())
+        else:
+            name_tokens.append(token.capitalize())
+
+    if not name_tokens:
+        return(None, tuple(qualifiers))
+    return(" ".join(name_tokens), tuple(qualifiers))
+
+# The canonical form of a name, without its qualifiers
+def canonical_name(name):
+    return(normalize_name(name)[0])
+
+# The query name, rank and qualifiers of an AGSD record, from its species and subspecies names. Names with a genus-level
+# qualifier (eg. "Bufo sp.") or only a genus are queried at genus rank, "ssp." names at species rank, and other subspecies
+# names at subspecies rank. Trinomials in the species column are queried at species rank (ChecklistBank flags them for a
+# subspecies re-query).
+def normalize_query(species, subspecies=None):
+    name, qualifiers = normalize_name(subspecies or species)
+    if name is None:
+        return(subspecies or species, "species", qualifiers)
+
+    markers = {qualifier_marker(qualifier.split()[0]) for qualifier in qualifiers}
+    name_tokens = name.split()
+    if markers & GENUS_QUALIFIERS or len(name_tokens) == 1:
+        return(name_tokens[0], "genus", qualifiers)
+    if markers & SUBSPECIES_QUALIFIERS:
+        return(" ".join(name_tokens[:2]), "species", qualifiers)
+    if subspecies and len(name_tokens) > 2:
+        return(name, "subspecies", qualifiers)
+    return(name, "species", qualifiers)
+
+# Whitespace- and case-insensitive key of a (canonical) name, used to compare names from different sources
+def name_key(name):
+    return(" ".join(name.split()).casefold())
+
+# Normalized (name, rank) key used to group records sending the same query, and to look up names locally
+def query_key(query_name, query_rank):
+    return(name_key(query_name), query_rank)
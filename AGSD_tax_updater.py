@@ -3,121 +3,1458 @@ import re
 import csv
 import time
 import os
+import json
+import sys
+import hashlib
+import email.utils
+import sqlite3
+import zipfile
+import io
+import gzip
+import threading
+import queue
+import multiprocessing
+from collections import deque
+from collections.abc import Mapping, MutableMapping
+from operator import itemgetter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
-from io import StringIO
+from urllib3.util.retry import Retry
+from AGSD_name_normalizer import BRACKET_DESIGNATION, SSP_DESIGNATION, canonical_name, name_key, normalize_name, normalize_query, query_key
+
+# Matching settings: number of concurrent in-flight API requests, whether trinomials queried at species rank are also queried at
+# subspecies rank at the same time (rather than after ChecklistBank flags them), and the adaptive rate limit (requests per second)
+# shared between them.
+# The rate starts at REQUESTS_PER_SECOND and is raised by RATE_INCREASE per second of healthy responses, up to MAX_REQUESTS_PER_SECOND,
+# and is multiplied by RATE_DECREASE (down to MIN_REQUESTS_PER_SECOND) when the API throttles requests with a 429 or 503 response.
+MAX_WORKERS = 8
+SPECULATIVE_QUERIES = True
+REQUESTS_PER_SECOND = 10
+MIN_REQUESTS_PER_SECOND = 1
+MAX_REQUESTS_PER_SECOND = 50
+RATE_INCREASE = 1
+RATE_DECREASE = 0.5
+
+# Cache settings: SQLite file used to keep API responses between runs, and the number of days before a cached response expires
+CACHE_FILE = "AGSD_api_cache.sqlite"
+CACHE_TTL_DAYS = 60
+
+# Checkpoint settings: folder for the checkpoint journals of matching runs, and the number of completed records between flushes to disk
+CHECKPOINT_DIR = "checkpoints"
+CHECKPOINT_INTERVAL = 100
+
+# Deferred retry settings: the number of passes re-matching the records whose queries failed with an error after the main pass,
+# and the wait in seconds before the first of them (doubled for each further pass)
+ERROR_RETRY_PASSES = 2
+ERROR_RETRY_BACKOFF = 30
+
+# Extraction settings: number of processes parsing a large .sql file in parallel, and the size in bytes of the parts of the file
+# each process parses at a time. Files no larger than one part are parsed in the main process.
+EXTRACT_PROCESSES = os.cpu_count() or 1
+EXTRACT_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Output settings: whether the .csv outputs are gzip compressed (saved as .csv.gz)
+COMPRESS_OUTPUT = False
+
+# Pipeline settings: number of records per chunk passed between stages, and the number of chunks queued between two stages
+PIPELINE_CHUNK_SIZE = 500
+PIPELINE_QUEUE_SIZE = 4
+
+# Reporting settings: whether a live progress bar (with ETA) replaces the per-chunk progress lines, and the upper bounds (in seconds)
+# of the API latency histogram buckets in the run report
+PROGRESS_BAR = False
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Number of names sent to GNV per batch verification request, and the largest edit distance of the corrections made locally
+# (with an offline checklist) before names are sent to GNV
+GNV_BATCH_SIZE = 1000
+FUZZY_MAX_EDIT_DISTANCE = 2
+
+# API settings: base URLs, request timeouts (connect, read) in seconds, the number of pooled keep-alive connections per host
+# (ChecklistBank requests are sent at once from the species matching, family matching and source lookup stages of the pipeline
+# and from the speculative query pool, each with MAX_WORKERS threads, and with hedging the hedge pool's connections are added),
+# the number of retries (with exponential backoff) for failed connections and 500/502/504 responses, the number of times a
+# throttled (429/503) request is re-sent after waiting for its Retry-After time (or an exponential backoff without one), the
+# longest wait in seconds before a throttled request is re-sent (longer Retry-After times are cut to it), and the most seconds
+# a request waits on throttling in total before it fails
+CHECKLISTBANK_API = "https://api.checklistbank.org"
+GNV_API = "https://verifier.globalnames.org/api/v1"
+REQUEST_TIMEOUT = (10, 60)
+POOL_SIZES = {CHECKLISTBANK_API: 4 * MAX_WORKERS, GNV_API: 4}
+MAX_RETRIES = 5
+RETRY_BACKOFF = 0.5
+MAX_THROTTLE_RETRIES = 8
+MAX_THROTTLE_WAIT = 60
+MAX_THROTTLE_TOTAL_WAIT = 300
+
+# Hedging settings: whether slow match/nameusage requests are hedged (sent a second time once they have taken longer than the
+# HEDGE_PERCENTILE latency of the endpoint's last HEDGE_WINDOW requests, keeping whichever response comes back first), the
+# number of requests to an endpoint before hedging starts, and the most hedges sent as a fraction of the endpoint's requests.
+# GNV verifications are not hedged: they are sent as one batch per pipeline chunk, too few (and too different in size) for a percentile.
+HEDGE_REQUESTS = False
+HEDGED_ENDPOINTS = ("match/nameusage",)
+HEDGE_PERCENTILE = 95
+HEDGE_WINDOW = 1000
+HEDGE_MIN_REQUESTS = 50
+HEDGE_BUDGET = 0.05
 
 # Request for CheckilistBank user key
-def fetch_user_key(username, password):
-    url = "https://api.checklistbank.org/user/me"
-    r = requests.get(url, auth=HTTPBasicAuth(username, password))
-    data = r.json()
+def fetch_user_key(client):
+    url = f"{CHECKLISTBANK_API}/user/me"
+    data = client.get(url, authenticate=True)
     user_key = data["key"]
     return(user_key)
 
-# Extracting data from the AGSD .sql file
-def AGSD_data_extract(AGSD_sql_file):
-    print("Extracting AGSD tax data...")
-    print("-"*15)
-    time.sleep(1)
- 
-    AGSD_records = []
-    column_names = []
-    
-    with open(AGSD_sql_file, "r") as file:
+# Changing some key names from the AGSD .sql file for consistency with data downstream
+COLUMN_RENAMES = {
+        "sub_phylum": "subphylum",
+        "super_class": "superclass",
+        "sub_class": "subclass",
+        "infra_class": "infraclass",
+        "super_order": "superorder",
+        "order_name": "order",
+        "sub_order": "suborder",
+        "infra_order": "infraorder",
+        "sub_family": "subfamily",
+        "species_alt": "name_in_reference"
+    }
+
+# Columns with few distinct values (taxonomic names, methods and data entry details), whose values are interned when records
+# are extracted, so that records share a single copy of each value
+INTERNED_COLUMNS = frozenset(["kingdom", "phylum", "subphylum", "superclass", "class", "subclass", "infraclass", "superorder", "order",
+    "suborder", "infraorder", "family", "subfamily", "genus", "species", "subspecies", "method", "std_sp", "entered_by", "date_entered", "refs"])
+
+# Regex patterns used to parse .sql dumps: the start of INSERT INTO statements (with an optional column list), column
+# definitions inside CREATE TABLE statements, and the values (single- or double-quoted strings, or unquoted), separators and
+# quote escapes of the VALUES tuples
+SQL_INSERT = re.compile(r"insert\s+into\s+[^\s(]+\s*(?:\(([^)]*)\))?\s*values\s*(.*)$", re.IGNORECASE | re.DOTALL)
+SQL_INSERT_LINE = re.compile(rb"\s*insert\s+into\s", re.IGNORECASE)
+SQL_CREATE_COLUMN = re.compile(r"^\s*`([^`]+)`")
+SQL_TUPLE_START = re.compile(r"[\s,]*([(;])")
+SQL_VALUE = re.compile(r"""\s*(?:'((?:[^'\\]+|\\.|'')*)'|"((?:[^"\\]+|\\.|"")*)"|([^\s,()'";]+))""", re.DOTALL)
+SQL_SEPARATOR = re.compile(r"\s*([,)])")
+SQL_UNTERMINATED_STRING = re.compile(r"""\s*(?:'(?:[^'\\]+|\\.|'')*|"(?:[^"\\]+|\\.|"")*)\\?$""", re.DOTALL)
+SQL_ESCAPE = re.compile(r"""\\(.)|''|\"\"""", re.DOTALL)
+SQL_ESCAPE_CHARS = {"n": "\n", "r": "\r", "t": "\t", "0": "\0", "Z": "\x1a", "b": "\b"}
+
+# Replacing MySQL backslash escapes and doubled quotes in a string value quoted with "quote"
+def unescape_sql_string(value, quote="'"):
+    if "\\" not in value and quote * 2 not in value:
+        return(value)
+    return(SQL_ESCAPE.sub(lambda match: SQL_ESCAPE_CHARS.get(match.group(1), match.group(1)) if match.group(1) is not None
+                          else match.group(0)[0] if match.group(0) == quote * 2 else match.group(0), value))
+
+# Whether the text of a buffer from "position" on could be the start of a tuple cut off at the end of the buffer (only
+# whitespace, or a string value that is still open), rather than text that cannot be parsed
+def incomplete_sql_text(buffer, position):
+    return(not buffer[position:].strip() or bool(SQL_UNTERMINATED_STRING.match(buffer, position)))
+
+# Parsing the complete VALUES tuples at the start of a buffer of .sql text. Returns the parsed rows (lists of values, with
+# unquoted NULLs as None), the position the next parse should start from (the start of any incomplete tuple, which
+# needs more text to be parsed), and whether the end of the INSERT statement was reached.
+# Raises a ValueError for text that cannot be parsed, rather than waiting for more text that would never complete it.
+def parse_sql_tuples(buffer):
+    rows = []
+    position = 0
+
+    while True:
+        start = SQL_TUPLE_START.match(buffer, position)
+        if not start:
+            if buffer[position:].strip().strip(","):
+                raise ValueError(f"Could not parse .sql VALUES text: {buffer[position:].strip().splitlines()[0]}")
+            return(rows, position, False)
+        if start.group(1) == ";":
+            return(rows, start.end(), True)
+
+        tuple_start = position
+        position = start.end()
+        values = []
+        complete = False
+
+        while True:
+            value = SQL_VALUE.match(buffer, position)
+            if not value:
+                break
+            if value.group(1) is not None:
+                values.append(unescape_sql_string(value.group(1)))
+            elif value.group(2) is not None:
+                values.append(unescape_sql_string(value.group(2), '"'))
+            elif value.group(3).upper() == "NULL":
+                values.append(None)
+            else:
+                values.append(value.group(3))
+
+            position = value.end()
+            separator = SQL_SEPARATOR.match(buffer, position)
+            if not separator:
+                break
+            position = separator.end()
+            if separator.group(1) == ")":
+                complete = True
+                break
+
+        if not complete:
+            if not incomplete_sql_text(buffer, position):
+                raise ValueError(f"Could not parse .sql values tuple: {buffer[start.start(1):].splitlines()[0]}")
+            return(rows, tuple_start, False)
+        rows.append(values)
+
+# Generator reading a .sql dump line by line and yielding (column_names, values) for every row of every INSERT INTO statement.
+# Handles one tuple per line as well as multi-row extended inserts (INSERT ... VALUES (...),(...);), taking the column names
+# from the INSERT column list, or from the preceding CREATE TABLE statement when the INSERT has none. Only the current
+# statement line (or tuple, for values spanning lines) is held in memory.
+# With a (start, end) byte range (see sql_chunks), only that part of the file is read, starting with the given CREATE TABLE columns,
+# and for ranges starting between the tuples of an INSERT statement (in_values), with the column names of that INSERT.
+def iter_sql_rows(sql_file, byte_range=None, table_columns=(), insert_columns=(), in_values=False):
+    table_columns = list(table_columns)
+    column_names = [COLUMN_RENAMES.get(name, name) for name in insert_columns]
+    in_create = False
+    buffer = ""
+
+    with open_sql_range(sql_file, byte_range) as file:
         for line in file:
-            stripped = line.strip()
+            if in_values:
+                buffer += line
+            else:
+                stripped = line.strip()
 
-            # Using the INSERT INTO line to find keys
-            if not column_names and stripped.lower().startswith("insert into"):
-                columns = re.search(r"\((.*?)\)", stripped)
-                if columns:
-                    column_names = [line.strip().strip('`"') for line in columns.group(1).split(',')]
-
-                    # Changing some key names for consistency with data downstream
-                    column_renames = {
-                            "sub_phylum": "subphylum",
-                            "super_class": "superclass",
-                            "sub_class": "subclass",
-                            "infra_class": "infraclass",
-                            "super_order": "superorder",
-                            "order_name": "order",
-                            "sub_order": "suborder",
-                            "infra_order": "infraorder",
-                            "sub_family": "subfamily",
-                            "species_alt": "name_in_reference"
-                        }
-                    
-                column_names = [column_renames.get(name, name) for name in column_names]
-
-
-            # Cleaning and appending values from records
-            elif re.match(r'^\(\d+', stripped):
-                stripped = stripped[1:-2]
-                csv_reader = csv.reader(StringIO(stripped), skipinitialspace = True, quotechar ="'")
-                entry_row = next(csv_reader)
-
-                cleaned_data = []
-
-                for data in entry_row:
-                    data = data.replace('\xa0', ' ').strip() # Removes hidden character spaces that ccan be found in SQL files
-
-                    # Converting all "NULL" values or empty strings to None type
-                    if data.upper() == "NULL" or data in ("''", "", "' '", '" "', " "): 
-                        cleaned_data.append(None)
-                    elif data.startswith("'") and data.endswith("'"):
-                        data = data[1:-1].strip()
-                        cleaned_data.append(data)
-                    else:
-                        cleaned_data.append(data)
+                if stripped.lower().startswith("create table"):
+                    in_create = True
+                    table_columns = []
+                    continue
+                if in_create:
+                    column = SQL_CREATE_COLUMN.match(stripped)
+                    if column:
+                        table_columns.append(column.group(1))
+                    elif stripped.startswith(")"):
+                        in_create = False
+                    continue
 
-                if len(cleaned_data) < len(column_names):
+                insert = SQL_INSERT.match(line.lstrip())
+                if not insert:
                     continue
+                column_names = [COLUMN_RENAMES.get(name, name) for name in sql_insert_columns(insert, table_columns)]
+                in_values = True
+                buffer = insert.group(2)
 
-                # Zipping record data with key (column) names
-                row_data = dict(zip(column_names, cleaned_data))
+            rows, position, statement_end = parse_sql_tuples(buffer)
+            for values in rows:
+                yield(column_names, values)
 
-                subspecies_value = row_data.get("subspecies")
-                species_value = row_data.get("species")
+            if statement_end:
+                in_values = False
+                buffer = ""
+            else:
+                buffer = buffer[position:]
+
+# The column names of a matched INSERT statement: its column list, or the CREATE TABLE columns when it has none
+def sql_insert_columns(insert, table_columns):
+    if insert.group(1):
+        return([name.strip().strip('`"') for name in insert.group(1).split(',')])
+    return(list(table_columns))
+
+# Opening a .sql file as text, or only a byte range of it (decoded the same way as the whole file)
+def open_sql_range(sql_file, byte_range=None):
+    if byte_range is None:
+        return(open(sql_file, "r"))
+    with open(sql_file, "rb") as file:
+        file.seek(byte_range[0])
+        return(io.TextIOWrapper(io.BytesIO(file.read(byte_range[1] - byte_range[0]))))
+
+# Splitting a .sql file into byte ranges of about chunk_bytes for parallel extraction, in a single pass over its lines.
+# Ranges start at the first INSERT statement, or tuple line of a long INSERT statement (a line starting with "(" after a line
+# ending in "),"), after each chunk_bytes. Each comes with the CREATE TABLE columns in effect at its start, and for ranges starting
+# inside an INSERT statement, the column names of that INSERT.
+# Returns a list of (start, end, table_columns, insert_columns, in_values)
+def sql_chunks(sql_file, chunk_bytes=EXTRACT_CHUNK_BYTES):
+    chunks = []
+    table_columns = []
+    insert_columns = []
+    chunk_start = ([], [], False)
+    in_create = False
+    in_values = False
+    tuple_ended = False
+    start = 0
+    position = 0
+
+    with open(sql_file, "rb") as file:
+        for line in file:
+            stripped = line.strip()
+            if in_values:
+                if position - start >= chunk_bytes and tuple_ended and stripped.startswith(b"("):
+                    chunks.append((start, position, *chunk_start))
+                    start = position
+                    chunk_start = (list(table_columns), insert_columns, True)
+                in_values = not stripped.endswith(b";")
+            elif stripped[:12].lower() == b"create table":
+                in_create = True
+                table_columns = []
+            elif in_create:
+                column = SQL_CREATE_COLUMN.match(stripped.decode("utf-8", "replace"))
+                if column:
+                    table_columns.append(column.group(1))
+                elif stripped.startswith(b")"):
+                    in_create = False
+            elif SQL_INSERT_LINE.match(line):
+                if position - start >= chunk_bytes:
+                    chunks.append((start, position, *chunk_start))
+                    start = position
+                    chunk_start = (list(table_columns), [], False)
+                insert = SQL_INSERT.match(line.decode("utf-8", "replace").lstrip())
+                insert_columns = sql_insert_columns(insert, table_columns) if insert else []
+                in_values = bool(insert) and not stripped.endswith(b";")
+            tuple_ended = stripped.endswith(b"),")
+            position += len(line)
+
+    chunks.append((start, position, *chunk_start))
+    return(chunks)
+
+# Cleaning a single value from the .sql file
+def clean_sql_value(data):
+    if data is None:
+        return None
 
-                # Assigning query ranks and namees. "ssp." and "sp." are removed from query names, 
-                # however result in a querying ranks of species and genus, respectively
-                if subspecies_value:
-                    if "ssp." in subspecies_value:
-                        raw_name = subspecies_value
-                        query_name = subspecies_value.split("ssp.")[0].strip()
-                        query_rank = "species"
-                    else:
-                        raw_name = subspecies_value
-                        query_name = subspecies_value
-                        query_rank = "subspecies"
+    data = data.replace('\xa0', ' ').strip() # Removes hidden character spaces that ccan be found in SQL files
+
+    # Converting all "NULL" values or empty strings to None type
+    if data.upper() == "NULL" or data in ("''", "", "' '", '" "', " "): 
+        return None
+    elif data.startswith("'") and data.endswith("'"):
+        return data[1:-1].strip()
+    return data
+
+# The ordered keys shared by all compact records with the same keys, with the position of each key in the record values.
+# Adding or removing a key moves a record on to another shape through a cached transition, so records built the same way
+# (eg. all records of a .sql file, or all results of a match) share the same few shapes. Setting several keys at once uses a
+# cached update plan for the sequence of keys: the shape reached, and a getter picking the values of that shape out of the
+# record's values followed by the new values, so the new list of values is built in one call.
+class RecordShape:
+    __slots__ = ("keys", "index", "template", "additions", "removals", "updates")
+    shapes = {}
+    lock = threading.Lock()
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.index = {key: position for position, key in enumerate(keys)}
+        self.template = dict.fromkeys(keys)
+        self.additions = {}
+        self.removals = {}
+        self.updates = {}
+
+    @classmethod
+    def for_keys(cls, keys):
+        shape = cls.shapes.get(keys)
+        if shape is None:
+            with cls.lock:
+                shape = cls.shapes.setdefault(keys, cls(keys))
+        return(shape)
+
+    def add(self, key):
+        shape = self.additions.get(key)
+        if shape is None:
+            shape = self.additions[key] = RecordShape.for_keys(self.keys + (key,))
+        return(shape)
+
+    def remove(self, key):
+        shape = self.removals.get(key)
+        if shape is None:
+            shape = self.removals[key] = RecordShape.for_keys(tuple(shape_key for shape_key in self.keys if shape_key != key))
+        return(shape)
+
+    def update_plan(self, keys):
+        plan = self.updates.get(keys)
+        if plan is None:
+            shape = self
+            positions = list(range(len(self.keys)))
+            for value_position, key in enumerate(keys, len(self.keys)):
+                if key in shape.index:
+                    positions[shape.index[key]] = value_position
                 else:
-                    if "ssp." in species_value:
-                        raw_name = species_value
-                        query_name = species_value.split("ssp.")[0].strip()
-                        query_rank = "species"
-                    elif "sp." in species_value:
-                        raw_name = species_value
-                        query_name = species_value.split("sp.")[0].strip()
-                        query_rank = "genus"
-                    else:
-                        raw_name = species_value
-                        query_name = species_value
-                        query_rank = "species"
+                    shape = shape.add(key)
+                    positions.append(value_position)
+            if len(positions) > 1:
+                getter = itemgetter(*positions)
+            else: # itemgetter returns a single value rather than a tuple for one position
+                getter = lambda values: [values[position] for position in positions]
+            plan = self.updates[keys] = (shape, getter)
+        return(plan)
+
+# Compact record used for AGSD records and match results throughout the pipeline: a list of values and a shared shape, in place
+# of a dict repeating every key. Behaves like a dict (with keys in insertion order), and is turned into one with as_dict() where
+# a real dict is needed, eg. when saving to JSON.
+class CompactRecord(MutableMapping):
+    __slots__ = ("shape", "_values")
+
+    def __init__(self, shape, values):
+        self.shape = shape
+        self._values = values
+
+    @classmethod
+    def from_dict(cls, data):
+        return(cls(RecordShape.for_keys(tuple(data)), list(data.values())))
+
+    def __getitem__(self, key):
+        return(self._values[self.shape.index[key]])
+
+    def get(self, key, default=None):
+        position = self.shape.index.get(key)
+        return(default if position is None else self._values[position])
+
+    def __setitem__(self, key, value):
+        position = self.shape.index.get(key)
+        if position is None:
+            self.shape = self.shape.additions.get(key) or self.shape.add(key)
+            self._values.append(value)
+        else:
+            self._values[position] = value
+
+    # Setting several (key, value) pairs, moving to the shape of any new keys in one step
+    def update(self, pairs=(), **kwargs):
+        pairs = list(record_items(pairs) if isinstance(pairs, Mapping) else pairs) + list(kwargs.items())
+        self.set_values(tuple(key for key, value in pairs), [value for key, value in pairs])
+
+    # Setting the values of a sequence of keys (a list of values in the same order)
+    def set_values(self, keys, values):
+        shape, getter = self.shape.update_plan(keys)
+        self._values = list(getter(self._values + values))
+        self.shape = shape
+
+    def __delitem__(self, key):
+        position = self.shape.index[key]
+        self.shape = self.shape.remove(key)
+        del self._values[position]
+
+    def pop(self, key, *default):
+        position = self.shape.index.get(key)
+        if position is None:
+            if default:
+                return(default[0])
+            raise KeyError(key)
+        value = self._values[position]
+        del self[key]
+        return(value)
+
+    def __contains__(self, key):
+        return(key in self.shape.index)
+
+    def __iter__(self):
+        return(iter(self.shape.keys))
+
+    def __len__(self):
+        return(len(self._values))
+
+    def keys(self):
+        return(self.shape.index.keys())
+
+    def copy(self):
+        return(CompactRecord(self.shape, self._values.copy()))
+
+    # Filling in a copy of the shape's template dict, which is already sized for all keys
+    def as_dict(self):
+        data = self.shape.template.copy()
+        data.update(zip(self.shape.keys, self._values))
+        return(data)
+
+    # Pickled as the shape's keys and the values, so that records sharing a shape also share its keys when pickled together
+    def __reduce__(self):
+        return(CompactRecord.from_keys, (self.shape.keys, self._values))
+
+    @classmethod
+    def from_keys(cls, keys, values):
+        return(cls(RecordShape.for_keys(keys), values))
+
+    def __repr__(self):
+        return(f"CompactRecord({self.as_dict()!r})")
+
+# A record (compact or not) as a new dict
+def record_dict(record):
+    return(record.as_dict() if isinstance(record, CompactRecord) else dict(record))
+
+# The (key, value) pairs of a record (compact or not), without building a dict
+def record_items(record):
+    return(zip(record.shape.keys, record._values) if isinstance(record, CompactRecord) else record.items())
+
+# Setting the values of a sequence of keys on a record (compact or not)
+def set_record_values(record, keys, values):
+    if isinstance(record, CompactRecord):
+        record.set_values(keys, values)
+    else:
+        record.update(zip(keys, values))
+
+# Saving compact records as JSON objects, and any other value that is not JSON serializable as a string
+def json_default(value):
+    return(value.as_dict() if isinstance(value, CompactRecord) else str(value))
+
+# Generator yielding AGSD records from the .sql file one at a time as compact records, with their query names and ranks assigned,
+# so records can be passed downstream as the file is read. A byte range and the table and INSERT columns in effect at its start
+# (see sql_chunks) limit it to part of the file.
+def iter_AGSD_records(AGSD_sql_file, byte_range=None, table_columns=(), insert_columns=(), in_values=False):
+    last_column_names = None
+    queries = {}
+    for column_names, values in iter_sql_rows(AGSD_sql_file, byte_range, table_columns, insert_columns, in_values):
+        cleaned_data = [clean_sql_value(data) for data in values]
+
+        if len(cleaned_data) < len(column_names):
+            continue
 
-                if row_data["kingdom"] is None:
-                    row_data["kingdom"] = "Animalia"
+        # Zipping record data with key (column) names, sharing one shape between all rows of an INSERT statement
+        if column_names is not last_column_names:
+            last_column_names = column_names
+            column_positions = {key: position for position, key in enumerate(column_names)}
+            shape = RecordShape.for_keys(tuple(column_positions))
+            value_positions = list(column_positions.values())
+            interned_positions = [position for position, key in enumerate(shape.keys) if key in INTERNED_COLUMNS]
+
+        row_data = CompactRecord(shape, [cleaned_data[position] for position in value_positions])
+        for position in interned_positions:
+            if row_data._values[position]:
+                row_data._values[position] = sys.intern(row_data._values[position])
+
+        subspecies_value = row_data.get("subspecies")
+        species_value = row_data.get("species")
+
+        # Assigning query ranks and names from the canonical form of the subspecies (or species) name. Qualifiers such as
+        # "ssp.", "sp.", "cf." and "(4n)" are removed from query names, with "ssp." and "sp." names queried at species and
+        # genus rank, respectively (see AGSD_name_normalizer). Names repeat across records, so each is only normalized once.
+        raw_name = subspecies_value or species_value
+        query = queries.get((species_value, subspecies_value))
+        if query is None:
+            query = queries[(species_value, subspecies_value)] = normalize_query(species_value, subspecies_value)[:2]
+        query_name, query_rank = query
+
+        if row_data["kingdom"] is None:
+            row_data["kingdom"] = "Animalia"
+
+        row_data["query_name"] = query_name
+        row_data["query_rank"] = query_rank
+        row_data["raw_name"] = raw_name
+        yield(row_data)
+
+# Extracting the AGSD records of one byte range of the .sql file, run in the extraction worker processes. The records are
+# returned as the keys of their (few) shapes, the shape of each record and each record's values, which are much faster to
+# send back to the main process than the records themselves.
+def extract_AGSD_chunk(AGSD_sql_file, byte_range, table_columns, insert_columns=(), in_values=False):
+    records = list(iter_AGSD_records(AGSD_sql_file, byte_range, table_columns, insert_columns, in_values))
+    shape_positions = {shape: position for position, shape in enumerate(dict.fromkeys(record.shape for record in records))}
+    return([shape.keys for shape in shape_positions], [shape_positions[record.shape] for record in records], [record._values for record in records])
+
+# Rebuilding the records returned by extract_AGSD_chunk
+def chunk_records(extracted_chunk):
+    shape_keys, record_shapes, record_values = extracted_chunk
+    shapes = [RecordShape.for_keys(keys) for keys in shape_keys]
+    return([CompactRecord(shapes[shape], values) for shape, values in zip(record_shapes, record_values)])
+
+# Parallel version of iter_AGSD_records for large .sql files: byte ranges of the file are parsed in a pool of worker processes,
+# and their records are yielded in the original file order. At most two ranges per process are parsed ahead of the records
+# being used, so memory use stays bounded. Worker processes are started fresh (spawned), as the pipeline runs extraction
+# alongside other threads.
+def iter_AGSD_records_parallel(AGSD_sql_file, processes=EXTRACT_PROCESSES, chunk_bytes=EXTRACT_CHUNK_BYTES):
+    chunks = sql_chunks(AGSD_sql_file, chunk_bytes) if processes > 1 else []
+    if len(chunks) <= 1:
+        yield from iter_AGSD_records(AGSD_sql_file)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+        pending = deque()
+        for start, end, table_columns, insert_columns, in_values in chunks:
+            pending.append(executor.submit(extract_AGSD_chunk, AGSD_sql_file, (start, end), table_columns, insert_columns, in_values))
+            if len(pending) >= processes * 2:
+                yield from chunk_records(pending.popleft().result())
+        while pending:
+            yield from chunk_records(pending.popleft().result())
 
-                AGSD_records.append({
-                    **row_data,
-                    "query_name": query_name,
-                    "query_rank": query_rank,
-                    "raw_name": raw_name
-                })
+# Extracting data from the AGSD .sql file
+def AGSD_data_extract(AGSD_sql_file):
+    print("Extracting AGSD tax data...")
+    print("-"*15)
+    time.sleep(1)
+
+    AGSD_records = list(iter_AGSD_records(AGSD_sql_file))
+    return(AGSD_records)
+
+# Token-bucket rate limiter shared by the matching worker threads, used in place of a fixed sleep between calls
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Blocks until a token is available, refilling the bucket at "rate" tokens per second
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Token-bucket rate limiter with an AIMD (additive increase, multiplicative decrease) rate, shared by all API requests.
+# Each healthy response raises the rate by increase/rate, so the rate grows by about "increase" requests per second for every
+# second of healthy traffic. A throttled response multiplies the rate by "decrease" (at most once per backoff and once per
+# second, so a burst of throttled responses only counts once) and pauses all requests until its Retry-After time has passed.
+class AdaptiveRateLimiter(TokenBucket):
+    def __init__(self, rate, min_rate=MIN_REQUESTS_PER_SECOND, max_rate=MAX_REQUESTS_PER_SECOND, increase=RATE_INCREASE, decrease=RATE_DECREASE):
+        super().__init__(rate)
+        self.min_rate = min(min_rate, rate)
+        self.max_rate = max(max_rate, rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.paused_until = 0
+        self.decreased_at = 0
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                wait = self.paused_until - time.monotonic()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        super().acquire()
+
+    def success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+            self.capacity = self.rate
+
+    # Backing off after a throttled response. Responses throttled during the same backoff only extend the pause.
+    def throttled(self, retry_after):
+        with self.lock:
+            now = time.monotonic()
+            if now >= max(self.paused_until, self.decreased_at + 1):
+                self.decreased_at = now
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self.capacity = self.rate
+                self.tokens = 0
+            self.paused_until = max(self.paused_until, now + retry_after)
+
+# Seconds to wait before re-sending a throttled request: the response's Retry-After header (in seconds or as an HTTP date),
+# or an exponential backoff if there is none, at most max_wait seconds
+def retry_after_seconds(response, attempt, backoff=RETRY_BACKOFF, max_wait=MAX_THROTTLE_WAIT):
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return(min(max_wait, max(0.0, float(retry_after))))
+        except ValueError:
+            try:
+                return(min(max_wait, max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())))
+            except (TypeError, ValueError, OverflowError):
+                pass
+    return(min(max_wait, backoff * 2 ** attempt))
+
+# Persistent on-disk cache of API responses, keyed by endpoint, dataset, name and rank.
+# Entries are stored per dataset key, so a new CoL release is never served responses from an older one,
+# and entries older than the TTL are purged when the cache is opened.
+class ResponseCache:
+    def __init__(self, path=CACHE_FILE, ttl_days=CACHE_TTL_DAYS):
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+        self.pending_writes = 0
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses (endpoint TEXT, dataset TEXT, name TEXT, rank TEXT, "
+                                "response TEXT, created REAL, PRIMARY KEY (endpoint, dataset, name, rank))")
+        if ttl_days:
+            self.connection.execute("DELETE FROM responses WHERE created < ?", (time.time() - ttl_days * 86400,))
+        self.connection.commit()
+
+    # Returns the cached response, or None if the request has not been cached
+    def get(self, endpoint, dataset, name, rank=""):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response FROM responses WHERE endpoint = ? AND dataset = ? AND name = ? AND rank = ?",
+                (endpoint, str(dataset), str(name), rank)).fetchone()
+            counter = self.hits if row else self.misses
+            counter[endpoint] = counter.get(endpoint, 0) + 1
+        if row:
+            return(json.loads(row[0]))
+        return None
 
-        return(AGSD_records)
+    def set(self, endpoint, dataset, name, rank, response):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                                    (endpoint, str(dataset), str(name), rank, json.dumps(response), time.time()))
+            self.pending_writes += 1
+            if self.pending_writes >= 100:
+                self.connection.commit()
+                self.pending_writes = 0
+
+    # Removes all cached responses for a dataset key (or for a single endpoint of that dataset)
+    def invalidate(self, dataset, endpoint=None):
+        with self.lock:
+            if endpoint:
+                self.connection.execute("DELETE FROM responses WHERE dataset = ? AND endpoint = ?", (str(dataset), endpoint))
+            else:
+                self.connection.execute("DELETE FROM responses WHERE dataset = ?", (str(dataset),))
+            self.connection.commit()
+
+    # Printing cache hits and misses per endpoint for the run summary
+    def report(self):
+        print("API response cache:")
+        for endpoint in sorted(set(self.hits) | set(self.misses)):
+            hits = self.hits.get(endpoint, 0)
+            misses = self.misses.get(endpoint, 0)
+            print(f"{endpoint}: {hits} hits, {misses} misses ({(hits/(hits + misses))*100:.1f}% served from cache)")
+        print("-"*15)
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+# Append-only checkpoint journal of completed work, stored as one JSON entry per line, so an interrupted run can resume where it stopped.
+# Entries are flushed to disk every "interval" entries, and the entries written by an earlier run are loaded when the journal is opened.
+class CheckpointJournal:
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.completed = {}
+        self.unflushed = 0
+
+        needs_newline = False
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    needs_newline = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError: # Skips a partially written entry from an interrupted run
+                        continue
+                    self.completed[entry["key"]] = entry["value"]
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+        if needs_newline:
+            self.file.write("\n")
+
+    def record(self, key, value):
+        with self.lock:
+            self.completed[key] = value
+            self.file.write(json.dumps({"key": key, "value": value}, default=json_default) + "\n")
+            self.unflushed += 1
+            if self.unflushed >= self.interval:
+                self.flush()
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unflushed = 0
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.flush()
+                self.file.close()
+
+    # Deleting the journal once the run it belongs to has finished
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+# Short endpoint name of a ChecklistBank or GNV request URL, used to group request metrics
+def endpoint_name(url):
+    path = url.split("?")[0]
+    if "/match/nameusage" in path:
+        return("match/nameusage")
+    elif re.search(r"/nameusage/[^/]+/source$", path):
+        return("nameusage/source")
+    elif re.search(r"/source/[^/]+$", path):
+        return("source")
+    elif "/verifications" in path:
+        return("verifications")
+    return(path.rsplit("/", 2)[-2] + "/" + path.rsplit("/", 1)[-1])
+
+# Value at percentile "percent" of a sorted list of values (nearest rank), or None for an empty list
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    return(sorted_values[min(len(sorted_values) - 1, max(0, int(round(percent / 100 * len(sorted_values))) - 1))])
+
+# Metrics of a run, shared by the API client and pipeline threads: per-endpoint request counts, latencies, retries, errors,
+# cache and local checklist answers, and the busy time and records processed of each pipeline stage.
+class RunMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.endpoints = {}
+        self.stages = {}
+
+    def endpoint(self, endpoint):
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = {"requests": 0, "names": 0, "errors": 0, "retries": 0, "throttled": 0, "cache_hits": 0, "local": 0, "tree": 0,
+                                        "hedged": 0, "hedge_wins": 0, "latencies": []}
+        return(self.endpoints[endpoint])
+
+    # Recording a network request, its latency in seconds, the number of retries made by the connection adapter and whether it failed
+    def record_request(self, endpoint, seconds, retries=0, error=False):
+        with self.lock:
+            counts = self.endpoint(endpoint)
+            counts["requests"] += 1
+            counts["latencies"].append(seconds)
+            counts["retries"] += retries
+            counts["errors"] += int(error)
+
+    # Recording a request answered without the network, from the response cache ("cache_hits"), a local checklist ("local") or
+    # the classification tree ("tree"), a throttled response ("throttled") that was re-sent, or a hedged request answered by
+    # its duplicate ("hedge_wins"). Batched endpoints (GNV verifications) also record the names sent in each request ("names").
+    def record_answer(self, endpoint, source, count=1):
+        with self.lock:
+            self.endpoint(endpoint)[source] += count
+
+    # Latency in seconds at percentile "percent" of the last "window" requests to an endpoint, or None before it has had min_requests
+    def latency_threshold(self, endpoint, percent, window=HEDGE_WINDOW, min_requests=HEDGE_MIN_REQUESTS):
+        with self.lock:
+            latencies = self.endpoint(endpoint)["latencies"][-window:]
+        if len(latencies) < min_requests:
+            return None
+        return(percentile(sorted(latencies), percent))
+
+    # Recording a hedge if the endpoint's hedges stay within the budget (a fraction of its primary requests, ie. its requests
+    # other than the hedges themselves). Returns whether it may be sent.
+    def record_hedge(self, endpoint, budget):
+        with self.lock:
+            counts = self.endpoint(endpoint)
+            if counts["hedged"] + 1 > budget * (counts["requests"] - counts["hedged"]):
+                return False
+            counts["hedged"] += 1
+            return True
+
+    def record_stage(self, stage, seconds, records=0):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = {"seconds": 0.0, "chunks": 0, "records": 0}
+            self.stages[stage]["seconds"] += seconds
+            self.stages[stage]["chunks"] += 1
+            self.stages[stage]["records"] += records
+
+    def report(self, records=0, cache=None, summary=None):
+        duration = time.time() - self.started
+        report = {
+            "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            "duration_seconds": round(duration, 3),
+            "records": records,
+            "records_per_second": round(records / duration, 2) if duration else None,
+            "stages": {},
+            "endpoints": {}
+            }
+
+        with self.lock:
+            for stage, counts in self.stages.items():
+                report["stages"][stage] = {**counts, "seconds": round(counts["seconds"], 3),
+                                           "records_per_second": round(counts["records"] / counts["seconds"], 2) if counts["seconds"] else None}
+            if self.stages:
+                report["slowest_stage"] = max(self.stages, key=lambda stage: self.stages[stage]["seconds"])
+
+            for endpoint, counts in self.endpoints.items():
+                latencies = sorted(counts["latencies"])
+                buckets = {f"<={bound}s": sum(1 for latency in latencies if latency <= bound) for bound in LATENCY_BUCKETS}
+                buckets[f">{LATENCY_BUCKETS[-1]}s"] = sum(1 for latency in latencies if latency > LATENCY_BUCKETS[-1])
+                # The cache hit ratio of a batched endpoint is the share of names answered from the cache
+                answered = (counts["names"] or counts["requests"]) + counts["cache_hits"] + counts["local"] + counts["tree"]
+                report["endpoints"][endpoint] = {
+                    "requests": counts["requests"],
+                    "names": counts["names"],
+                    "errors": counts["errors"],
+                    "retries": counts["retries"],
+                    "throttled": counts["throttled"],
+                    "cache_hits": counts["cache_hits"],
+                    "local": counts["local"],
+                    "tree": counts["tree"],
+                    "hedged": counts["hedged"],
+                    "hedge_wins": counts["hedge_wins"],
+                    "hedge_rate": round(counts["hedged"] / (counts["requests"] - counts["hedged"]), 4) if counts["requests"] > counts["hedged"] else None,
+                    "cache_hit_ratio": round(counts["cache_hits"] / answered, 3) if answered else None,
+                    "latency_seconds": {"mean": round(sum(latencies) / len(latencies), 4) if latencies else None,
+                                        **{f"p{percent}": round(percentile(latencies, percent), 4) if latencies else None for percent in (50, 95, 99)},
+                                        "max": round(latencies[-1], 4) if latencies else None},
+                    "latency_histogram": buckets
+                    }
+
+        if cache:
+            report["cache"] = {endpoint: {"hits": cache.hits.get(endpoint, 0), "misses": cache.misses.get(endpoint, 0)}
+                               for endpoint in sorted(set(cache.hits) | set(cache.misses))}
+        if summary:
+            report["matching"] = summary
+        return(report)
+
+    # Writing the run report (with the match summary of the run, if given) to a JSON file, and printing the stage and endpoint summary
+    def write_report(self, output_file, records=0, cache=None, summary=None):
+        report = self.report(records, cache, summary)
+        with open(output_file, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+        print("Run summary:")
+        print(f"{records} records in {report['duration_seconds']}s ({report['records_per_second']} records/s)")
+        for stage, counts in report["stages"].items():
+            print(f"{stage}: {counts['seconds']}s busy, {counts['records']} records")
+        for endpoint, counts in report["endpoints"].items():
+            latency = counts["latency_seconds"]
+            print(f"{endpoint}: {counts['requests']} requests (p50 {latency['p50']}s, p95 {latency['p95']}s, p99 {latency['p99']}s), "
+                  f"{counts['retries']} retries, {counts['throttled']} throttled, {counts['errors']} errors, {counts['cache_hits']} cached, {counts['local']} local, "
+                  f"{counts['tree']} from the classification tree")
+            if counts["names"]:
+                print(f"{endpoint}: {counts['names']} names sent in {counts['requests']} requests, {counts['cache_hit_ratio']*100:.1f}% of names served from cache")
+            if counts["hedged"]:
+                print(f"{endpoint}: {counts['hedged']} hedged requests ({counts['hedge_rate']*100:.1f}% of primary requests), "
+                      f"{counts['hedge_wins']} answered by the hedge first")
+        if report["stages"]:
+            print(f"Slowest stage: {report['slowest_stage']}")
+        print(f"{output_file} saved to the current directory")
+        print("-"*15)
+
+# Live progress bar with records/s and ETA, redrawn on one terminal line. Without a total, only the count and rate are shown.
+class ProgressBar:
+    def __init__(self, total=None, width=30):
+        self.total = total
+        self.width = width
+        self.count = 0
+        self.started = time.time()
+
+    def update(self, count):
+        self.count += count
+        elapsed = time.time() - self.started
+        rate = self.count / elapsed if elapsed else 0
+        if self.total:
+            done = min(1, self.count / self.total)
+            eta = (self.total - self.count) / rate if rate else 0
+            bar = "#" * int(done * self.width)
+            line = f"[{bar:<{self.width}}] {done*100:5.1f}% {self.count}/{self.total} records, {rate:.1f} records/s, ETA {time.strftime('%H:%M:%S', time.gmtime(eta))}"
+        else:
+            line = f"{self.count} records, {rate:.1f} records/s"
+        print("\r" + line, end="", flush=True)
+
+    def close(self):
+        print()
+
+# Shared HTTP client used for all ChecklistBank and GNV requests. A single session keeps connections alive between calls,
+# with a connection pool per host, request timeouts, retries with exponential backoff on 500/502/504 responses, the shared
+# adaptive rate limiter and the (optional) persistent response cache. Throttled (429/503) requests are re-sent once the
+# Retry-After time has passed, rather than failing, until they have waited max_throttle_total_wait seconds. With a classification tree, the higher taxa of every match response are
+# added to it, and genus and family matches it can answer are not sent to the API. With hedging, requests to the hedged
+# endpoints that are slower than the endpoint's hedge percentile are sent again (within the hedge budget), and the first
+# response is used.
+class APIClient:
+    def __init__(self, username=None, password=None, cache=None, requests_per_second=REQUESTS_PER_SECOND,
+                 timeout=REQUEST_TIMEOUT, pool_sizes=POOL_SIZES, max_retries=MAX_RETRIES, retry_backoff=RETRY_BACKOFF, checklist=None, metrics=None,
+                 max_throttle_retries=MAX_THROTTLE_RETRIES, classification_tree=None, hedge=HEDGE_REQUESTS, hedge_percentile=HEDGE_PERCENTILE,
+                 hedge_budget=HEDGE_BUDGET, rate_limiter=None, max_throttle_wait=MAX_THROTTLE_WAIT, max_throttle_total_wait=MAX_THROTTLE_TOTAL_WAIT):
+        self.auth = HTTPBasicAuth(username, password) if username else None
+        self.cache = cache
+        self.checklist = checklist
+        self.classification_tree = classification_tree
+        self.metrics = metrics if metrics else RunMetrics()
+        self.rate_limiter = rate_limiter if rate_limiter else AdaptiveRateLimiter(requests_per_second)
+        self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        self.timeout = timeout
+        self.retry_backoff = retry_backoff
+        self.max_throttle_retries = max_throttle_retries
+        self.max_throttle_wait = max_throttle_wait
+        self.max_throttle_total_wait = max_throttle_total_wait
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        # Hedged requests (and their duplicates) run in their own pool, as they may be sent from the speculative query pool
+        hedge_workers = 4 * MAX_WORKERS if hedge else 0
+        self.hedge_executor = ThreadPoolExecutor(max_workers=hedge_workers) if hedge else None
+
+        # Connection pools block once all of their connections are in use, rather than opening extra connections that are closed
+        # (and not kept alive) when they are returned. The ChecklistBank pool also covers the hedge pool's requests, and hosts
+        # without a pool of their own (eg. a local mock API) get one as large as the largest pool.
+        pool_sizes = {host: pool_size + (hedge_workers if host == CHECKLISTBANK_API else 0) for host, pool_size in pool_sizes.items()}
+        retry = Retry(total=max_retries, backoff_factor=retry_backoff, status_forcelist=(500, 502, 504),
+                      allowed_methods=None, respect_retry_after_header=False, raise_on_status=False)
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=max(pool_sizes.values()), pool_block=True, max_retries=retry))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=max(pool_sizes.values()), pool_block=True, max_retries=retry))
+        for host, pool_size in pool_sizes.items():
+            self.session.mount(host, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=retry))
+
+    # Rate-limited GET request returning the decoded JSON response. ChecklistBank credentials are only sent if authenticate is set.
+    # When a cache key (endpoint, dataset, name, rank) is given, cached responses are returned without a network call.
+    # If a local checklist is set, the ChecklistBank endpoints it covers are answered from it instead of the API. Match requests
+    # not in the cache are answered from the classification tree where it can.
+    def get(self, url, cache_key=None, authenticate=False):
+        endpoint = endpoint_name(url)
+        if self.checklist and cache_key and cache_key[0] in self.checklist.endpoints:
+            self.metrics.record_answer(endpoint, "local")
+            return(self.checklist.get(*cache_key))
+
+        data = self.cached(cache_key)
+        if data is not None:
+            self.add_classification(cache_key, data)
+            return(data)
+
+        if self.classification_tree and cache_key:
+            data = self.classification_tree.get(*cache_key)
+            if data is not None:
+                self.metrics.record_answer(endpoint, "tree")
+                return(data)
+
+        data = self.request(endpoint, self.session.get, url, auth=self.auth if authenticate else None, timeout=self.timeout)
+
+        if self.cache and cache_key:
+            self.cache.set(*cache_key, data)
+        self.add_classification(cache_key, data)
+        return(data)
+
+    # Response cached for a cache key (endpoint, dataset, name, rank), recorded as a cache hit of the endpoint, or None
+    def cached(self, cache_key):
+        if not (self.cache and cache_key):
+            return None
+        data = self.cache.get(*cache_key)
+        if data is not None:
+            self.metrics.record_answer(cache_key[0], "cache_hits")
+        return(data)
+
+    # Adding the classification of a match response to the classification tree
+    def add_classification(self, cache_key, data):
+        if self.classification_tree and cache_key and cache_key[0] == "match/nameusage":
+            self.classification_tree.add(cache_key[1], data)
+
+    # Rate-limited POST request with a JSON payload, returning the decoded JSON response
+    def post(self, url, payload):
+        return(self.request(endpoint_name(url), self.session.post, url, json=payload, timeout=self.timeout))
+
+    # Sending a request, hedged if hedging is on for its endpoint
+    def request(self, endpoint, send, url, **kwargs):
+        if self.hedge_executor and endpoint in HEDGED_ENDPOINTS:
+            return(self.hedged_request(endpoint, send, url, **kwargs))
+        return(self.timed_request(endpoint, send, url, **kwargs))
+
+    # Sending a request, and a duplicate of it if no response has come back within the endpoint's hedge percentile latency.
+    # The latency is timed from when the request is sent (once the rate limiter lets it through), as the recorded latencies are.
+    # The first successful response is returned (the other request is left to finish), or the error of the first request if
+    # both fail.
+    def hedged_request(self, endpoint, send, url, **kwargs):
+        first_sent = threading.Event()
+        first = self.hedge_executor.submit(self.timed_request, endpoint, send, url, sent=first_sent, **kwargs)
+        first.add_done_callback(lambda future: first_sent.set())
+        threshold = self.metrics.latency_threshold(endpoint, self.hedge_percentile)
+        if threshold is None:
+            return(first.result())
+        first_sent.wait()
+        done, pending = wait([first], timeout=threshold)
+        if done or not self.metrics.record_hedge(endpoint, self.hedge_budget):
+            return(first.result())
+
+        hedge = self.hedge_executor.submit(self.timed_request, endpoint, send, url, **kwargs)
+        pending = {first, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in (first, hedge):
+                if future in done and future.exception() is None:
+                    if future is hedge:
+                        self.metrics.record_answer(endpoint, "hedge_wins")
+                    return(future.result())
+        return(first.result())
+
+    # Sending a rate-limited request and recording its latency, the retries made by the connection adapter and any failure in the
+    # run metrics. Throttled responses slow down the rate limiter and the request is sent again after the Retry-After time,
+    # unless that would take its throttling waits past max_throttle_total_wait seconds, when it fails as the last attempt does.
+    # The "sent" event (if given) is set once the request is first let through by the rate limiter.
+    def timed_request(self, endpoint, send, url, sent=None, **kwargs):
+        throttle_wait = 0
+        for attempt in range(self.max_throttle_retries + 1):
+            self.rate_limiter.acquire()
+            if sent:
+                sent.set()
+            start = time.perf_counter()
+            retries = 0
+            try:
+                r = send(url, **kwargs)
+                retry_state = getattr(getattr(r, "raw", None), "retries", None)
+                retries = len(retry_state.history) if retry_state else 0
+                if r.status_code in (429, 503) and attempt < self.max_throttle_retries:
+                    retry_after = retry_after_seconds(r, attempt, self.retry_backoff, self.max_throttle_wait)
+                    if throttle_wait + retry_after <= self.max_throttle_total_wait:
+                        throttle_wait += retry_after
+                        self.rate_limiter.throttled(retry_after)
+                        self.metrics.record_answer(endpoint, "throttled")
+                        continue
+                r.raise_for_status()
+                data = r.json()
+            except Exception:
+                self.metrics.record_request(endpoint, time.perf_counter() - start, retries, error=True)
+                raise
+            self.rate_limiter.success()
+            self.metrics.record_request(endpoint, time.perf_counter() - start, retries)
+            return(data)
+
+    # Running a request in the background (eg. a speculative query), returning its future
+    def submit(self, function, *args):
+        return(self.executor.submit(function, *args))
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.hedge_executor:
+            self.hedge_executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+# Column names used for each name usage field in ColDP (NameUsage.tsv) and Darwin Core (Taxon.tsv) archives, without their
+# "col:"/"dwc:" prefixes
+CHECKLIST_COLUMNS = {
+    "id": ("ID", "taxonID"),
+    "parent_id": ("parentID", "parentNameUsageID"),
+    "accepted_id": ("acceptedNameUsageID",),
+    "status": ("status", "taxonomicStatus"),
+    "rank": ("rank", "taxonRank"),
+    "name": ("scientificName",),
+    "authorship": ("authorship", "scientificNameAuthorship"),
+    "source_key": ("sourceID", "datasetID")
+    }
+ACCEPTED_STATUSES = ("accepted", "provisionally accepted")
+
+# Offline copy of a ChecklistBank dataset, loaded from a downloaded ColDP or Darwin Core archive (zip file or extracted folder)
+# into an indexed SQLite file kept next to the archive. Answers the match/nameusage, nameusage/source and source requests
+# with the same response shape as the ChecklistBank API, so runs need no network access for ChecklistBank matching.
+class LocalChecklist:
+    endpoints = ("match/nameusage", "nameusage/source", "source")
+
+    def __init__(self, archive, index_file=None, max_edit_distance=FUZZY_MAX_EDIT_DISTANCE):
+        self.archive = archive.rstrip("/\\")
+        self.index_file = index_file if index_file else f"{os.path.splitext(self.archive)[0]}_index.sqlite"
+        self.lock = threading.Lock()
+        self.fuzzy_index = FuzzyNameIndex(self, max_edit_distance)
+
+        archive_version = self.archive_version()
+        self.connection = sqlite3.connect(self.index_file, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'archive_version'").fetchone()
+        if not row or row[0] != archive_version:
+            self.build_index(archive_version)
+
+    # Version of the archive the index is built from: the size and modification time of a zip file or, for an extracted folder,
+    # a hash of the path, size and modification time of each file in it (the folder's own size and modification time do not
+    # change when a file in it is replaced with a new release)
+    def archive_version(self):
+        if not os.path.isdir(self.archive):
+            return(f"{os.path.getsize(self.archive)}:{os.path.getmtime(self.archive)}")
+
+        index_path = os.path.abspath(self.index_file)
+        version = hashlib.sha256()
+        for member in sorted(self.archive_members(None)):
+            path = os.path.join(self.archive, member)
+            if os.path.abspath(path).startswith(index_path): # An index (and its journal) kept inside the folder
+                continue
+            version.update(f"{member}:{os.path.getsize(path)}:{os.path.getmtime(path)}\n".encode("utf-8"))
+        return(version.hexdigest())
+
+    # Paths of the files in the archive (zip file or folder), relative to the archive root
+    def archive_members(self, archive_zip):
+        if archive_zip:
+            return([member for member in archive_zip.namelist() if not member.endswith("/")])
+        return([os.path.relpath(os.path.join(root, file_name), self.archive).replace("\\", "/")
+                for root, folders, files in os.walk(self.archive) for file_name in files])
+
+    def open_member(self, archive_zip, member):
+        if archive_zip:
+            return(io.TextIOWrapper(archive_zip.open(member), encoding="utf-8", newline=""))
+        return(open(os.path.join(self.archive, member), "r", encoding="utf-8", newline=""))
+
+    def build_index(self, archive_version):
+        print(f"Indexing checklist archive {self.archive}...")
+        print(f"Start time {time.strftime('%H:%M:%S')}")
+
+        self.connection.execute("DROP TABLE IF EXISTS usages")
+        self.connection.execute("DROP TABLE IF EXISTS sources")
+        self.connection.execute("CREATE TABLE usages (id TEXT PRIMARY KEY, parent_id TEXT, status TEXT, rank TEXT, name TEXT, "
+                                "name_key TEXT, authorship TEXT, source_key TEXT)")
+        self.connection.execute("CREATE TABLE sources (key TEXT PRIMARY KEY, title TEXT)")
+
+        archive_zip = zipfile.ZipFile(self.archive) if zipfile.is_zipfile(self.archive) else None
+        members = self.archive_members(archive_zip)
+        usage_files = ([member for member in members if os.path.basename(member).lower().startswith("nameusage.")] or
+                       [member for member in members if os.path.basename(member).lower().startswith("taxon.")])
+        if not usage_files:
+            raise ValueError(f"No NameUsage or Taxon file found in {self.archive}")
+
+        count = 0
+        with self.open_member(archive_zip, usage_files[0]) as file:
+            reader = csv.reader(file, delimiter="\t", quoting=csv.QUOTE_NONE)
+            header = [column.split(":")[-1] for column in next(reader)]
+            positions = {field: next((header.index(column) for column in columns if column in header), None)
+                         for field, columns in CHECKLIST_COLUMNS.items()}
+            if positions["id"] is None or positions["name"] is None:
+                raise ValueError(f"{usage_files[0]} has no ID or scientificName column")
+
+            batch = []
+            for row in reader:
+                values = {field: (row[position] or None) if position is not None and position < len(row) else None
+                          for field, position in positions.items()}
+                if not values["id"] or not values["name"]:
+                    continue
+                status = (values["status"] or "accepted").lower()
+                # Synonyms point to their accepted name through the parent ID in ColDP, and the accepted name usage ID in Darwin Core
+                parent_id = values["accepted_id"] if values["accepted_id"] and status not in ACCEPTED_STATUSES else values["parent_id"]
+                batch.append((values["id"], parent_id, status, (values["rank"] or "").lower(), values["name"],
+                              name_key(values["name"]), values["authorship"], values["source_key"]))
+
+                count += 1
+                if len(batch) >= 10000:
+                    self.connection.executemany("INSERT OR REPLACE INTO usages VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+                    batch = []
+                if count % 500000 == 0:
+                    print(f"{count} name usages indexed")
+            self.connection.executemany("INSERT OR REPLACE INTO usages VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+
+        # Source dataset titles, from the source/<key>.yaml metadata files of CoL releases
+        for member in members:
+            key, extension = os.path.splitext(os.path.basename(member))
+            if member.lower().startswith("source/") and extension.lower() in (".yaml", ".yml"):
+                with self.open_member(archive_zip, member) as file:
+                    title = re.search(r"^title:\s*(.+?)\s*$", file.read(), re.MULTILINE)
+                if title:
+                    self.connection.execute("INSERT OR REPLACE INTO sources VALUES (?, ?)", (key, title.group(1).strip("'\"")))
+        if archive_zip:
+            archive_zip.close()
+
+        self.connection.execute("CREATE INDEX usages_name ON usages (name_key, rank)")
+        self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('archive_version', ?)", (archive_version,))
+        self.connection.commit()
+
+        print(f"Finished {time.strftime('%H:%M:%S')}")
+        print(f"{count} name usages indexed to {self.index_file}")
+        print("-"*15)
+
+    # Answers a ChecklistBank request from the local checklist. Takes the same (endpoint, dataset, name, rank) key as the
+    # response cache; the dataset is the one the archive was downloaded from.
+    def get(self, endpoint, dataset, name, rank=""):
+        with self.lock:
+            if endpoint == "match/nameusage":
+                return(self.match(name, rank))
+            elif endpoint == "nameusage/source":
+                row = self.connection.execute("SELECT source_key FROM usages WHERE id = ?", (str(name),)).fetchone()
+                return({"sourceDatasetKey": row[0]} if row and row[0] else {})
+            elif endpoint == "source":
+                row = self.connection.execute("SELECT title FROM sources WHERE key = ?", (str(name),)).fetchone()
+                return({"key": name, "title": row[0] if row else None})
+
+    def match(self, name, rank):
+        # Trinomials queried at species rank are flagged for a re-query at subspecies rank, as ChecklistBank does
+        if rank == "species" and len(name.split()) > 2:
+            return({"match": False, "issues": {"issues": ["subspecies assigned"]}})
+
+        usages = self.connection.execute("SELECT id, parent_id, status, rank, name, authorship FROM usages WHERE name_key = ? AND rank = ?",
+                                         (name_key(name), rank)).fetchall()
+        if not usages:
+            return({"match": False, "issues": {}})
+
+        # Accepted names are preferred over synonyms. Several accepted names, or synonyms of different accepted names, are ambiguous.
+        candidates = [usage for usage in usages if usage[2] in ACCEPTED_STATUSES] or usages
+        if len(candidates) > 1 and len(set(usage[0] if usage[2] in ACCEPTED_STATUSES else usage[1] for usage in candidates)) > 1:
+            match_type = "ambiguous"
+        else:
+            match_type = "exact"
+        usage_id, parent_id, status, usage_rank, usage_name, authorship = candidates[0]
+
+        # Classification from the accepted name up to the root
+        classification = self.lineage(usage_id if status in ACCEPTED_STATUSES else parent_id)
+
+        return({
+            "match": True,
+            "issues": {},
+            "usage": {
+                "id": usage_id,
+                "name": usage_name,
+                "authorship": authorship,
+                "rank": usage_rank,
+                "status": status,
+                "namesIndexMatchType": match_type,
+                "namesIndexId": None,
+                "classification": [{"id": tax_id, "name": tax_name, "rank": tax_rank} for tax_id, tax_name, tax_rank in classification]
+                }
+            })
+
+    # The (id, name, rank) of a name usage and its parents, from the usage up to the root
+    def lineage(self, usage_id):
+        return(self.connection.execute(
+            "WITH RECURSIVE lineage(id, parent_id, name, rank, depth) AS ("
+            "SELECT id, parent_id, name, rank, 0 FROM usages WHERE id = ? "
+            "UNION ALL SELECT usages.id, usages.parent_id, usages.name, usages.rank, lineage.depth + 1 FROM usages "
+            "JOIN lineage ON usages.id = lineage.parent_id WHERE lineage.depth < 100) "
+            "SELECT id, name, rank FROM lineage ORDER BY depth",
+            (usage_id,)).fetchall())
+
+    # Local fuzzy match of a name against the checklist, returning a GNV-style name result or None (see FuzzyNameIndex)
+    def verify(self, name):
+        with self.lock:
+            return(self.fuzzy_index.verify(name))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+# In-memory tree of the higher taxa seen in the classifications of ChecklistBank match responses, per dataset. Each node keeps its
+# id, rank, name, parent and status, so genus and family queries for names already seen in a classification are answered locally,
+# with their classification up to the root, in the match/nameusage response shape (as the local checklist answers them). Only
+# names with a single node of the queried rank are answered, so queries that might be ambiguous still go to the API.
+class ClassificationTree:
+    ranks = ("genus", "family")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nodes = {}
+        self.names = {}
+
+    # Adding the classification of a match/nameusage response, from the matched name up to the root
+    def add(self, dataset, data):
+        classification = (data or {}).get("usage", {}).get("classification") or []
+        with self.lock:
+            for position, group in enumerate(classification):
+                node_key = (dataset, group.get("id"))
+                if node_key[1] is None or node_key in self.nodes:
+                    break # The rest of the classification is already in the tree (or cannot be linked to it)
+                parent_id = classification[position + 1]["id"] if position + 1 < len(classification) else None
+                self.nodes[node_key] = (group["name"], group["rank"], parent_id, group.get("status", "accepted"), group.get("authorship"))
+                self.names.setdefault((dataset, name_key(group["name"]), group["rank"]), set()).add(group["id"])
+
+    # Answers a match/nameusage request from the tree, or returns None if it cannot be answered locally
+    def get(self, endpoint, dataset, name, rank=""):
+        if endpoint != "match/nameusage" or rank not in self.ranks:
+            return None
+        with self.lock:
+            node_ids = self.names.get((dataset, name_key(name), rank))
+            if not node_ids or len(node_ids) > 1:
+                return None
+            node_id = next(iter(node_ids))
+            tax_name, tax_rank, parent_id, status, authorship = self.nodes[(dataset, node_id)]
+
+            classification = []
+            lineage_id = node_id
+            while lineage_id is not None and (dataset, lineage_id) in self.nodes:
+                lineage_name, lineage_rank, lineage_parent_id = self.nodes[(dataset, lineage_id)][:3]
+                classification.append({"id": lineage_id, "name": lineage_name, "rank": lineage_rank})
+                lineage_id = lineage_parent_id
+
+        return({
+            "match": True,
+            "issues": {},
+            "usage": {
+                "id": node_id,
+                "name": tax_name,
+                "authorship": authorship,
+                "rank": tax_rank,
+                "status": status,
+                "namesIndexMatchType": "exact",
+                "namesIndexId": None,
+                "classification": classification
+                }
+            })
+
+# Levenshtein edit distance between two strings, or max_distance + 1 once the distance is known to be larger than max_distance
+def edit_distance(a, b, max_distance):
+    if abs(len(a) - len(b)) > max_distance:
+        return(max_distance + 1)
+
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return(max_distance + 1)
+        previous = current
+    return(previous[-1])
+
+# Fuzzy matcher over the names of a LocalChecklist, used to correct misspelled names locally instead of sending them to GNV.
+# Names are split into partitions (epithets by genus, and uninomials by first letter), each with a deletion index built the
+# first time the partition is searched: every string is stored under all variants with up to max_edit_distance characters
+# deleted, so candidates are found by looking up the deletion variants of the query and confirmed by their edit distance.
+class FuzzyNameIndex:
+    def __init__(self, checklist, max_edit_distance=FUZZY_MAX_EDIT_DISTANCE):
+        self.checklist = checklist
+        self.max_edit_distance = max_edit_distance
+        self.partitions = {}
+
+    def deletions(self, string, max_edit_distance):
+        variants = {string}
+        for distance in range(max_edit_distance):
+            variants |= {variant[:i] + variant[i + 1:] for variant in variants for i in range(len(variant))}
+        return(variants)
+
+    # Loading a partition: uninomials starting with a letter ("uninomial", letter), or the epithets of a genus ("genus", genus)
+    def partition(self, partition_key):
+        if partition_key not in self.partitions:
+            kind, prefix = partition_key
+            if kind == "uninomial":
+                rows = self.checklist.connection.execute("SELECT DISTINCT name_key FROM usages WHERE name_key >= ? AND name_key < ? "
+                                                         "AND instr(name_key, ' ') = 0", (prefix, prefix + "\uffff")).fetchall()
+                strings = [row[0] for row in rows]
+            else:
+                rows = self.checklist.connection.execute("SELECT DISTINCT name_key FROM usages WHERE name_key > ? AND name_key < ?",
+                                                         (prefix + " ", prefix + "!")).fetchall()
+                strings = [row[0][len(prefix) + 1:] for row in rows]
+
+            index = {}
+            for string in strings:
+                for variant in self.deletions(string, self.max_edit_distance):
+                    index.setdefault(variant, []).append(string)
+            self.partitions[partition_key] = index
+        return(self.partitions[partition_key])
+
+    # Strings in a partition within max_edit_distance of the query, as {string: edit distance}
+    def search(self, partition_key, query, max_edit_distance):
+        index = self.partition(partition_key)
+        candidates = {}
+        for variant in self.deletions(query, max_edit_distance):
+            for string in index.get(variant, ()):
+                if string not in candidates:
+                    candidates[string] = edit_distance(query, string, max_edit_distance)
+        return({string: distance for string, distance in candidates.items() if distance <= max_edit_distance})
+
+    # Finding the closest checklist name, with a misspelled genus corrected before its epithets are searched. Returns a name
+    # result in the shape GNV returns, or None if there is no candidate or several names are equally close.
+    def verify(self, name):
+        words = name_key(name).split(" ")
+        if not words[0]:
+            return None
+
+        matches = self.search(("uninomial", words[0][0]), words[0], self.max_edit_distance)
+        if len(words) > 1:
+            epithets = " ".join(words[1:])
+            genus_matches = matches
+            matches = {}
+            for genus, genus_distance in genus_matches.items():
+                for epithet, epithet_distance in self.search(("genus", genus), epithets, self.max_edit_distance - genus_distance).items():
+                    matches[f"{genus} {epithet}"] = genus_distance + epithet_distance
+
+        if not matches:
+            return None
+        best_distance = min(matches.values())
+        best_names = [name_key for name_key, distance in matches.items() if distance == best_distance]
+        if len(best_names) > 1:
+            return None
+
+        # Accepted name usages are preferred, and the classification ranks run from the root to the matched name, as in GNV results
+        usages = self.checklist.connection.execute("SELECT id, name, status FROM usages WHERE name_key = ?", (best_names[0],)).fetchall()
+        usage_id, usage_name, status = sorted(usages, key=lambda usage: usage[2] not in ACCEPTED_STATUSES)[0]
+        classification_ranks = "|".join(tax_rank for tax_id, tax_name, tax_rank in reversed(self.checklist.lineage(usage_id)))
+
+        return({
+            "name": name,
+            "matchType": "Exact" if best_distance == 0 else "Fuzzy",
+            "bestResult": {
+                "matchedCanonicalFull": usage_name,
+                "editDistance": best_distance,
+                "classificationRanks": classification_ranks
+                }
+            })
 
 # Matching names using the CheckListBank and Global Names Verifier (GNV) APIs, and CoL25 as the reference dataset
-def tax_namematch(dataset, AGSD_records, list_name):
+# When called repeatedly on chunks of records (see run_pipeline), a shared known_queries dict carries resolved queries over
+# between calls, so names seen in an earlier chunk are not queried again, and report=False leaves out the per-call summary.
+def tax_namematch(dataset, AGSD_records, list_name, client, workers=MAX_WORKERS, GNV_batch_size=GNV_BATCH_SIZE, checkpoint=None,
+                  known_queries=None, report=True, stats=None):
 
     record_tot = len(AGSD_records)
 
@@ -126,250 +1463,391 @@ def tax_namematch(dataset, AGSD_records, list_name):
     all_match_issues = []
     all_errors = []
     tax_classification_list = {}
-    match_tax_cache = {}
-    unmatch_tax_cache = {}
 
-    print(f"Checking {list_name} names against dataset {dataset}...")
-    print(f"Start time {time.strftime('%H:%M:%S')}")
+    if report:
+        print(f"Checking {list_name} names against dataset {dataset}...")
+        print(f"Start time {time.strftime('%H:%M:%S')}")
 
     total_count = 0
-    GNV_count = 0  
+    GNV_count = 0
+    known_queries = known_queries if known_queries is not None else {}
+
+    # Records already resolved by an earlier, interrupted run are taken from the checkpoint journal
+    resumed = {}
+    if checkpoint:
+        resumed = {str(record.get("id")): checkpoint.completed[str(record.get("id"))] for record in AGSD_records if str(record.get("id")) in checkpoint.completed}
+    if resumed and report:
+        print(f"Resuming from checkpoint {checkpoint.path}: {len(resumed)} records already resolved")
+
+    # Grouping records by normalized query, so that each unique name and rank is only resolved once
+    unique_queries = {}
+    query_records = {}
     for record in AGSD_records:
-        
-        id = record.get("id")
-        raw_name = record.get("raw_name")
-        query_name = record.get("query_name")
-        query_rank = record.get("query_rank")
+        if str(record.get("id")) in resumed:
+            continue
+        key = query_key(record.get("query_name"), record.get("query_rank"))
+        if key not in unique_queries:
+            unique_queries[key] = (record.get("query_name"), record.get("query_rank"))
+            query_records[key] = []
+        query_records[key].append(record)
+
+    unique_tot = len(unique_queries)
+    pending_tot = sum(len(records) for records in query_records.values())
+    if pending_tot and report:
+        print(f"{unique_tot} unique names for {pending_tot} records ({pending_tot - unique_tot} duplicate queries skipped, unique/total ratio {unique_tot/pending_tot:.2f})")
+
+    # Queries resolved by an earlier call are re-used
+    resolved_queries = {}
+    for key in unique_queries:
+        if key in known_queries:
+            resolved_queries[key] = known_queries[key]
+            if checkpoint:
+                checkpoint_query(checkpoint, query_records[key], known_queries[key])
+    new_queries = [key for key in unique_queries if key not in resolved_queries]
+
+    # Callers matching records over several calls (eg. the chunks of the pipeline) keep run totals of the records matched and
+    # the queries sent for them in a stats dictionary
+    if stats is not None:
+        stats["records"] = stats.get("records", 0) + pending_tot
+        stats["unique_queries"] = stats.get("unique_queries", 0) + len(new_queries)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        # Unique queries are matched against ChecklistBank concurrently, with executor.map returning the results in order of first appearance
+        query_results = executor.map(lambda key: resolve_query(dataset, unique_queries[key][0], unique_queries[key][1], client), new_queries)
+
+        for count, (key, query_result) in enumerate(zip(new_queries, query_results), 1):
+            resolved_queries[key] = query_result
+            if checkpoint and query_result[0] == "match":
+                checkpoint_query(checkpoint, query_records[key], query_result)
+            if count % 100 == 0 and report:
+                print(f"{count}/{len(new_queries)} unique names resolved")
+
+        # Names not matched by ChecklistBank are verified with GNV in batches, and re-queried using any GNV corrected names
+        unverified_keys = [key for key, query_result in resolved_queries.items() if query_result[0] == "unverified"]
+        GNV_queries = [(unique_queries[key][0], resolved_queries[key][1]["query_rank"]) for key in unverified_keys]
+        GNV_results = global_names_batch_verifier(GNV_queries, client, GNV_batch_size)
+
+        query_results = executor.map(lambda key: resolve_unverified_query(dataset, unique_queries[key][0], resolved_queries[key], GNV_results, client), unverified_keys)
+        for key, query_result in zip(unverified_keys, query_results):
+            resolved_queries[key] = query_result
+            if checkpoint:
+                checkpoint_query(checkpoint, query_records[key], query_result)
+
+    if checkpoint:
+        checkpoint.flush()
+    known_queries.update(resolved_queries)
+
+    classifications = [query_result[3] for query_result in resolved_queries.values()]
+    classifications += [entry["classification"] for entry in resumed.values()]
+    for classification in classifications:
+        for tax_name, tax_rank in classification:
+            if tax_name not in tax_classification_list:
+                tax_classification_list[tax_name] = []
+            if tax_rank not in tax_classification_list[tax_name]:
+                tax_classification_list[tax_name].append(tax_rank)
+
+    # Fanning the resolved queries back out to every record, in the original record order
+    for record in AGSD_records:
+        if str(record.get("id")) in resumed:
+            entry = resumed[str(record.get("id"))]
+            category, results, errors, GNV_corrected = entry["category"], entry["results"], [], entry["GNV_corrected"]
+        else:
+            category, results, errors, classification, GNV_corrected = resolved_queries[query_key(record.get("query_name"), record.get("query_rank"))]
+            if category:
+                results = record_result(record, category, results)
 
-        # Result caching temporarily deactived
-        '''cache_key = f"{query_name}_{query_rank}"
+        for error in errors:
+            all_errors.append({**error, "id": record.get("id"), "raw_name": record.get("raw_name")})
 
-        if cache_key in match_tax_cache:
-            results = match_tax_cache[cache_key].copy()
-            results["id"] = id
+        if category == "match":
             all_matches.append(results)
-            if total_count % 100 == 0 and total_count != 0:
-                print(f"{total_count}/{record_tot} records processed")
-            total_count += 1
-            cache_lookup_count += 1
-            continue
-
-        if cache_key in unmatch_tax_cache:
-            results = unmatch_tax_cache[cache_key].copy()
-            results["id"] = id
+        elif category == "unmatch":
             all_unmatches.append(results)
-            if total_count % 100 == 0 and total_count != 0:
-                print(f"{total_count}/{record_tot} records processed")
-            total_count += 1
-            cache_lookup_count += 1
-            continue'''
-
-        formatted_name = query_name.replace(" ", "%20")
-        url = f"https://api.checklistbank.org/dataset/{dataset}/match/nameusage?scientificName={formatted_name}&rank={query_rank}"
-      
-        # Querying ChecklistBank
-        try:
-            r = requests.get(url, auth=HTTPBasicAuth(username, password))
-            r.raise_for_status()
-            data = r.json()
-
-            # Re-querying with rank changed to "subspecies" if ChecklistBank has flagged a match as such
-            if data and len(data.get("issues")) > 0:
-                if 'subspecies assigned' in data.get("issues").get("issues"):
-                    query_rank = "subspecies_adjusted"
-                    url = f"https://api.checklistbank.org/dataset/{dataset}/match/nameusage?scientificName={formatted_name}&rank=subspecies"
-
-                    try:
-                        r = requests.get(url, auth=HTTPBasicAuth(username, password))
-                        r.raise_for_status()
-                        data = r.json()
-
-                    except Exception as e:
-                        print(f"Error processing name {raw_name}: {e}")
-                        all_errors.append({
-                        "raw_name": raw_name,
-                        "query_name": query_name,
-                        "query_rank": query_rank,
-                        "error": e
-                        })
-
-            # Adding all successfull match data (metadata + taxonomic) to a results list
-            if data and data.get("match") == True and not data.get("issues"):
-                results = {
-                "id": id,
-                "raw_name": raw_name,
-                "query_name": query_name,
-                "query_rank": query_rank,
-                "match_id": data.get("usage", {}).get("id"),
-                "match_type": data.get("usage", {}).get("namesIndexMatchType"),
-                "status": data.get("usage", {}).get("status"),
-                "match_rank": data.get("usage", {}).get("rank"),
-                "name_authorship": data.get("usage", {}).get("authorship"),
-                "nidx": data.get("usage", {}).get("namesIndexId"),
-                "issues": data.get("issues")
-                }
-
-                classification = data.get("usage", {}).get("classification", [])
-                for group in classification:
-                    tax_rank = group["rank"]
-                    tax_name = group["name"]
-                    tax_id = group["id"]
-
-                    if tax_name not in tax_classification_list:
-                        tax_classification_list[tax_name] = []
-                    if tax_rank not in tax_classification_list[tax_name]:
-                        tax_classification_list[tax_name].append(tax_rank)
-
-                    results[tax_rank] = tax_name
-                    results[f"{tax_rank}_COL_code"] = tax_id
-
-                    if tax_rank == "kingdom":
-                        break
-                
-                all_matches.append(results)
-                match_tax_cache[f"{query_name}_{query_rank}"] = results
-                
-            # Querying GNV using unmatched names
-            else:
-                GNV_match_name, GNV_edit_distance, call_error = global_names_verifier(raw_name, query_rank, query_name, formatted_name)
-              
-                if len(call_error) > 0:
-                    all_errors.append(call_error)
-
-                # If GNV finds no match, add to unmatched list
-                elif GNV_match_name is None and GNV_edit_distance is None:
-                    results = {**record, "issues": data.get("issues")}
-                    all_unmatches.append(results)
-                    unmatch_tax_cache[f"{query_name}_{query_rank}"] = results
-
-                # If GNV does find a match, re-query the ChecklistBank API using that matched name
-                else:
-                    formatted_name = GNV_match_name.replace(" ", "%20")
-                    url = f"https://api.checklistbank.org/dataset/{dataset}/match/nameusage?scientificName={formatted_name}&rank={query_rank}"
+        elif category == "match_issue":
+            all_match_issues.append(results)
 
-                    try:
-                        r = requests.get(url, auth=HTTPBasicAuth(username, password))
-                        r.raise_for_status()
-                        data = r.json()
-
-                        if data and data.get("match") == True:
-                            results = {
-                            "id": id,
-                            "raw_name": raw_name,
-                            "query_name": query_name,
-                            "query_rank": query_rank,
-                            "match_id": data.get("usage", {}).get("id"),
-                            "match_type": data.get("usage", {}).get("namesIndexMatchType"),
-                            "status": data.get("usage", {}).get("status"),
-                            "match_rank": data.get("usage", {}).get("rank"),
-                            "scientific_name": data.get("usage", {}).get("name"),
-                            "name_authorship": data.get("usage", {}).get("authorship"),
-                            "nidx": data.get("usage", {}).get("namesIndexId"),
-                            "issues": data.get("issues"),
-                            "GNV_required": "True",
-                            "GNV_edit_distance": GNV_edit_distance
-                            }
-
-                            classification = data.get("usage", {}).get("classification", [])
-                            for group in classification:
-                                tax_rank = group["rank"]
-                                tax_name = group["name"]
-                                tax_id = group["id"]
-
-                                if tax_name not in tax_classification_list:
-                                    tax_classification_list[tax_name] = []
-                                if tax_rank not in tax_classification_list[tax_name]:
-                                    tax_classification_list[tax_name].append(tax_rank)
-
-                                results[tax_rank] = tax_name
-                                results[f"{tax_rank}_COL_code"] = tax_id
-
-                                if tax_rank == "kingdom":
-                                    break
-                            
-                            if len(results["issues"]) > 0:
-                                all_match_issues.append(results)
-                            else:
-                                all_matches.append(results)
-                                match_tax_cache[f"{query_name}_{query_rank}"] = results
-                                GNV_count += 1
-
-                        else:
-                            results = {**record, "issues": data.get("issues")}
-                            all_unmatches.append(results)
-                            unmatch_tax_cache[f"{query_name}_{query_rank}"] = results
-
-                    except Exception as e:
-                        print(f"Error processing GNV corrected name {raw_name}: {e}")
-                        all_errors.append({
-                            "raw_name": raw_name,
-                            "query_name": query_name,
-                            "query_rank": query_rank,
-                            "error": e
-                            })
-                        
-        except Exception as e:
-                    print(f"Error processing name {raw_name}: {e}")
-                    all_errors.append({
-                        "raw_name": raw_name,
-                        "query_name": query_name,
-                        "query_rank": query_rank,
-                        "error": e
-                        })
-
-        # Small time sleep to prevent overwhelming API calls
-        time.sleep(0.1)
-        if total_count % 100 == 0 and total_count != 0:
-            print(f"{total_count}/{record_tot} records processed")
+        if GNV_corrected:
+            GNV_count += 1
         total_count += 1
 
+    if not report:
+        return(all_matches, all_unmatches, all_match_issues, all_errors, tax_classification_list)
+
     print(f"Finished {time.strftime('%H:%M:%S')}")
-    print(f"{len(all_matches)} records matched ({(len(all_matches)/total_count)*100}%)")
-    print(f"{len(all_unmatches)} records unmatched ({(len(all_unmatches)/total_count)*100}%)")
-    print(f"{len(all_match_issues)} record match issues ({(len(all_match_issues)/total_count)*100}%)")
-    print(f"{len(all_errors)} record matches failed due to error ({(len(all_errors)/total_count)*100}%)")
-    print(f"{GNV_count} ({(GNV_count/record_tot)*100}%) names corrected with GNverifier")
+    if total_count: # An incremental run can leave no records to match
+        print(f"{len(all_matches)} records matched ({(len(all_matches)/total_count)*100}%)")
+        print(f"{len(all_unmatches)} records unmatched ({(len(all_unmatches)/total_count)*100}%)")
+        print(f"{len(all_match_issues)} record match issues ({(len(all_match_issues)/total_count)*100}%)")
+        print(f"{len(all_errors)} record matches failed due to error ({(len(all_errors)/total_count)*100}%)")
+        print(f"{GNV_count} ({(GNV_count/record_tot)*100}%) names corrected with GNverifier")
 
     print("-"*15)
     
     return(all_matches, all_unmatches, all_match_issues, all_errors, tax_classification_list)
 
-# Function used for GNV API calls
-def global_names_verifier(raw_name, query_rank, query_name, formatted_name):
-   
-        url = f"https://verifier.globalnames.org/api/v1/verifications/{formatted_name}?data_sources=1&all_matches=false&capitalize=True&species_group=false&fuzzy_uninomial=false&stats=false&main_taxon_threshold=0.5"
-        call_error = []
 
-        # Querying GNV
+# Writing the per-record results of a resolved query to the checkpoint journal, keyed by record id.
+# Queries that failed with an error are left out, so that they are retried when the run is resumed.
+def checkpoint_query(checkpoint, records, query_result):
+    category, results, errors, classification, GNV_corrected = query_result
+    if category is None or category == "unverified" or len(errors) > 0:
+        return
+
+    for record in records:
+        checkpoint.record(str(record.get("id")), {
+            "category": category,
+            "results": record_result(record, category, results),
+            "classification": classification,
+            "GNV_corrected": GNV_corrected
+            })
+
+# Copying a resolved query result for an individual record. Unmatched records keep their full AGSD data.
+def record_result(record, category, results):
+    if category == "unmatch":
+        record = record.copy()
+        record["issues"] = results["issues"]
+        return(record)
+
+    results = results.copy()
+    results["id"] = record.get("id")
+    results["raw_name"] = record.get("raw_name")
+    return(results)
+
+# The API call function for the ChecklistBank match/nameusage endpoint
+def checklistbank_match(dataset, name, rank, client):
+    formatted_name = name.replace(" ", "%20")
+    url = f"{CHECKLISTBANK_API}/dataset/{dataset}/match/nameusage?scientificName={formatted_name}&rank={rank}"
+    return(client.get(url, cache_key=("match/nameusage", dataset, name, rank), authenticate=True))
+
+# Building the results record (metadata + taxonomic) for a ChecklistBank match, with the record "id" and "raw_name" left
+# empty (see record_result). Returns the results and the (name, rank) pairs of the match classification.
+def match_result(data, query_name, query_rank, GNV_edit_distance=None):
+    GNV_required = GNV_edit_distance is not None
+    classification_names = []
+
+    results = {
+    "id": None,
+    "raw_name": None,
+    "query_name": query_name,
+    "query_rank": query_rank,
+    "match_id": data.get("usage", {}).get("id"),
+    "match_type": data.get("usage", {}).get("namesIndexMatchType"),
+    "status": data.get("usage", {}).get("status"),
+    "match_rank": data.get("usage", {}).get("rank")
+    }
+    if GNV_required:
+        results["scientific_name"] = data.get("usage", {}).get("name")
+    results["name_authorship"] = data.get("usage", {}).get("authorship")
+    results["nidx"] = data.get("usage", {}).get("namesIndexId")
+    results["issues"] = data.get("issues")
+    if GNV_required:
+        results["GNV_required"] = "True"
+        results["GNV_edit_distance"] = GNV_edit_distance
+
+    classification = data.get("usage", {}).get("classification", [])
+    for group in classification:
+        tax_rank = group["rank"]
+        tax_name = group["name"]
+        tax_id = group["id"]
+
+        classification_names.append((tax_name, tax_rank))
+        results[tax_rank] = tax_name
+        results[f"{tax_rank}_COL_code"] = tax_id
+
+        if tax_rank == "kingdom":
+            break
+
+    return(CompactRecord.from_dict(results), classification_names)
+
+# Matching a single query name and rank against ChecklistBank.
+# Returns the result category ("match", "unverified" for names still to be checked with GNV, or None on error), the result
+# (for unverified names, the returned issues and the query rank used), any errors, the (name, rank) pairs of the match
+# classification and whether the name was corrected with GNV
+# With speculative queries, trinomials queried at species rank (which ChecklistBank flags as subspecies) are queried at
+# subspecies rank at the same time, and the subspecies response is only used if the species match is flagged.
+def resolve_query(dataset, query_name, query_rank, client, speculative=SPECULATIVE_QUERIES):
+
+    errors = []
+    subspecies_query = None
+    if speculative and query_rank == "species" and len(query_name.split()) > 2:
+        subspecies_query = client.submit(checklistbank_match, dataset, query_name, "subspecies", client)
+
+    # Querying ChecklistBank
+    try:
+        data = checklistbank_match(dataset, query_name, query_rank, client)
+
+        # Re-querying with rank changed to "subspecies" if ChecklistBank has flagged a match as such
+        if data and len(data.get("issues")) > 0:
+            if 'subspecies assigned' in data.get("issues").get("issues"):
+                query_rank = "subspecies_adjusted"
+
+                try:
+                    if subspecies_query:
+                        data = subspecies_query.result()
+                    else:
+                        data = checklistbank_match(dataset, query_name, "subspecies", client)
+
+                except Exception as e:
+                    print(f"Error processing name {query_name}: {e}")
+                    errors.append({
+                    "raw_name": None,
+                    "query_name": query_name,
+                    "query_rank": query_rank,
+                    "error": e
+                    })
+
+        # Adding all successfull match data (metadata + taxonomic) to a results list
+        if data and data.get("match") == True and not data.get("issues"):
+            results, classification_names = match_result(data, query_name, query_rank)
+            return("match", results, errors, classification_names, False)
+
+        # Unmatched names are returned to be verified with GNV
+        return("unverified", {"issues": data.get("issues"), "query_rank": query_rank}, errors, [], False)
+
+    except Exception as e:
+                print(f"Error processing name {query_name}: {e}")
+                errors.append({
+                    "raw_name": None,
+                    "query_name": query_name,
+                    "query_rank": query_rank,
+                    "error": e
+                    })
+
+    return(None, None, errors, [], False)
+
+# Resolving a name ChecklistBank could not match, using its GNV result. If GNV found a match, ChecklistBank is re-queried
+# with the GNV corrected name. Returns the same values as resolve_query, with the category "match", "unmatch" or "match_issue"
+def resolve_unverified_query(dataset, query_name, unverified_result, GNV_results, client):
+
+    category, results, errors, classification_names, GNV_corrected = unverified_result
+    query_rank = results["query_rank"]
+    GNV_match_name, GNV_edit_distance, call_error = GNV_results[(query_name, query_rank)]
+
+    if len(call_error) > 0:
+        return(None, None, errors + call_error, [], False)
+
+    # If GNV finds no match, add to unmatched list
+    if GNV_match_name is None and GNV_edit_distance is None:
+        return("unmatch", {"issues": results["issues"]}, errors, [], False)
+
+    # If GNV does find a match, re-query the ChecklistBank API using that matched name
+    try:
+        data = checklistbank_match(dataset, GNV_match_name, query_rank, client)
+
+        if data and data.get("match") == True:
+            results, classification_names = match_result(data, query_name, query_rank, GNV_edit_distance)
+            
+            if len(results["issues"]) > 0:
+                return("match_issue", results, errors, classification_names, False)
+            return("match", results, errors, classification_names, True)
+
+        return("unmatch", {"issues": data.get("issues")}, errors, [], False)
+
+    except Exception as e:
+        print(f"Error processing GNV corrected name {query_name}: {e}")
+        errors = errors + [{
+            "raw_name": None,
+            "query_name": query_name,
+            "query_rank": query_rank,
+            "error": e
+            }]
+
+    return(None, None, errors, [], False)
+
+# GNV verification of a list of (query_name, query_rank) pairs, sending names not already cached to the GNV POST
+# verifications endpoint in chunks of batch_size names.
+# Returns a dictionary of (query_name, query_rank): (GNV_match_name, GNV_edit_distance, call_error)
+def global_names_batch_verifier(queries, client, batch_size=GNV_BATCH_SIZE):
+
+    url = f"{GNV_API}/verifications"
+    cache = client.cache
+    metrics = client.metrics
+    name_results = {}
+    name_errors = {}
+    names_to_verify = {}
+    local_count = 0
+
+    for query_name, query_rank in queries:
+        if query_name in name_results or query_name in names_to_verify:
+            continue
+
+        # With an offline checklist, names are first corrected locally. Names without a local correction passing the rank check go to GNV.
+        if client.checklist:
+            name_result = client.checklist.verify(query_name)
+            if GNV_best_match(name_result, query_rank)[0] is not None:
+                name_results[query_name] = name_result
+                metrics.record_answer("verifications", "local")
+                local_count += 1
+                continue
+
+        data = client.cached(("verifications", "GNV", query_name, ""))
+        if data is not None:
+            name_results[query_name] = data.get("names")[0]
+        else:
+            names_to_verify[query_name] = None
+
+    if local_count:
+        print(f"{local_count} names corrected with the local checklist")
+    names_to_verify = list(names_to_verify)
+    if names_to_verify:
+        print(f"Verifying {len(names_to_verify)} names with GNverifier...")
+
+    # Querying GNV, one request per batch of names
+    for start in range(0, len(names_to_verify), batch_size):
+        batch = names_to_verify[start:start + batch_size]
+        payload = {
+            "nameStrings": batch,
+            "dataSources": [1],
+            "withAllMatches": False,
+            "withCapitalization": True,
+            "withSpeciesGroup": False,
+            "withUninomialFuzzyMatch": False,
+            "withStats": False,
+            "mainTaxonThreshold": 0.5
+            }
+
         try:
-            r = requests.get(url)
-            r.raise_for_status()
-            data = r.json()
+            metrics.record_answer("verifications", "names", len(batch))
+            data = client.post(url, payload)
+
+            # GNV returns one result per name, in the order the names were sent
+            for query_name, name_result in zip(batch, data.get("names")):
+                name_results[query_name] = name_result
+                if cache:
+                    cache.set("verifications", "GNV", query_name, "", {"names": [name_result]})
 
         except Exception as e:
-            print(f"Error verifying name {raw_name} with GNverifier: {e}")
-            call_error.append({
-                "raw_name": raw_name,
+            print(f"Error verifying batch of {len(batch)} names with GNverifier: {e}")
+            for query_name in batch:
+                name_errors[query_name] = e
+
+    verified = {}
+    for query_name, query_rank in queries:
+        if query_name in name_errors:
+            call_error = [{
+                "raw_name": None,
                 "query_name": query_name,
                 "query_rank": query_rank,
-                "error": e
-                })
-            
-        # Taking only returned matches where the query rank is equal to match rank.
-        if data and data.get("names")[0].get("matchType") != "NoMatch":
-            GNV_top_match = data.get("names")[0].get("bestResult")
-            GNV_tax_match = GNV_top_match.get("classificationRanks")
-            if GNV_tax_match.endswith(f"{query_rank}"):
-                GNV_match_name = GNV_top_match.get("matchedCanonicalFull")
-                GNV_edit_distance = GNV_top_match.get("editDistance")
-            else:
-                GNV_match_name = None
-                GNV_edit_distance = None
+                "error": name_errors[query_name]
+                }]
+            verified[(query_name, query_rank)] = (None, None, call_error)
         else:
-            GNV_match_name = None
-            GNV_edit_distance = None
+            GNV_match_name, GNV_edit_distance = GNV_best_match(name_results.get(query_name), query_rank)
+            verified[(query_name, query_rank)] = (GNV_match_name, GNV_edit_distance, [])
 
-        return(GNV_match_name, GNV_edit_distance, call_error)
+    return(verified)
+
+# Taking the best GNV result for a name, keeping only returned matches where the query rank is equal to match rank.
+# Returns the matched name and edit distance, or (None, None)
+def GNV_best_match(name_result, query_rank):
+    if name_result and name_result.get("matchType") != "NoMatch":
+        GNV_top_match = name_result.get("bestResult")
+        GNV_tax_match = GNV_top_match.get("classificationRanks") or ""
+        if GNV_tax_match.endswith(f"{query_rank}"):
+            return(GNV_top_match.get("matchedCanonicalFull"), GNV_top_match.get("editDistance"))
+
+    return(None, None)
 
 # Small fucntion separate ambiguous from non-ambiguous matches in data
 def ambiguous_match_extract(match_list):
@@ -386,60 +1864,98 @@ def ambiguous_match_extract(match_list):
 
 
 # Family namematch function to re-query ChecklistBank for previoulsy unmatched records using family name
-def family_namematch(dataset, unmatches, list_name):
-    print(f"Matching family names for unmatched species entries...")
+def family_namematch(dataset, unmatches, list_name, client, checkpoint=None, known_queries=None, report=True, stats=None):
+    if report:
+        print(f"Matching family names for unmatched species entries...")
 
     for record in unmatches:
-        record['query_name'] = record['family']
+        record['query_name'] = canonical_name(record['family']) or record['family']
         record['query_rank'] = "family"
         if record.get('raw_name'):
             del record['raw_name']
         if record.get("issues"):
             del record['issues']
 
-    matches, unmatches, match_issues, match_errors, higher_tax_class_list = tax_namematch(dataset, unmatches, list_name)
+    matches, unmatches, match_issues, match_errors, higher_tax_class_list = tax_namematch(dataset, unmatches, list_name, client, checkpoint=checkpoint,
+                                                                                          known_queries=known_queries, report=report, stats=stats)
 
 
     return(matches, unmatches, match_issues, match_errors, higher_tax_class_list)
 
-# Appending key identifiers to records for the sources providing taxonomic information to CoL25.
-def append_source_keys(dataset, matches):
-    print(f"Obtaining source keys for matches...")
-    print(f"Start time {time.strftime('%H:%M:%S')}")
-
-    count = 0
-    key_cache = {}
-
-    for record in matches:
-        match_id = record["match_id"]
+# Appending the key identifiers and names of the sources providing taxonomic information to CoL25 to all matched records.
+# The distinct match IDs of all match lists are resolved to source keys concurrently, and the (few) distinct source keys are
+# then resolved to source names once each. Shared key_cache and name_cache dicts carry resolved keys and names over between calls.
+# Failed lookups are not cached, so later calls send them again, and the records they leave without a source are added to the
+# errors list (if given), in the same form as match errors.
+def resolve_sources(dataset, match_lists, client, checkpoint=None, workers=MAX_WORKERS, key_cache=None, name_cache=None, report=True, errors=None):
+    if report:
+        print(f"Obtaining source keys and sources for matches...")
+        print(f"Start time {time.strftime('%H:%M:%S')}")
+
+    key_cache = key_cache if key_cache is not None else {}
+    name_cache = name_cache if name_cache is not None else {}
+    match_ids = []
+    resumed_count = 0
+
+    for match_id in dict.fromkeys(record["match_id"] for matches in match_lists for record in matches):
         if match_id in key_cache:
-            source_key = key_cache[match_id]
+            continue
+        # Source keys retrieved by an earlier, interrupted run are taken from the checkpoint journal
+        if checkpoint and match_id in checkpoint.completed:
+            key_cache[match_id] = checkpoint.completed[match_id]
+            resumed_count += 1
         else:
-            source_key = fetch_source_keys(dataset, match_id)
-            source_key = str(source_key)
+            match_ids.append(match_id)
+    if report:
+        print(f"{len(match_ids)} distinct match IDs to resolve ({resumed_count} from checkpoint)")
+
+    key_errors = {}
+    name_errors = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        source_keys = executor.map(lambda match_id: fetch_source_keys(dataset, match_id, client, key_errors), match_ids)
+        for count, (match_id, source_key) in enumerate(zip(match_ids, source_keys), 1):
+            if match_id in key_errors:
+                continue
             key_cache[match_id] = source_key
-            time.sleep(0.1)
-
-        record["source_key"] = source_key
-
-        count += 1
-        if count % 100 == 0:
-            print(f"{count} keys retrieved")
-        else:
-            continue
-    
-    print(f"Finished {time.strftime('%H:%M:%S')}")
-    print(f"Updated match list with CoL match IDs")
-    print("-"*15)
-    return(matches)
-
-# The API call function that returns the ChecklistBank source key using dataset and match ID
-def fetch_source_keys(dataset, match_id):
-    url = f"https://api.checklistbank.org/dataset/{dataset}/nameusage/{match_id}/source"
+            if checkpoint and source_key != "None":
+                checkpoint.record(match_id, source_key)
+            if count % 100 == 0 and report:
+                print(f"{count} keys retrieved")
+
+        # Records without a source key get no source name
+        source_keys = [key_cache[record["match_id"]] for matches in match_lists for record in matches if record["match_id"] in key_cache]
+        source_keys = [source_key for source_key in dict.fromkeys(source_keys) if source_key != "None" and source_key not in name_cache]
+        source_names = executor.map(lambda source_key: fetch_source_names(dataset, source_key, client, name_errors), source_keys)
+        name_cache.update((source_key, source_name) for source_key, source_name in zip(source_keys, source_names) if source_key not in name_errors)
+
+    if checkpoint:
+        checkpoint.flush()
+
+    error_count = 0
+    for matches in match_lists:
+        for record in matches:
+            record["source_key"] = key_cache.get(record["match_id"], "None")
+            record["tax_source_name"] = name_cache.get(record["source_key"])
+            error = key_errors.get(record["match_id"]) or name_errors.get(record["source_key"])
+            if error:
+                error_count += 1
+                if errors is not None:
+                    errors.append({"raw_name": record.get("raw_name"), "query_name": record.get("query_name"), "query_rank": record.get("query_rank"),
+                                   "error": error, "id": record.get("id")})
+
+    if report:
+        print(f"Finished {time.strftime('%H:%M:%S')}")
+        print(f"Updated matched records with {len(name_cache)} source keys and names")
+        print(f"{error_count} records left without a source due to error")
+        print("-"*15)
+    return(match_lists)
+
+# The API call function that returns the ChecklistBank source key using dataset and match ID. Errors are added to the errors
+# dictionary (if given) by match ID.
+def fetch_source_keys(dataset, match_id, client, errors=None):
+    url = f"{CHECKLISTBANK_API}/dataset/{dataset}/nameusage/{match_id}/source"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
+        data = client.get(url, cache_key=("nameusage/source", dataset, match_id, ""))
 
         source_key = data.get("sourceDatasetKey", None)
         source_key = str(source_key)
@@ -448,54 +1964,205 @@ def fetch_source_keys(dataset, match_id):
 
     except Exception as e:
         print(f"Error fetching source for match ID {match_id}: {e}")
+        if errors is not None:
+            errors[match_id] = e
         return None
     
     return(source_key)
 
-# Appending source names to records using source key identifiers
-def append_source_names(dataset, matches):
-    print(f"Obtaining sources for taxonomic matches...")
-    print(f"Start time {time.strftime('%H:%M:%S')}")
-    
-    name_cache = {}
-    count = 0
-
-    for record in matches:
-        source_key = record["source_key"]
-        if source_key in name_cache:
-            tax_source_name = name_cache[source_key]
-        else:
-            tax_source_name = fetch_source_names(dataset, source_key)
-            name_cache[source_key] = tax_source_name
-            time.sleep(0.1)
-
-        record["tax_source_name"] = tax_source_name
-        count += 1
-        if count % 100 == 0:
-            print(f"{count} sources retrieved")
-        else:
-            continue
-    
-    print(f"Finished {time.strftime('%H:%M:%S')}")
-    print(f"Updated matched records with source names")
-    print("-"*15)
-    return(matches)
-
-# The API call function that returns the ChecklistBank source dataset using the source key
-def fetch_source_names(dataset, source_key):
-    url = f"https://api.checklistbank.org/dataset/{dataset}/source/{source_key}"
+# The API call function that returns the ChecklistBank source dataset using the source key. Errors are added to the errors
+# dictionary (if given) by source key.
+def fetch_source_names(dataset, source_key, client, errors=None):
+    url = f"{CHECKLISTBANK_API}/dataset/{dataset}/source/{source_key}"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
+        data = client.get(url, cache_key=("source", dataset, source_key, ""))
         return data.get("title", None)
     
     except Exception as e:
         print(f"Error fetching name with source key {source_key}: {e}")
+        if errors is not None:
+            errors[source_key] = e
+        return None
+
+# Keys of matched and AGSD records that are not taxonomic names, and are copied over as-is when merging
+NON_TAX_KEYS = frozenset(["id", "match_id", "match_type", "match_rank", "status", "query_name", "query_rank", "raw_name", "scientific_name",
+    "source_key", "tax_source_name", "source_name", "name_authorship", "name_in_reference", "entered_by", "date_entered", "date_last_modified", "c_value", "c_value_upper", 
+    "chrom_num", "chrom_num_upper", "GNV_edit_distance", "GNV_required", "method", "std_sp", "rr", "comments", "refs", "issues", "species_synonyms", 
+    "subspecies_synonyms", "family_synonyms", "genus_synonyms", "tax_filled", "tax_updated", "type", "nidx", "order_alt", "common_name"])
+
+# Higher taxonomic ranks, changes to which are also recorded in the high tax update log
+HIGHER_TAX_RANKS = frozenset(["kingdom", "phylum", "subphylum", "superclass", "class", "subclass", "infraclass", "superorder", "order"])
+
+# Ranks whose AGSD names can carry qualifiers (eg. Bufo viridis (4n)), which are kept when a match only differs by them
+QUALIFIED_NAME_RANKS = frozenset(["genus", "species", "subspecies"])
+
+# Query ranks that can be merged for each match rank
+MERGE_QUERY_RANKS = {
+    "species": ("species",),
+    "genus": ("genus",),
+    "subspecies": ("subspecies", "subspecies_adjusted"),
+    "family": ("family",)
+    }
+
+# Merge rules for each (match rank, status) pair:
+#   "set_fields"  - (field, source field) pairs copied within the matched record before merging
+#   "synonym_column" - (synonym column, old field) the old name is moved to for synonym matches
+#   "subspecies_synonym_column" - the synonym column used instead when the matched record includes a subspecies
+#   "drop_subspecies" - removes subspecies returned with a match (not considered reliable here) instead of recording a synonym
+#   "keep_name_suffix" - keeps bracketed designations (eg. Bufo viridis (4n)) and "ssp." parts of the old species name when it is updated
+MERGE_RULES = {
+    ("species", "accepted"): {
+        "set_fields": [("species_COL_code", "match_id")]
+        },
+    ("species", "synonym"): {
+        "set_fields": [("species_COL_code", "match_id")],
+        "synonym_column": ("species_synonyms", "species"),
+        "drop_subspecies": True,
+        "keep_name_suffix": True
+        },
+    ("genus", "accepted"): {
+        "set_fields": [("genus_COL_code", "match_id"), ("genus", "query_name"), ("species", "raw_name")]
+        },
+    ("genus", "synonym"): {
+        "set_fields": [("genus_COL_code", "match_id")],
+        "synonym_column": ("genus_synonyms", "species")
+        },
+    ("subspecies", "accepted"): {
+        "set_fields": [("subspecies", "raw_name"), ("subspecies_COL_code", "match_id")]
+        },
+    ("subspecies", "synonym"): {
+        "synonym_column": ("species_synonyms", "species"),
+        "subspecies_synonym_column": ("subspecies_synonyms", "species")
+        },
+    ("family", "accepted"): {
+        "set_fields": [("family", "query_name"), ("family_COL_code", "match_id")]
+        },
+    ("family", "synonym"): {
+        "set_fields": [("family", "query_name"), ("family_COL_code", "match_id")],
+        "synonym_column": ("family_synonyms", "family")
+        }
+    }
+
+
+# Finding the merge rule for a matched record, or None if the match should not be merged
+def merge_rule(matched_record):
+    match_rank = matched_record["match_rank"]
+    if matched_record["query_rank"] not in MERGE_QUERY_RANKS.get(match_rank, ()):
         return None
 
+    if matched_record["status"] in ("accepted","provisionally accepted"):
+        return MERGE_RULES.get((match_rank, "accepted"))
+    return MERGE_RULES.get((match_rank, matched_record["status"]))
+
+# Merge kernel: merges a matched record into a copy of an AGSD record following a merge rule. Compact AGSD records are merged
+# as compact records (copying only their list of values), and plain dict records as dicts.
+# Returns the combined record and the record's tax update, tax fill, high tax update and reclassification log entries
+def merge_record(old_record, matched_record, rule, merge_date):
+    tax_filled = []
+    tax_updated = []
+    update_log = []
+    fill_log = []
+    high_update_log = []
+    reclass_log = []
+    combined_record = old_record.copy()
+
+    for field, source in rule.get("set_fields", ()):
+        matched_record[field] = matched_record[source]
+
+    # Moving old names to synonym columns, or dropping subspecies data returned with the match
+    if "synonym_column" in rule:
+        has_subspecies = matched_record.get("subspecies") != None
+        if has_subspecies and rule.get("drop_subspecies"):
+            matched_record["subspecies"] = None
+            matched_record["subspecies_COL_code"] = None
+        else:
+            synonym_column, old_field = rule["synonym_column"]
+            if has_subspecies:
+                synonym_column, old_field = rule.get("subspecies_synonym_column", rule["synonym_column"])
+            combined_record[synonym_column] = combined_record[old_field]
+
+    # Reverse index of values to the tax name keys holding them, used to detect reclassifications in a single pass
+    value_index = {}
+    for key, value in record_items(combined_record):
+        if (key not in NON_TAX_KEYS) and ("_COL_code" not in key):
+            keys = value_index.get(value)
+            if keys is None:
+                value_index[value] = [key]
+            else:
+                keys.append(key)
+
+    # Data other than tax names is added from the matched record in one update once the tax names are merged (the merge of tax
+    # names does not read it)
+    matched_keys = []
+    matched_values = []
+    for key, new_value in record_items(matched_record):
+
+        # If not a tax name, simply add data from matched record
+        if (key in NON_TAX_KEYS) or ("_COL_code" in key):
+            matched_keys.append(key)
+            matched_values.append(new_value)
+            continue
+
+        # Keep track of reclassifications, where a name is added that already exists, but to a different tax rank, and remove name from old rank
+        old_keys = value_index.get(new_value)
+        if old_keys and (len(old_keys) > 1 or old_keys[0] != key):
+            if len(old_keys) > 1: # Logging reclassifications in record order
+                old_keys = [old_key for old_key in combined_record if old_key in old_keys]
+            for old_key in old_keys:
+                if old_key != key:
+                    combined_record[old_key] = None
+                    if new_value != None:
+                        value_index[new_value].remove(old_key)
+                        value_index.setdefault(None, []).append(old_key)
+                    reclass_log.append(f"{new_value} reclassified from {old_key} to {key}")
+
+        old_value = combined_record.get(key)
+
+        # The AGSD name is kept where the match is the same name without its qualifiers
+        if new_value != old_value and key in QUALIFIED_NAME_RANKS and isinstance(old_value, str):
+            old_name, old_qualifiers = normalize_name(old_value)
+            if old_qualifiers and old_name == new_value:
+                new_value = old_value
+
+        if new_value != old_value:
+
+            # Tax updates - where a different value already existed for the that rank in old dataset
+            if old_value != None:
+                if key in HIGHER_TAX_RANKS: # Keeping track of high tax changes in high tax change log
+                    high_update_log.append(f"WARNING: {key} changed from '{old_value}' to '{new_value}'")
+
+                if key == "species" and rule.get("keep_name_suffix"): # Dealing with synonymym swapping of species names that have extra information in name
+                    bracket_match = BRACKET_DESIGNATION.search(old_value)
+                    ssp_match = SSP_DESIGNATION.search(matched_record['raw_name'])
+                    if bracket_match:
+                        new_value = f"{new_value} {bracket_match.group(0)}"
+                    if ssp_match:
+                        new_value = f"{new_value} {ssp_match.group(0)}"
+
+                tax_updated.append(key)
+                update_log.append(f"{key} changed from '{old_value}' to '{new_value}'")
+
+            # Tax fills - where no value existed for that rank in the old dataset
+            if old_value == None:
+                tax_filled.append(key)
+                fill_log.append(f"{key} classification '{new_value}' added")
+
+            if key in combined_record:
+                value_index[old_value].remove(key)
+            keys = value_index.get(new_value)
+            if keys is None:
+                value_index[new_value] = [key]
+            else:
+                keys.append(key)
+            combined_record[key] = new_value
+
+    matched_keys += ("date_last_modified", "tax_filled", "tax_updated")
+    matched_values += (merge_date, tax_filled, tax_updated)
+    set_record_values(combined_record, tuple(matched_keys), matched_values)
+    return(combined_record, update_log, fill_log, high_update_log, reclass_log)
+
 # Data merging function that merges matched data with AGSD records
-def data_merger(AGSD_records, matched_list):
+def data_merger(AGSD_records, matched_list, merge_date=None, report=True):
 
     merged_data = []
     high_tax_update_log = {}
@@ -503,11 +2170,7 @@ def data_merger(AGSD_records, matched_list):
     tax_update_log = {}
     tax_fill_log = {}
     tax_reclass_log = {}
-    higher_tax_list = ["kingdom", "phylum", "subphylum", "superclass", "class", "subclass", "infraclass", "superorder", "order"]
-    non_tax_keys  = ["id", "match_id", "match_type", "match_rank", "status", "query_name", "query_rank", "raw_name", "scientific_name",
-    "source_key", "tax_source_name", "source_name", "name_authorship", "name_in_reference", "entered_by", "date_entered", "date_last_modified", "c_value", "c_value_upper", 
-    "chrom_num", "chrom_num_upper", "GNV_edit_distance", "GNV_required", "method", "std_sp", "rr", "comments", "refs", "issues", "species_synonyms", 
-    "subspecies_synonyms", "family_synonyms", "genus_synonyms", "tax_filled", "tax_updated", "type", "nidx", "order_alt", "common_name"]
+    merge_date = merge_date if merge_date else time.strftime("%Y-%m-%d %H:%M", time.localtime())
 
     # Using ID as matched record key value for efficient lookup
     for match in matched_list:
@@ -515,465 +2178,468 @@ def data_merger(AGSD_records, matched_list):
 
     # For each record in the AGSD data, looks up the corresonding matched record using id.
     for old_record in AGSD_records:
-        tax_filled = []
-        tax_updated = []
         id = old_record["id"]
         matched_record = matched_lookup.get(id)
 
         #### MERGING CONDITIONS ####
 
         ## NO MATCH
-        if matched_record == None: # Uses original record if no match found
+        if matched_record is None: # Uses original record if no match found
             merged_data.append(old_record)
             continue
         
         ## AMBIGUOUS MATCHES 
-        elif matched_record["match_type"] == "ambiguous" or matched_record["status"] == "ambiguous synonym": # Uses original record if match type is ambiguous
+        if matched_record["match_type"] == "ambiguous" or matched_record["status"] == "ambiguous synonym": # Uses original record if match type is ambiguous
             merged_data.append(old_record)
             continue
 
         ## FAR-OFF MATCHES, use orininal record if match is not in animal kingdom.
-        elif matched_record["kingdom"] != "Animalia":
+        if matched_record.get("kingdom") != "Animalia":
             merged_data.append(old_record)
             continue
 
-        ## SPECIES-LEVEL MATCHES
-        elif matched_record["query_rank"] == matched_record['match_rank'] == 'species':
-            matched_record["species_COL_code"] = matched_record['match_id']
-            combined_record = old_record.copy()
-            
-            # Merging straight-forward accepted species match
-            if matched_record["status"] in ("accepted","provisionally accepted"):
-                for key, new_value in matched_record.items():
-
-                    # If not a tax name, simply add data from matched record
-                    if (key in non_tax_keys) or ("_COL_code" in key):
-                        combined_record[key] = new_value
-                        continue
+        ## SPECIES, GENUS, SUBSPECIES AND FAMILY-LEVEL MATCHES, merged following the rule for their rank and status
+        rule = merge_rule(matched_record)
+        if rule == None: # Uses original record for matches without a merge rule (eg. query and match ranks differ)
+            merged_data.append(old_record)
+            continue
 
-                    # Keep track of reclassifications, where a name is added that already exists, but to a different tax rank, and remove name from old rank
-                    for old_key, old_value in combined_record.items():
-                        if (old_value == new_value) and (old_key != key) and ("_COL_code" not in old_key) and (old_key not in non_tax_keys):
-                            combined_record[old_key] = None
-
-                            if id not in tax_reclass_log:
-                                tax_reclass_log[id] = []
-                            tax_reclass_log[id].append(f"{old_value} reclassified from {old_key} to {key}")
-                    
-                    old_value = combined_record.get(key)
-                    if new_value != old_value: # Tax updates - where a different value already existed for the that rank in old dataset
-                        if old_value != None: 
-                            if id not in tax_update_log:
-                                tax_update_log[id] = []
-                            tax_updated.append(key)
-                            tax_update_log[id].append(f"{key} changed from '{old_value}' to '{new_value}'")
-                            
-                            if key in higher_tax_list: # Keeping track of high tax changes in high tax change log
-                                if id not in high_tax_update_log:
-                                    high_tax_update_log[id] = []
-                                high_tax_update_log[id].append(f"WARNING: {key} changed from '{old_value}' to '{new_value}'")
-
-                        if old_value == None: # Tax fills - where no value existed for that rank in the old dataset
-                            if id not in tax_fill_log:
-                                tax_fill_log[id] = []
-                            tax_filled.append(key)
-                            tax_fill_log[id].append(f"{key} classification '{new_value}' added")
-                        combined_record[key] = new_value
-
-                combined_record["date_last_modified"] = time.strftime("%Y-%m-%d %H:%M", time.localtime())
-                combined_record["tax_filled"] = tax_filled
-                combined_record["tax_updated"] = tax_updated
-                merged_data.append(combined_record)
-
-            # Merging reecords for returned species synonyms
-            elif matched_record['status'] == "synonym":
-
-                # Removing subspecies data that is sometimes returned by species querying to ChecklistBank, however not considered reliable here.
-                if matched_record.get('subspecies') != None:
-                    matched_record['subspecies'] = None
-                    matched_record['subspecies_COL_code'] = None
-                else:
-                    combined_record['species_synonyms'] = combined_record["species"] # Moving old name to "synonyms" column
-                
-                for key, new_value in matched_record.items():
+        combined_record, updates, fills, high_updates, reclassifications = merge_record(old_record, matched_record, rule, merge_date)
+        merged_data.append(combined_record)
 
-                    # If not a tax name, simply add data from matched record
-                    if (key in non_tax_keys) or ("_COL_code" in key):
-                        combined_record[key] = new_value
-                        continue
-                    
-                    # Keep track of reclassifications
-                    for old_key, old_value in combined_record.items():
-                        if (old_value == new_value) and (old_key != key) and ("_COL_code" not in old_key) and (old_key not in non_tax_keys):
-                            combined_record[old_key] = None
-
-                            if id not in tax_reclass_log:
-                                tax_reclass_log[id] = []
-                            tax_reclass_log[id].append(f"{old_value} reclassified from {old_key} to {key}")
-                    
-                    old_value = combined_record.get(key)
-                    if new_value != old_value: 
-
-                        # Tax updates
-                        if old_value != None:
-                            if id not in tax_update_log:
-                                tax_update_log[id] = []
-                            if key in higher_tax_list: # Keep track of high tax changes
-                                if id not in high_tax_update_log:
-                                    high_tax_update_log[id] = []
-                                high_tax_update_log[id].append(f"WARNING: {key} changed from '{old_value}' to '{new_value}'")
-
-                            if key == "species": # Dealing with synonymym swapping of species names that have extra information in name 
-                                bracket_designation = r"\([0-9]+[A-Za-z]*\)" # Regex pattern for bracketed numbers+letters in names (eg. Bufo viridis (4n)) for synonym swapping later
-                                ssp_designation = r"\bssp\..*" # Regex pattern for "ssp.*"
-                                bracket_match = re.search(bracket_designation, old_value)
-                                ssp_match = re.search(ssp_designation, matched_record['raw_name'])
-                                if bracket_match:
-                                    new_value = f"{new_value} {bracket_match.group(0)}"
-                                if ssp_match:
-                                    new_value = f"{new_value} {ssp_match.group(0)}"
-
-                            tax_updated.append(key)
-                            tax_update_log[id].append(f"{key} changed from '{old_value}' to '{new_value}'")
-
-                        # Tax fills
-                        if old_value == None:
-                            if id not in tax_fill_log:
-                                tax_fill_log[id] = []
-                            tax_filled.append(key)
-                            tax_fill_log[id].append(f"{key} classification '{new_value}' added")
-                        combined_record[key] = new_value
-
-                combined_record["date_last_modified"] = time.strftime("%Y-%m-%d %H:%M", time.localtime())
-                combined_record["tax_filled"] = tax_filled
-                combined_record["tax_updated"] = tax_updated
-                merged_data.append(combined_record)
-
-        ## GENUS-LEVEL MATCHES
-        elif matched_record["query_rank"] == matched_record["match_rank"] == "genus":
-            matched_record["genus_COL_code"] = matched_record["match_id"]
-            combined_record = old_record.copy()
-
-            # Merge for accepted genus name match
-            if matched_record["status"] in ("accepted","provisionally accepted"):
-                matched_record['genus'] = matched_record['query_name'] # Moves genus name to new genus column
-                matched_record['species'] = matched_record['raw_name'] # Keeps original (sp.) name in species column
-                
-                for key, new_value in matched_record.items():
-
-                    # If not a tax name, simply add data from matched record
-                    if (key in non_tax_keys) or ("_COL_code" in key):
-                        combined_record[key] = new_value
-                        continue
-                    
-                    # Keep track of reclassifications
-                    for old_key, old_value in combined_record.items():
-                        if (old_value == new_value) and (old_key != key) and ("_COL_code" not in old_key) and (old_key not in non_tax_keys):
-                            combined_record[old_key] = None
-
-                            if id not in tax_reclass_log:
-                                tax_reclass_log[id] = []
-                            tax_reclass_log[id].append(f"{old_value} reclassified from {old_key} to {key}")
-                    
-                    old_value = combined_record.get(key)
-                    if new_value != old_value:
-
-                        # Tax updates
-                        if old_value != None: 
-                            if id not in tax_update_log:
-                                tax_update_log[id] = []
-                            tax_updated.append(key)
-                            tax_update_log[id].append(f"{key} changed from '{old_value}' to '{new_value}'")
-                            if key in higher_tax_list:
-                                if id not in high_tax_update_log:
-                                    high_tax_update_log[id] = []
-                                high_tax_update_log[id].append(f"WARNING: {key} changed from '{old_value}' to '{new_value}'")
-
-                        # Tax fills      
-                        if old_value == None:
-                            if id not in tax_fill_log:
-                                tax_fill_log[id] = []
-                            tax_filled.append(key)
-                            tax_fill_log[id].append(f"{key} classification '{new_value}' added")
-                        combined_record[key] = new_value
-
-                combined_record["date_last_modified"] = time.strftime("%Y-%m-%d %H:%M", time.localtime())
-                combined_record["tax_filled"] = tax_filled
-                combined_record["tax_updated"] = tax_updated
-                merged_data.append(combined_record)
-            
-            # Genera synonyms
-            elif matched_record['status'] == "synonym":
-                combined_record['genus_synonyms'] = combined_record["species"] # Moves old name to "synonyms" column
-                matched_record['genus_COL_code'] = matched_record["match_id"]
-                
-                for key, new_value in matched_record.items():
-
-                    # If not a tax name, simply add data from matched record
-                    if (key in non_tax_keys) or ("_COL_code" in key):
-                        combined_record[key] = new_value
-                        continue
-                    
-                    # Keep track of reclassifications
-                    for old_key, old_value in combined_record.items():
-                        if (old_value == new_value) and (old_key != key) and ("_COL_code" not in old_key) and (old_key not in non_tax_keys):
-                            combined_record[old_key] = None
-
-                            if id not in tax_reclass_log:
-                                tax_reclass_log[id] = []
-                            tax_reclass_log[id].append(f"{old_value} reclassified from {old_key} to {key}")
-                    
-                    old_value = combined_record.get(key)
-                    if new_value != old_value:
-
-                        # Tax updates
-                        if old_value != None: 
-                            if id not in tax_update_log:
-                                tax_update_log[id] = []
-                            tax_updated.append(key)
-                            tax_update_log[id].append(f"{key} changed from '{old_value}' to '{new_value}'")
-                            if key in higher_tax_list:
-                                if id not in high_tax_update_log:
-                                    high_tax_update_log[id] = []
-                                high_tax_update_log[id].append(f"WARNING: {key} changed from '{old_value}' to '{new_value}'")
-
-                        # Tax fills      
-                        if old_value == None:
-                            if id not in tax_fill_log:
-                                tax_fill_log[id] = []
-                            tax_filled.append(key)
-                            tax_fill_log[id].append(f"{key} classification '{new_value}' added")
-                        combined_record[key] = new_value
-
-                combined_record["date_last_modified"] = time.strftime("%Y-%m-%d %H:%M", time.localtime())
-                combined_record["tax_filled"] = tax_filled
-                combined_record["tax_updated"] = tax_updated
-                merged_data.append(combined_record)
-
-        ## SUBSPECIES-LEVEL MATCHES
-        elif (matched_record["match_rank"] == "subspecies") and (matched_record["query_rank"] in ("subspecies", "subspecies_adjusted")):
-            combined_record = old_record.copy()
-            if matched_record["status"] in ("accepted","provisionally accepted"): # <-- simple merge for accepted names
-                matched_record["subspecies"] = matched_record["raw_name"]
-                matched_record["subspecies_COL_code"] = matched_record["match_id"]
-                for key, new_value in matched_record.items():
-
-                    # If not a tax name, simply add data from matched record
-                    if (key in non_tax_keys) or ("_COL_code" in key):
-                        combined_record[key] = new_value
-                        continue
-                    
-                    # Keep track of reclassifications
-                    for old_key, old_value in combined_record.items():
-                        if (old_value == new_value) and (old_key != key) and ("_COL_code" not in old_key) and (old_key not in non_tax_keys):
-                            combined_record[old_key] = None
-
-                            if id not in tax_reclass_log:
-                                tax_reclass_log[id] = []
-                            tax_reclass_log[id].append(f"{old_value} reclassified from {old_key} to {key}")
-                    
-                    old_value = combined_record.get(key)
-                    if new_value != old_value:
-
-                        # Tax updates
-                        if old_value != None: 
-                            if id not in tax_update_log:
-                                tax_update_log[id] = []
-                            tax_updated.append(key)
-                            tax_update_log[id].append(f"{key} changed from '{old_value}' to '{new_value}'")
-                            if key in higher_tax_list:
-                                if id not in high_tax_update_log:
-                                    high_tax_update_log[id] = []
-                                high_tax_update_log[id].append(f"WARNING: {key} changed from '{old_value}' to '{new_value}'")
-
-                        # Tax fills      
-                        if old_value == None:
-                            if id not in tax_fill_log:
-                                tax_fill_log[id] = []
-                            tax_filled.append(key)
-                            tax_fill_log[id].append(f"{key} classification '{new_value}' added")
-                        combined_record[key] = new_value
-
-                combined_record["date_last_modified"] = time.strftime("%Y-%m-%d %H:%M", time.localtime())
-                combined_record["tax_filled"] = tax_filled
-                combined_record["tax_updated"] = tax_updated
-                merged_data.append(combined_record)
+        for log, entries in ((tax_update_log, updates), (tax_fill_log, fills), (high_tax_update_log, high_updates), (tax_reclass_log, reclassifications)):
+            if entries:
+                log.setdefault(id, []).extend(entries)
             
-            elif matched_record['status'] == "synonym": 
-                if matched_record.get("subspecies") == None: # For when subspecies name is synonymous with species name
-                    combined_record["species_synonyms"] = combined_record["species"]
-                else:
-                    combined_record["subspecies_synonyms"] = combined_record["species"] # For when subspecies name has subspecies synonym
+    if report:
+        print("Matched data merged with AGSD records")
+ 
+    return(merged_data, tax_update_log, tax_fill_log, high_tax_update_log, tax_reclass_log)
 
-                for key, new_value in matched_record.items():
+# Runs a pipeline stage in its own thread: takes chunks from the input queue, applies the stage and passes the result on.
+# After a failure in any stage, remaining chunks are drained without processing, so no stage is left blocked on a full queue.
+def run_pipeline_stage(stage, input_queue, output_queue, failures):
+    while True:
+        chunk = input_queue.get()
+        if chunk is None:
+            break
+        if failures:
+            continue
+        try:
+            output_queue.put(stage(chunk))
+        except Exception as e:
+            failures.append(e)
+    output_queue.put(None)
+
+# Pipelined run of all stages (extraction, species matching, family matching, source lookup and merging) over chunks of records.
+# Chunks stream through bounded queues between stages running in their own threads, so source lookups for early chunks overlap
+# with the matching of later ones, and total run time is close to that of the slowest stage rather than the sum of all of them.
+# Resolved queries and source keys are shared between chunks, and the outputs are in the same order as a stage-by-stage run.
+# Stage busy times are recorded in the client's run metrics, and a progress bar replaces the per-chunk progress lines if given.
+# Records whose species or family queries (or source lookups) failed with an error are matched again in deferred retry passes
+# after the main pass, with their results replacing those of the main pass.
+# Given an output writer (CSVStreamWriter), the merged records are written to it (without the unneeded columns) as they are
+# merged, and "merged_data" is left empty, so the merged data is never held in memory as a whole.
+def run_pipeline(dataset, AGSD_records, client, species_checkpoint=None, family_checkpoint=None, source_key_checkpoint=None,
+                 chunk_size=PIPELINE_CHUNK_SIZE, queue_size=PIPELINE_QUEUE_SIZE, progress=None, retry_passes=ERROR_RETRY_PASSES,
+                 retry_backoff=ERROR_RETRY_BACKOFF, output=None):
+    print(f"Running pipeline against dataset {dataset} in chunks of {chunk_size} records...")
+    print(f"Start time {time.strftime('%H:%M:%S')}")
 
-                    # If not a tax name, simply add data from matched record
-                    if (key in non_tax_keys) or ("_COL_code" in key):
-                        combined_record[key] = new_value
-                        continue
-                    
-                    # Keep track of reclassifications
-                    for old_key, old_value in combined_record.items():
-                        if (old_value == new_value) and (old_key != key) and ("_COL_code" not in old_key) and (old_key not in non_tax_keys):
-                            combined_record[old_key] = None
-
-                            if id not in tax_reclass_log:
-                                tax_reclass_log[id] = []
-                            tax_reclass_log[id].append(f"{old_value} reclassified from {old_key} to {key}")
-                    
-                    old_value = combined_record.get(key)
-                    if new_value != old_value:
-
-                        # Tax updates
-                        if old_value != None: 
-                            if id not in tax_update_log:
-                                tax_update_log[id] = []
-                            tax_updated.append(key)
-                            tax_update_log[id].append(f"{key} changed from '{old_value}' to '{new_value}'")
-                            if key in higher_tax_list:
-                                if id not in high_tax_update_log:
-                                    high_tax_update_log[id] = []
-                                high_tax_update_log[id].append(f"WARNING: {key} changed from '{old_value}' to '{new_value}'")
-
-                        # Tax fills      
-                        if old_value == None:
-                            if id not in tax_fill_log:
-                                tax_fill_log[id] = []
-                            tax_filled.append(key)
-                            tax_fill_log[id].append(f"{key} classification '{new_value}' added")
-                        combined_record[key] = new_value
-
-                combined_record["date_last_modified"] = time.strftime("%Y-%m-%d %H:%M", time.localtime())
-                combined_record["tax_filled"] = tax_filled
-                combined_record["tax_updated"] = tax_updated
-                merged_data.append(combined_record)
-
-        ## FAMILY-LEVEL MATCHES
-        elif matched_record["query_rank"] == matched_record['match_rank'] == 'family':
-            matched_record["family"] = matched_record["query_name"]
-            matched_record["family_COL_code"] = matched_record['match_id']
-            combined_record = old_record.copy()
-
-            #  Merge for accepted name match
-            if matched_record["status"] in ("accepted","provisionally accepted"):
-                for key, new_value in matched_record.items():
-
-                    # If not a tax name, simply add data from matched record
-                    if (key in non_tax_keys) or ("_COL_code" in key):
-                        combined_record[key] = new_value
-                        continue
-                    
-                    # Keep track of reclassifications
-                    for old_key, old_value in combined_record.items():
-                        if (old_value == new_value) and (old_key != key) and ("_COL_code" not in old_key) and (old_key not in non_tax_keys):
-                            combined_record[old_key] = None
-
-                            if id not in tax_reclass_log:
-                                tax_reclass_log[id] = []
-                            tax_reclass_log[id].append(f"{old_value} reclassified from {old_key} to {key}")
-                    
-                    old_value = combined_record.get(key)
-                    if new_value != old_value:
-
-                        # Tax updates
-                        if old_value != None: 
-                            if id not in tax_update_log:
-                                tax_update_log[id] = []
-                            tax_updated.append(key)
-                            tax_update_log[id].append(f"{key} changed from '{old_value}' to '{new_value}'")
-                            if key in higher_tax_list:
-                                if id not in high_tax_update_log:
-                                    high_tax_update_log[id] = []
-                                high_tax_update_log[id].append(f"WARNING: {key} changed from '{old_value}' to '{new_value}'")
-
-                        # Tax fills      
-                        if old_value == None:
-                            if id not in tax_fill_log:
-                                tax_fill_log[id] = []
-                            tax_filled.append(key)
-                            tax_fill_log[id].append(f"{key} classification '{new_value}' added")
-                        combined_record[key] = new_value
-
-                combined_record["date_last_modified"] = time.strftime("%Y-%m-%d %H:%M", time.localtime())
-                combined_record["tax_filled"] = tax_filled
-                combined_record["tax_updated"] = tax_updated
-                merged_data.append(combined_record)
-
-            # Family synonyms
-            elif matched_record['status'] == "synonym":
-                combined_record['family_synonyms'] = combined_record["family"] # Moving old name to "synonyms" column
-                for key, new_value in matched_record.items():
-
-                    # If not a tax name, simply add data from matched record
-                    if (key in non_tax_keys) or ("_COL_code" in key):
-                        combined_record[key] = new_value
-                        continue
-                    
-                    # Keep track of reclassifications
-                    for old_key, old_value in combined_record.items():
-                        if (old_value == new_value) and (old_key != key) and ("_COL_code" not in old_key) and (old_key not in non_tax_keys):
-                            combined_record[old_key] = None
-
-                            if id not in tax_reclass_log:
-                                tax_reclass_log[id] = []
-                            tax_reclass_log[id].append(f"{old_value} reclassified from {old_key} to {key}")
-                    
-                    old_value = combined_record.get(key)
-                    if new_value != old_value:
-
-                        # Tax updates
-                        if old_value != None: 
-                            if id not in tax_update_log:
-                                tax_update_log[id] = []
-                            tax_updated.append(key)
-                            tax_update_log[id].append(f"{key} changed from '{old_value}' to '{new_value}'")
-                            if key in higher_tax_list:
-                                if id not in high_tax_update_log:
-                                    high_tax_update_log[id] = []
-                                high_tax_update_log[id].append(f"WARNING: {key} changed from '{old_value}' to '{new_value}'")
-
-                        # Tax fills      
-                        if old_value == None:
-                            if id not in tax_fill_log:
-                                tax_fill_log[id] = []
-                            tax_filled.append(key)
-                            tax_fill_log[id].append(f"{key} classification '{new_value}' added")
-                        combined_record[key] = new_value
-
-                combined_record["date_last_modified"] = time.strftime("%Y-%m-%d %H:%M", time.localtime())
-                combined_record["tax_filled"] = tax_filled
-                combined_record["tax_updated"] = tax_updated
-                merged_data.append(combined_record)
+    species_queries = {}
+    family_queries = {}
+    species_stats = {"records": 0, "unique_queries": 0}
+    family_stats = {"records": 0, "unique_queries": 0}
+    key_cache = {}
+    name_cache = {}
+    failures = []
+    merge_date = time.strftime("%Y-%m-%d %H:%M", time.localtime())
+    metrics = client.metrics
+
+    # Extraction time excludes the time spent waiting for space in the queue
+    def extract_stage(output_queue):
+        try:
+            chunk = []
+            start = time.perf_counter()
+            for record in AGSD_records:
+                if failures:
+                    break
+                chunk.append(record)
+                if len(chunk) >= chunk_size:
+                    metrics.record_stage("extract", time.perf_counter() - start, len(chunk))
+                    output_queue.put({"records": chunk})
+                    chunk = []
+                    start = time.perf_counter()
+            if chunk:
+                metrics.record_stage("extract", time.perf_counter() - start, len(chunk))
+                output_queue.put({"records": chunk})
+        except Exception as e:
+            failures.append(e)
+        output_queue.put(None)
+
+    # Runs a stage on a chunk, recording its busy time
+    def timed_stage(stage_name, stage):
+        def run_stage(chunk):
+            start = time.perf_counter()
+            chunk = stage(chunk)
+            metrics.record_stage(stage_name, time.perf_counter() - start, len(chunk["records"]))
+            return(chunk)
+        return(run_stage)
+
+    def species_stage(chunk):
+        chunk["matches"], chunk["unmatches"], chunk["match_issues"], chunk["match_errors"], classification = tax_namematch(
+            dataset, chunk["records"], "AGSD species", client, checkpoint=species_checkpoint, known_queries=species_queries, report=False,
+            stats=species_stats)
+        chunk["clean_matches"], chunk["ambiguous_matches"] = ambiguous_match_extract(chunk["matches"])
+        return(chunk)
+
+    # Species unmatches and ambiguous matches are re-queried separately, so their results can be put back in the order of a single pass
+    def family_stage(chunk):
+        chunk["family_results"] = [family_namematch(dataset, chunk[group], "all unmatched", client, family_checkpoint, known_queries=family_queries,
+                                                    report=False, stats=family_stats) for group in ("unmatches", "ambiguous_matches")]
+        return(chunk)
+
+    def source_stage(chunk):
+        chunk["source_errors"] = []
+        resolve_sources(dataset, [chunk["matches"]] + [family_results[0] for family_results in chunk["family_results"]], client,
+                        source_key_checkpoint, key_cache=key_cache, name_cache=name_cache, report=False, errors=chunk["source_errors"])
+        return(chunk)
+
+    queues = [queue.Queue(maxsize=queue_size) for stage in range(4)]
+    threads = [threading.Thread(target=extract_stage, args=(queues[0],), daemon=True)]
+    stages = (timed_stage("species_matching", species_stage), timed_stage("family_matching", family_stage), timed_stage("source_lookup", source_stage))
+    for stage, input_queue, output_queue in zip(stages, queues, queues[1:]):
+        threads.append(threading.Thread(target=run_pipeline_stage, args=(stage, input_queue, output_queue, failures), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    # Merging a chunk and adding its outputs to the results, returning its merged records
+    results = {"records": 0, "merged_data": [], "tax_updates": {}, "tax_fills": {}, "high_tax_updates": {}, "tax_reclass_log": {},
+               "matches": [], "match_issues": [], "match_errors": [], "family_matches": [[], []], "family_unmatches": [[], []],
+               "family_match_issues": [[], []], "family_match_errors": [[], []], "source_errors": []}
+
+    def merge_chunk(chunk):
+        start = time.perf_counter()
+        family_matches = chunk["family_results"][0][0] + chunk["family_results"][1][0]
+        merged_data, tax_updates, tax_fills, high_tax_updates, tax_reclass_log = data_merger(chunk["records"], chunk["clean_matches"] + family_matches,
+                                                                                             merge_date, report=False)
+        metrics.record_stage("merge", time.perf_counter() - start, len(chunk["records"]))
+        for log, entries in (("tax_updates", tax_updates), ("tax_fills", tax_fills), ("high_tax_updates", high_tax_updates), ("tax_reclass_log", tax_reclass_log)):
+            results[log].update(entries)
+        for output in ("matches", "match_issues", "match_errors", "source_errors"):
+            results[output] += chunk[output]
+        for position, family_results in enumerate(chunk["family_results"]):
+            for output, values in zip(("family_matches", "family_unmatches", "family_match_issues", "family_match_errors"), family_results):
+                results[output][position] += values
+        return(merged_data)
+
+    # The AGSD records of a chunk with a failed species or family query, or a failed source lookup
+    def failed_records(chunk):
+        failed_ids = {error["id"] for error in chunk["match_errors"] + chunk["source_errors"]}
+        failed_ids.update(error["id"] for family_results in chunk["family_results"] for error in family_results[3])
+        return([record for record in chunk["records"] if record["id"] in failed_ids])
+
+    # Merging chunks in the main thread, in record order, as they come out of the last stage. With an output writer, merged records
+    # are written out as each chunk is merged rather than kept in the results. Records to retry are copied first, as writing drops
+    # their query columns.
+    retry_records = []
+    record_order = {}
+    chunk_count = 0
+    while True:
+        chunk = queues[3].get()
+        if chunk is None:
+            break
+        if failures:
+            continue
 
+        retry_records += [record.copy() for record in failed_records(chunk)]
+        if output is None:
+            results["merged_data"] += merge_chunk(chunk)
         else:
-            combined_record["date_last_modified"] = time.strftime("%Y-%m-%d %H:%M", time.localtime())
-            merged_data.append(combined_record)
-            
-    print("Matched data merged with AGSD records")
- 
-    return(merged_data, tax_update_log, tax_fill_log, high_tax_update_log, tax_reclass_log)
+            output.writerows(remove_unneeded_columns(merge_chunk(chunk)))
+        for record in chunk["records"]:
+            record_order[record["id"]] = len(record_order)
+        results["records"] += len(chunk["records"])
+        chunk_count += 1
+        if progress:
+            progress.update(len(chunk["records"]))
+        else:
+            print(f"{results['records']} records matched and merged ({chunk_count} chunks)")
+
+    for thread in threads:
+        thread.join()
+    if progress:
+        progress.close()
+    if failures:
+        raise failures[0]
+
+    # Deferred retry passes, once the API has had time to recover. Failed queries are dropped from the resolved queries, and the
+    # outputs of the retried records are replaced with those of the retry.
+    for retry_pass in range(retry_passes):
+        if not retry_records:
+            break
+        print(f"Retrying {len(retry_records)} records with failed queries in {retry_backoff * 2 ** retry_pass} s (pass {retry_pass + 1} of {retry_passes})...")
+        time.sleep(retry_backoff * 2 ** retry_pass)
+
+        for known_queries in (species_queries, family_queries):
+            for key in [key for key, query_result in known_queries.items() if query_result[2]]:
+                del known_queries[key]
+        retry_ids = {record["id"] for record in retry_records}
+        for output_name in ("matches", "match_issues", "match_errors", "source_errors"):
+            results[output_name] = [entry for entry in results[output_name] if entry.get("id") not in retry_ids]
+        for output_name in ("family_matches", "family_unmatches", "family_match_issues", "family_match_errors"):
+            results[output_name] = [[entry for entry in entries if entry.get("id") not in retry_ids] for entries in results[output_name]]
+
+        chunk = {"records": retry_records}
+        for stage in stages:
+            chunk = stage(chunk)
+        retry_records = [record.copy() for record in failed_records(chunk)]
+        retried = {record["id"]: record for record in merge_chunk(chunk)}
+        if output is None:
+            results["merged_data"] = [retried.get(record["id"], record) for record in results["merged_data"]]
+        else:
+            output.replace(remove_unneeded_columns(list(retried.values())))
+        print(f"{len(retried) - len(retry_records)} of {len(retried)} records matched without error on retry")
+
+        # Putting the retried records' outputs back in record order
+        for output_name in ("matches", "match_issues", "match_errors", "source_errors"):
+            results[output_name].sort(key=lambda entry: record_order[entry["id"]])
+        for output_name in ("family_matches", "family_unmatches", "family_match_issues", "family_match_errors"):
+            for entries in results[output_name]:
+                entries.sort(key=lambda entry: record_order[entry["id"]])
+
+    for output_name in ("family_matches", "family_unmatches", "family_match_issues", "family_match_errors"):
+        results[output_name] = results[output_name][0] + results[output_name][1]
+
+    results["summary"] = match_summary(results, species_stats, family_stats)
+    summary = results["summary"]
+    record_count = results["records"]
+    print(f"Finished {time.strftime('%H:%M:%S')}")
+    if record_count:
+        print(f"{len(results['matches'])} records matched ({(len(results['matches'])/record_count)*100}%)")
+        print(f"{len(results['family_matches'])} records matched at family level ({(len(results['family_matches'])/record_count)*100}%)")
+        print(f"{len(results['family_unmatches'])} records unmatched ({(len(results['family_unmatches'])/record_count)*100}%)")
+        print(f"{summary['match_issues']} record match issues, {summary['family_match_issues']} family match issues")
+        print(f"{summary['match_errors']} record matches failed due to error")
+        print(f"{summary['source_errors']} matched records left without a source due to error")
+        print(f"{summary['GNV_corrected']} ({(summary['GNV_corrected']/record_count)*100}%) names corrected with GNverifier")
+        for stage in ("species_queries", "family_queries"):
+            queries = summary[stage]
+            if queries["records"]:
+                print(f"{stage.split('_')[0].capitalize()} matching: {queries['unique_queries']} unique queries for {queries['records']} records "
+                      f"(unique/total ratio {queries['unique_ratio']:.2f})")
+    print("-"*15)
+
+    return(results)
+
+# Totals of a pipeline run for the run report: records matched at each level, match issues, match and source lookup errors and
+# GNV corrected names, and for the species and family matching stages, the unique queries sent for the records matched (counting
+# re-matched records and re-sent queries of retry passes, and leaving out records resumed from a checkpoint)
+def match_summary(results, species_stats, family_stats):
+    summary = {
+        "records": results["records"],
+        "matches": len(results["matches"]),
+        "family_matches": len(results["family_matches"]),
+        "unmatched": len(results["family_unmatches"]),
+        "match_issues": len(results["match_issues"]),
+        "family_match_issues": len(results["family_match_issues"]),
+        "match_errors": len(results["match_errors"]) + len(results["family_match_errors"]),
+        "source_errors": len(results["source_errors"]),
+        "GNV_corrected": sum(1 for match in results["matches"] + results["family_matches"] if match.get("GNV_required") == "True")
+        }
+    for stage, stats in (("species_queries", species_stats), ("family_queries", family_stats)):
+        summary[stage] = {**stats, "unique_ratio": round(stats["unique_queries"] / stats["records"], 3) if stats["records"] else None}
+    return(summary)
+
+# Matching the same AGSD records against several ChecklistBank datasets at once, with a pipeline per dataset (each with its own
+# query caches), run on its own API client and writing to its own output writer. The records are parsed once, and each pipeline
+# matches and merges copies of them. Returns a dictionary of dataset: pipeline results
+def run_datasets(datasets, AGSD_records, clients, checkpoints=None, outputs=None, **kwargs):
+    checkpoints = checkpoints if checkpoints else {}
+    outputs = outputs if outputs else {}
+    with ThreadPoolExecutor(max_workers=len(datasets)) as executor:
+        pipelines = {dataset: executor.submit(run_pipeline, dataset, (record.copy() for record in AGSD_records), clients[dataset],
+                                              *checkpoints.get(dataset, ()), output=outputs.get(dataset), **kwargs) for dataset in datasets}
+    return({dataset: pipeline.result() for dataset, pipeline in pipelines.items()})
+
+# Side-by-side comparison of how every record matched against each dataset: the match level ("species" for low-order matches,
+# "family", "unmatched" or "error"), the matched name and its taxonomic status, and whether all datasets agree on the level and name.
+# Ambiguous low-order matches take the level of their family re-query.
+def dataset_comparison(AGSD_records, dataset_results):
+    record_matches = {}
+    for dataset, results in dataset_results.items():
+        for level, output_names in (("species", ("matches",)), ("family", ("family_matches",)), ("unmatched", ("family_unmatches",)),
+                                    ("error", ("match_errors", "family_match_errors"))):
+            for output_name in output_names:
+                for entry in results[output_name]:
+                    record_matches[(dataset, entry["id"])] = (level, entry.get(entry.get("match_rank") or ""), entry.get("status"))
+
+    comparison = []
+    for record in AGSD_records:
+        row = {"id": record["id"], "raw_name": record.get("raw_name")}
+        for dataset in dataset_results:
+            row[f"match_{dataset}"], row[f"name_{dataset}"], row[f"status_{dataset}"] = record_matches.get((dataset, record["id"]), (None, None, None))
+        row["datasets_agree"] = len({(row[f"match_{dataset}"], row[f"name_{dataset}"]) for dataset in dataset_results}) == 1
+        comparison.append(row)
+    return(comparison)
+
+# Match and query columns left out of the updated AGSD data
+UNNEEDED_COLUMNS = ["name_authorship", "GNV_edit_distance", "GNV_required", "issues", "match_id", "match_rank", "match_type", "nidx", "query_name", "query_rank", "raw_name", "scientific_name", "source_key", "status", "unranked", "unranked_COL_code"]
+
+# Column schema of the updated AGSD data, besides the AGSD columns themselves: the columns added when merging, and the ChecklistBank
+# ranks (with their COL codes) a match classification can fill in. Columns outside the schema still get written, at the cost of
+# a second pass over the output file.
+MERGE_COLUMNS = ["tax_filled", "tax_updated", "tax_source_name", "family_synonyms", "genus_synonyms", "species_synonyms", "subspecies_synonyms"]
+CLASSIFICATION_RANKS = ["kingdom", "phylum", "subphylum", "superclass", "class", "subclass", "infraclass", "superorder", "order", "suborder",
+                        "infraorder", "parvorder", "superfamily", "family", "subfamily", "tribe", "subtribe", "genus", "subgenus", "species", "subspecies"]
+GENOME_ENTRIES_COLUMNS = frozenset(MERGE_COLUMNS + CLASSIFICATION_RANKS + [f"{rank}_COL_code" for rank in CLASSIFICATION_RANKS])
 
 def remove_unneeded_columns(merged_data):
-    columns = ["name_authorship", "GNV_edit_distance", "GNV_required", "issues", "match_id", "match_rank", "match_type", "nidx", "query_name", "query_rank", "raw_name", "scientific_name", "source_key", "status", "unranked", "unranked_COL_code"]
     for record in merged_data:
-        for key in columns:
+        for key in UNNEEDED_COLUMNS:
             record.pop(key, None)
     return merged_data
 
-def results_to_csv(output_file, results_list):
+# Opening a .csv file for reading or writing, gzip compressed if its name ends in .gz
+def open_csv(csv_file, mode="r"):
+    if csv_file.endswith(".gz"):
+        return(gzip.open(csv_file, mode + "t", newline='', encoding="utf-8"))
+    return(open(csv_file, mode, newline='', encoding="utf-8"))
+
+# Streaming .csv writer, writing rows as they are produced rather than from a complete list, with the header taken from a known
+# column schema plus the columns of the first row (optionally gzip compressed, adding .gz to the file name).
+# Rows are written in one pass when all their columns are in the header. Columns outside it, rows replaced after being written
+# (eg. records re-matched in a retry pass) and, in incremental runs, rows carried over from the previous output are added on
+# close, in a second streaming pass over the file.
+class CSVStreamWriter:
+    def __init__(self, output_file, columns=(), compress=False):
+        self.output_file = output_file + ".gz" if compress and not output_file.endswith(".gz") else output_file
+        self.columns = set(columns)
+        self.file = None
+        self.writer = None
+        self.rows = 0
+        self.extra_values = {}
+        self.replacements = {}
+
+    def start(self, first_row=()):
+        self.columns.update(first_row)
+        self.file = open_csv(self.output_file, "w")
+        self.writer = csv.DictWriter(self.file, fieldnames=sorted(self.columns), extrasaction="ignore")
+        self.writer.writeheader()
+
+    def writerow(self, row):
+        if self.file is None:
+            self.start(row.keys())
+        extra_columns = row.keys() - self.columns
+        if extra_columns:
+            self.extra_values[self.rows] = {column: row[column] for column in extra_columns}
+        self.writer.writerow(row)
+        self.rows += 1
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    # Replacing already written rows with new rows with the same id
+    def replace(self, rows):
+        for row in rows:
+            self.replacements[row["id"]] = row
+
+    # Finishing the file. In incremental runs, the written (new or modified) rows are merged with the previous output rows, in
+    # the order of the current record ids.
+    def close(self, record_ids=None, previous_rows=None):
+        if self.file is None:
+            self.start()
+        self.file.close()
+        if self.extra_values or self.replacements or previous_rows is not None:
+            self.rewrite(record_ids, previous_rows)
+        print(f"{self.output_file} saved to the current directory")
+
+    def rewrite(self, record_ids, previous_rows):
+        columns = set(self.columns)
+        for values in self.extra_values.values():
+            columns.update(values)
+        for row in self.replacements.values():
+            columns.update(row.keys())
+        if previous_rows:
+            columns.update(next(iter(previous_rows.values())).keys())
+
+        # The temporary file keeps the output file's extension, so it is compressed the same way
+        output_folder, output_name = os.path.split(self.output_file)
+        temp_file = os.path.join(output_folder, f"tmp_{output_name}")
+        with open_csv(self.output_file) as source, open_csv(temp_file, "w") as target:
+            writer = csv.DictWriter(target, fieldnames=sorted(columns))
+            writer.writeheader()
+            rows = self.written_rows(csv.DictReader(source))
+            if previous_rows is None:
+                writer.writerows(rows)
+            else:
+                row = next(rows, None)
+                for id in record_ids:
+                    if row is not None and row["id"] == id:
+                        writer.writerow(row)
+                        row = next(rows, None)
+                    else:
+                        writer.writerow(previous_rows[id])
+        os.replace(temp_file, self.output_file)
+
+    # The rows read back from the file, with their extra column values added and replaced rows swapped in
+    def written_rows(self, reader):
+        for row_number, row in enumerate(reader):
+            row.update(self.extra_values.get(row_number, ()))
+            yield self.replacements.get(row.get("id"), row)
 
+# Saving a list of results to a .csv file, with the columns of all of the results
+def results_to_csv(output_file, results_list, compress=COMPRESS_OUTPUT):
     columns = set()
     for result in results_list:
         columns.update(result.keys())
-    
-    columns_sorted = sorted(columns)
 
-    with open(output_file, "w", newline='', encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=columns_sorted)
-        w.writeheader()
-        w.writerows(results_list)
+    writer = CSVStreamWriter(output_file, columns, compress)
+    writer.writerows(results_list)
+    writer.close()
+
+# Content hash of an AGSD record, used to find records that have changed since the previous run
+def record_hash(record):
+    return(hashlib.sha1(json.dumps(record_dict(record), sort_keys=True, default=str).encode("utf-8")).hexdigest())
 
-    print(f"{output_file} saved to the current directory")
+# Loading the id -> content hash manifest saved by the previous run, or None if there is none
+def load_manifest(manifest_file):
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, "r", encoding="utf-8") as file:
+        return(json.load(file))
+
+def save_manifest(manifest_file, record_hashes):
+    with open(manifest_file, "w", encoding="utf-8") as file:
+        json.dump(record_hashes, file)
+    print(f"{manifest_file} saved to the current directory")
+
+# Loading the rows of a previous genome_entries_updated .csv output, keyed by record id
+def load_previous_output(csv_file):
+    with open_csv(csv_file) as file:
+        return({row["id"]: row for row in csv.DictReader(file)})
+
+# Generator passing on the AGSD records that are new or modified since the previous run (or all records, without previous rows),
+# while adding the content hash of every record to record_hashes. Records are compared by content hash when the previous run's
+# manifest is available, otherwise by their "date_last_modified" against the previous output rows.
+def iter_changed_records(AGSD_records, record_hashes, previous_rows=None, manifest=None):
+    for record in AGSD_records:
+        id = record["id"]
+        record_hashes[id] = record_hash(record)
+        if previous_rows is None or id not in previous_rows:
+            yield record
+        elif manifest is not None:
+            if manifest.get(id) != record_hashes[id]:
+                yield record
+        elif (record.get("date_last_modified") or "") > (previous_rows[id].get("date_last_modified") or ""):
+            yield record
+
+# Merging the updated delta records into the previous output, in the order of the current AGSD record IDs.
+# Records that are no longer in the AGSD file are dropped.
+def merge_delta(record_ids, previous_rows, delta_data):
+    delta_lookup = {record["id"]: record for record in delta_data}
+    return([delta_lookup.get(id) or previous_rows[id] for id in record_ids])
 
 def log_to_txt(log, filename):
     os.makedirs("merge_log_files", exist_ok=True)
@@ -986,46 +2652,96 @@ if __name__ == "__main__":
     print("\n     " + "-"*38 + "\n      Welcome to the AGSD Taxonomy Updater \n     " + "-"*38 + "\n     Dylan Harding, 2025\n")
 
     AGSD_data = input("Please ensure the AGSD file you wish to check is in the same directory as this script, and enter the file name here: ")
-    dataset = input("Please enter the key for the ChecklistBank dataset you wish to check against. All datasets, including annual CoL releases can be found on the ChecklistBank website. (Eg. Col annual checklist = 310463): ")
+    datasets = [dataset.strip() for dataset in input("Please enter the key for the ChecklistBank dataset you wish to check against. All datasets, including annual CoL releases can be found on the ChecklistBank website. To compare several datasets, enter their keys separated by commas (Eg. Col annual checklist = 310463): ").split(",") if dataset.strip()]
+    previous_output = ""
+    checklist_archive = ""
+    if len(datasets) == 1:
+        previous_output = input("To only re-match records that are new or modified since a previous run, enter that run's genome_entries_updated .csv file (or leave blank to match all records): ").strip()
+        checklist_archive = input("To match names offline, enter the path of the dataset's downloaded ColDP or Darwin Core archive (or leave blank to use the ChecklistBank API): ").strip()
 
     username = "dylanharding"
     password = "mygbifpassword"
     
-    user_key = fetch_user_key(username, password)
-
-    AGSD_records = AGSD_data_extract(AGSD_data)
-
-    matches, unmatches, match_issues, match_errors, tax_classification_list = tax_namematch(dataset, AGSD_records, "AGSD species")
-    matches_with_source_keys = append_source_keys(dataset, matches)
-    matches_with_sources = append_source_names(dataset, matches_with_source_keys)
-
-    clean_matches, ambiguous_matches = ambiguous_match_extract(matches)
-    all_unmatched = unmatches + ambiguous_matches
-
-    family_matches, family_unmatches, family_match_issues, family_match_errors, higher_tax_class_list = family_namematch(dataset, all_unmatched, "all unmatched")
-    family_match_with_keys = append_source_keys(dataset, family_matches)
-    family_match_with_sources = append_source_names(dataset, family_match_with_keys)
-
-    all_matches_with_sources = clean_matches + family_matches
-    all_match_errors = match_errors + family_match_errors
-
-    merged_data, tax_updates, tax_fills, high_tax_updates, tax_reclass_log = data_merger(AGSD_records, all_matches_with_sources)
-
-    log_to_txt(tax_updates, "tax_update_log")
-    log_to_txt(tax_fills, "tax_fill_log")
-    log_to_txt(high_tax_updates, "high_tax_update_log")
-    log_to_txt(tax_reclass_log, "tax_reclassification_log")
-
-    print("Log file saved to 'merge_log_files' subfolder")
-
-    final_data = remove_unneeded_columns(merged_data)
-
+    # Each dataset has its own API client (and run metrics), sharing the rate limit, response cache and classification tree (which
+    # keep their entries by dataset)
+    response_cache = ResponseCache()
+    checklist = LocalChecklist(checklist_archive) if checklist_archive else None
+    rate_limiter = AdaptiveRateLimiter(REQUESTS_PER_SECOND)
+    classification_tree = ClassificationTree()
+    clients = {dataset: APIClient(username, password, response_cache, checklist=checklist, classification_tree=classification_tree,
+                                  rate_limiter=rate_limiter) for dataset in datasets}
+    
+    if not checklist:
+        user_key = fetch_user_key(clients[datasets[0]])
+
+    # Records are streamed from the .sql file into the pipeline. In incremental mode, only the records changed since the previous
+    # run are matched and merged.
+    manifest_file = f"AGSD_manifest_{datasets[0]}.json"
+    record_hashes = {}
+    previous_rows = load_previous_output(previous_output) if previous_output else None
+    AGSD_records = iter_changed_records(iter_AGSD_records_parallel(AGSD_data), record_hashes, previous_rows, load_manifest(manifest_file))
+
+    # Checkpoint journals for the matching passes, so that an interrupted run on the same file and dataset resumes where it stopped
+    checkpoints = {}
+    for dataset in datasets:
+        checkpoint_name = f"{CHECKPOINT_DIR}/{os.path.splitext(os.path.basename(AGSD_data))[0]}_{dataset}"
+        checkpoints[dataset] = (CheckpointJournal(f"{checkpoint_name}_species_matches.jsonl"), CheckpointJournal(f"{checkpoint_name}_family_matches.jsonl"),
+                                CheckpointJournal(f"{checkpoint_name}_source_keys.jsonl"))
+
+    # The progress bar needs the number of records up front, which takes an extra (API-free) pass over the .sql file
+    progress = None
+    if PROGRESS_BAR and len(datasets) == 1:
+        progress = ProgressBar(sum(1 for record in iter_changed_records(iter_AGSD_records_parallel(AGSD_data), {}, previous_rows, load_manifest(manifest_file))))
+
+    # The updated AGSD data is written out as records are merged. When comparing datasets, the outputs of each dataset are named
+    # after its key.
     date_str = time.strftime("%m_%Y")
-    results_to_csv(f"low_order_matches_{date_str}.csv", matches_with_sources)
-    results_to_csv(f"unmatched_records_{date_str}.csv", family_unmatches)
-    results_to_csv(f"match_error_log_{date_str}.csv", all_match_errors)
-    results_to_csv(f"family_level_matches_{date_str}.csv", family_matches)
-    results_to_csv(f"genome_entries_updated_{date_str}.csv", final_data)
-
-
-
+    output_suffixes = {dataset: f"{dataset}_{date_str}" if len(datasets) > 1 else date_str for dataset in datasets}
+    genome_entries = {dataset: CSVStreamWriter(f"genome_entries_updated_{output_suffixes[dataset]}.csv", GENOME_ENTRIES_COLUMNS, COMPRESS_OUTPUT)
+                      for dataset in datasets}
+
+    # The records of a single dataset are streamed into its pipeline, and several datasets are matched at once from one parse of
+    # the .sql file
+    if len(datasets) == 1:
+        dataset = datasets[0]
+        dataset_results = {dataset: run_pipeline(dataset, AGSD_records, clients[dataset], *checkpoints[dataset], progress=progress,
+                                                 output=genome_entries[dataset])}
+    else:
+        AGSD_records = list(AGSD_records)
+        dataset_results = run_datasets(datasets, AGSD_records, clients, checkpoints, genome_entries)
+    if previous_output:
+        print(f"Incremental run: {dataset_results[datasets[0]]['records']} of {len(record_hashes)} records were new or modified since the previous run")
+        print("-"*15)
+
+    for dataset, results in dataset_results.items():
+        log_suffix = f"_{dataset}" if len(datasets) > 1 else ""
+        log_to_txt(results["tax_updates"], f"tax_update_log{log_suffix}")
+        log_to_txt(results["tax_fills"], f"tax_fill_log{log_suffix}")
+        log_to_txt(results["high_tax_updates"], f"high_tax_update_log{log_suffix}")
+        log_to_txt(results["tax_reclass_log"], f"tax_reclassification_log{log_suffix}")
+
+        print("Log file saved to 'merge_log_files' subfolder")
+
+        output_suffix = output_suffixes[dataset]
+        results_to_csv(f"low_order_matches_{output_suffix}.csv", results["matches"])
+        results_to_csv(f"unmatched_records_{output_suffix}.csv", results["family_unmatches"])
+        results_to_csv(f"match_error_log_{output_suffix}.csv", results["match_errors"] + results["family_match_errors"] + results["source_errors"])
+        results_to_csv(f"family_level_matches_{output_suffix}.csv", results["family_matches"])
+        genome_entries[dataset].close(record_hashes, previous_rows)
+        save_manifest(f"AGSD_manifest_{dataset}.json", record_hashes)
+
+        # The run has finished, so its checkpoints are no longer needed
+        for checkpoint in checkpoints[dataset]:
+            checkpoint.remove()
+
+        clients[dataset].metrics.write_report(f"run_report_{output_suffix}.json", results["records"], response_cache, results["summary"])
+
+    if len(datasets) > 1:
+        results_to_csv(f"dataset_comparison_{date_str}.csv", dataset_comparison(AGSD_records, dataset_results))
+
+    response_cache.report()
+    response_cache.close()
+    for client in clients.values():
+        client.close()
+    if checklist:
+        checklist.close()
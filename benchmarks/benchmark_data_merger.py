@@ -0,0 +1,86 @@
+# Benchmark of data_merger throughput on synthetic AGSD records and ChecklistBank matches.
+# Usage: python benchmarks/benchmark_data_merger.py [number of records] [repeats]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AGSD_tax_updater import data_merger
+
+LINEAGES = [
+    {"kingdom": "Animalia", "phylum": "Chordata", "class": "Amphibia", "order": "Anura", "family": "Bufonidae"},
+    {"kingdom": "Animalia", "phylum": "Chordata", "class": "Amphibia", "order": "Anura", "family": "Ranidae"},
+    {"kingdom": "Animalia", "phylum": "Chordata", "class": "Mammalia", "order": "Rodentia", "family": "Muridae"},
+    {"kingdom": "Animalia", "phylum": "Arthropoda", "class": "Insecta", "order": "Coleoptera", "family": "Carabidae"},
+    {"kingdom": "Plantae", "phylum": "Tracheophyta", "class": "Magnoliopsida", "order": "Rosales", "family": "Rosaceae"}
+    ]
+MATCH_KINDS = [
+    ("species", "species", "accepted"), ("species", "species", "synonym"), ("genus", "genus", "accepted"),
+    ("genus", "genus", "synonym"), ("subspecies", "subspecies", "accepted"), ("subspecies_adjusted", "subspecies", "synonym"),
+    ("family", "family", "accepted"), ("family", "family", "synonym"), ("species", "genus", "accepted")
+    ]
+
+# Generating AGSD records and matches covering every merge rule, with a share of unmatched and ambiguous records
+def synthetic_records(record_count, seed=1):
+    rng = random.Random(seed)
+    AGSD_records = []
+    matched_list = []
+
+    for id in range(1, record_count + 1):
+        lineage = rng.choice(LINEAGES[:4])
+        genus = f"Genus{rng.randrange(500)}"
+        species = f"{genus} epithet{rng.randrange(20)}"
+        record = {
+            "id": str(id), "kingdom": None, "phylum": lineage["phylum"], "subphylum": None, "class": lineage["class"],
+            "subclass": None, "order": lineage["order"] if rng.random() < 0.8 else None, "suborder": None,
+            "family": lineage["family"] if rng.random() < 0.9 else rng.choice(LINEAGES)["family"], "subfamily": None,
+            "genus": genus if rng.random() < 0.5 else None, "species": species + rng.choice(["", "", " (4n)", " ssp."]),
+            "subspecies": None, "name_in_reference": None, "common_name": None, "c_value": f"{rng.random() * 10:.2f}",
+            "c_value_upper": None, "chrom_num": str(rng.randrange(10, 80)), "method": "Feulgen", "std_sp": None,
+            "entered_by": "RG", "date_entered": "2005-01-01", "date_last_modified": "2010-06-01 10:00:00", "comments": None,
+            "refs": "Ref. 1", "query_name": species, "query_rank": "species", "raw_name": species
+            }
+        AGSD_records.append(record)
+
+        if rng.random() < 0.15:
+            continue
+
+        query_rank, match_rank, status = rng.choice(MATCH_KINDS)
+        match_lineage = LINEAGES[4] if rng.random() < 0.02 else rng.choice(LINEAGES[:4])
+        match = {
+            "id": str(id), "raw_name": record["species"], "query_name": genus if match_rank == "genus" else species,
+            "query_rank": query_rank, "match_id": f"M{rng.randrange(100000)}",
+            "match_type": "ambiguous" if rng.random() < 0.03 else "exact", "status": status, "match_rank": match_rank,
+            "name_authorship": "Author, 1900", "nidx": str(rng.randrange(100000)), "issues": {},
+            "source_key": "1000", "tax_source_name": "Synthetic source"
+            }
+        if match_rank == "subspecies" or rng.random() < 0.05:
+            match["subspecies"] = f"{species} minor"
+            match["subspecies_COL_code"] = f"SS{id}"
+        if match_rank in ("species", "subspecies"):
+            match["species"] = species if status != "synonym" else f"{genus} renamed{rng.randrange(5)}"
+            match["species_COL_code"] = f"S{id}"
+        if match_rank != "family":
+            match["genus"] = genus
+            match["genus_COL_code"] = f"G{genus}"
+        for rank in ("family", "order", "class", "phylum", "kingdom"):
+            match[rank] = match_lineage[rank]
+            match[f"{rank}_COL_code"] = f"{rank[0].upper()}{match_lineage[rank]}"
+        matched_list.append(match)
+
+    return(AGSD_records, matched_list)
+
+if __name__ == "__main__":
+    record_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    timings = []
+    for repeat in range(repeats):
+        AGSD_records, matched_list = synthetic_records(record_count) # Fresh records each time, as merging updates the matched records
+        start = time.perf_counter()
+        data_merger(AGSD_records, matched_list)
+        timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    print(f"data_merger: {record_count} records ({len(matched_list)} matched), best of {repeats}: {best:.2f} s ({record_count/best:,.0f} records/s)")
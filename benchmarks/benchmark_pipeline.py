@@ -0,0 +1,95 @@
+# End-to-end and per-function throughput of the pipeline on synthetic AGSD dumps, against the local mock ChecklistBank/GNV
+# server (benchmarks/mock_api.py), so the live APIs are never called. For each dump size, AGSD_data_extract, tax_namematch,
+# family_namematch, resolve_sources, data_merger and results_to_csv are timed one after another, followed by a full
+# run_pipeline run writing its output as it goes. The client rate limit is lifted, so the mock latency and error rate set the pace.
+# Usage: python benchmarks/benchmark_pipeline.py [record counts, eg. 1000,10000,100000] [latency seconds] [error rate]
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import AGSD_tax_updater
+from AGSD_tax_updater import (GENOME_ENTRIES_COLUMNS, APIClient, AGSD_data_extract, CSVStreamWriter, ambiguous_match_extract, data_merger,
+                              family_namematch, iter_AGSD_records, remove_unneeded_columns, resolve_sources, results_to_csv, run_pipeline,
+                              tax_namematch)
+from mock_api import start_mock_server
+from synthetic_dump import write_synthetic_dump
+
+DATASET = "310463"
+REQUESTS_PER_SECOND = 100000
+
+# Running a function with its progress output hidden, returning its result and duration in seconds
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function(*args, **kwargs)
+    return(result, time.perf_counter() - start)
+
+def print_timing(name, record_count, seconds):
+    print(f"{name:<20} {record_count:>8} records {seconds:>9.2f} s {record_count/seconds if seconds else 0:>12,.0f} records/s")
+
+def benchmark(record_count, output_folder, mock_server):
+    dump_file = write_synthetic_dump(os.path.join(output_folder, f"synthetic_AGSD_{record_count}.sql"), record_count)
+    print(f"{record_count} records ({os.path.getsize(dump_file) / 1e6:.1f} MB dump)")
+
+    # Stage by stage, each with a fresh client so that no responses are re-used between runs
+    client = APIClient(requests_per_second=REQUESTS_PER_SECOND)
+    AGSD_records, seconds = timed(AGSD_data_extract, dump_file)
+    print_timing("AGSD_data_extract", len(AGSD_records), seconds - 1) # Less the one second pause in AGSD_data_extract
+
+    (matches, unmatches, match_issues, match_errors, classification), seconds = timed(tax_namematch, DATASET, AGSD_records, "AGSD species", client)
+    print_timing("tax_namematch", len(AGSD_records), seconds)
+
+    clean_matches, ambiguous_matches = ambiguous_match_extract(matches)
+    all_unmatched = unmatches + ambiguous_matches
+    (family_matches, family_unmatches, family_match_issues, family_match_errors, classification), seconds = timed(
+        family_namematch, DATASET, all_unmatched, "all unmatched", client)
+    print_timing("family_namematch", len(all_unmatched), seconds)
+
+    match_lists, seconds = timed(resolve_sources, DATASET, [matches, family_matches], client)
+    print_timing("resolve_sources", len(matches) + len(family_matches), seconds)
+
+    (merged_data, tax_updates, tax_fills, high_tax_updates, tax_reclass_log), seconds = timed(data_merger, AGSD_records, clean_matches + family_matches)
+    print_timing("data_merger", len(AGSD_records), seconds)
+
+    final_data = remove_unneeded_columns(merged_data)
+    result, seconds = timed(results_to_csv, os.path.join(output_folder, f"genome_entries_updated_{record_count}.csv"), final_data)
+    print_timing("results_to_csv", len(final_data), seconds)
+    client.close()
+
+    # End to end, with the stages overlapping in the pipeline
+    client = APIClient(requests_per_second=REQUESTS_PER_SECOND)
+    requests_before = mock_server.requests
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        output = CSVStreamWriter(os.path.join(output_folder, f"pipeline_entries_updated_{record_count}.csv"), GENOME_ENTRIES_COLUMNS)
+        results = run_pipeline(DATASET, iter_AGSD_records(dump_file), client, output=output)
+        output.close()
+    seconds = time.perf_counter() - start
+    print_timing("run_pipeline (total)", results["records"], seconds)
+
+    report = client.metrics.report(results["records"])
+    print(f"{mock_server.requests - requests_before} mock API requests, slowest stage: {report.get('slowest_stage')}")
+    for stage, counts in report["stages"].items():
+        print(f"  {stage:<18} {counts['seconds']:>9.2f} s busy")
+    client.close()
+    print("-"*15)
+
+if __name__ == "__main__":
+    record_counts = [int(count) for count in (sys.argv[1] if len(sys.argv) > 1 else "1000,10000,100000").split(",")]
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    error_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+
+    mock_server, AGSD_tax_updater.CHECKLISTBANK_API, AGSD_tax_updater.GNV_API = start_mock_server(latency=latency, error_rate=error_rate)
+    print(f"Mock API latency {latency} s, error rate {error_rate}")
+    print("-"*15)
+
+    with tempfile.TemporaryDirectory() as output_folder:
+        for record_count in record_counts:
+            benchmark(record_count, output_folder, mock_server)
+
+    mock_server.shutdown()
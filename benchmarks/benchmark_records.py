@@ -0,0 +1,70 @@
+# Memory use and merge throughput of the compact records used by the pipeline (CompactRecord, with interned values) against
+# plain dict records, on a synthetic AGSD dump. Memory is measured with tracemalloc as the size of the extracted records, and as
+# the peak while merging them with ChecklistBank-style matches (built for every record from the mock API taxonomy).
+# Usage: python benchmarks/benchmark_records.py [number of records]
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AGSD_tax_updater import clean_sql_value, data_merger, iter_AGSD_records, iter_sql_rows, match_result
+from mock_api import match_response
+from synthetic_dump import write_synthetic_dump
+
+# Extracting the dump as plain dict records, the way records were held before compact records
+def dict_records(dump_file):
+    records = []
+    for column_names, values in iter_sql_rows(dump_file):
+        record = dict(zip(column_names, [clean_sql_value(data) for data in values]))
+        species = record["subspecies"] or record["species"]
+        record.update({"query_name": species.split(" sp")[0], "query_rank": "species", "raw_name": species})
+        records.append(record)
+    return(records)
+
+# One match per record, for the records whose name is in the mock taxonomy
+def record_matches(records, compact):
+    matches = []
+    for record in records:
+        data = match_response(record["query_name"], "species")
+        if data.get("match"):
+            results, classification = match_result(data, record["query_name"], "species")
+            results = results.copy() if compact else results.as_dict()
+            results["id"] = record["id"]
+            results["raw_name"] = record["raw_name"]
+            matches.append(results)
+    return(matches)
+
+# Size in MB of the objects allocated by a function that are still held afterwards, the function's peak in MB, and its result
+def traced(function, *args):
+    gc.collect()
+    tracemalloc.start()
+    result = function(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return(current / 1e6, peak / 1e6, result)
+
+# Merging is timed without tracing, then repeated under tracemalloc (merging the same matches again gives the same result)
+def benchmark(dump_file, compact):
+    extract = (lambda dump_file: list(iter_AGSD_records(dump_file))) if compact else dict_records
+    records_mb, extract_peak_mb, records = traced(extract, dump_file)
+    matches = record_matches(records, compact)
+
+    start = time.perf_counter()
+    data_merger(records, matches, report=False)
+    seconds = time.perf_counter() - start
+    merged_mb, merge_peak_mb, results = traced(data_merger, records, matches, None, False)
+
+    print(f"{'CompactRecord' if compact else 'dict':<14} records {records_mb:>7.1f} MB (extract peak {extract_peak_mb:>7.1f} MB)   "
+          f"merged records {merged_mb:>7.1f} MB (merge peak {merge_peak_mb:>7.1f} MB)   merge {seconds:>6.2f} s ({len(records)/seconds:>9,.0f} records/s)")
+
+if __name__ == "__main__":
+    record_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as output_folder:
+        dump_file = write_synthetic_dump(os.path.join(output_folder, f"synthetic_AGSD_{record_count}.sql"), record_count)
+        print(f"{record_count} records ({os.path.getsize(dump_file) / 1e6:.1f} MB dump)")
+        for compact in (False, True):
+            benchmark(dump_file, compact)
@@ -0,0 +1,207 @@
+# Local mock of the ChecklistBank and GNV APIs used by the benchmarks, serving the match/nameusage, nameusage/{id}/source,
+# source/{key}, user/me and GNV verification endpoints over HTTP for a synthetic taxonomy, with configurable latency and error rate.
+# Usage: python benchmarks/mock_api.py [port] [latency seconds] [error rate]
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+# Higher classification of the synthetic families: (family, order, class, phylum)
+FAMILIES = [
+    ("Bufonidae", "Anura", "Amphibia", "Chordata"), ("Ranidae", "Anura", "Amphibia", "Chordata"),
+    ("Hylidae", "Anura", "Amphibia", "Chordata"), ("Salamandridae", "Caudata", "Amphibia", "Chordata"),
+    ("Muridae", "Rodentia", "Mammalia", "Chordata"), ("Cricetidae", "Rodentia", "Mammalia", "Chordata"),
+    ("Soricidae", "Eulipotyphla", "Mammalia", "Chordata"), ("Vespertilionidae", "Chiroptera", "Mammalia", "Chordata"),
+    ("Cyprinidae", "Cypriniformes", "Actinopterygii", "Chordata"), ("Cichlidae", "Cichliformes", "Actinopterygii", "Chordata"),
+    ("Salmonidae", "Salmoniformes", "Actinopterygii", "Chordata"), ("Colubridae", "Squamata", "Squamata", "Chordata"),
+    ("Carabidae", "Coleoptera", "Insecta", "Arthropoda"), ("Curculionidae", "Coleoptera", "Insecta", "Arthropoda"),
+    ("Drosophilidae", "Diptera", "Insecta", "Arthropoda"), ("Formicidae", "Hymenoptera", "Insecta", "Arthropoda"),
+    ("Nymphalidae", "Lepidoptera", "Insecta", "Arthropoda"), ("Gammaridae", "Amphipoda", "Malacostraca", "Arthropoda"),
+    ("Helicidae", "Stylommatophora", "Gastropoda", "Mollusca"), ("Lumbricidae", "Crassiclitellata", "Clitellata", "Annelida")
+    ]
+GENUS_SYLLABLES = ["bu", "ra", "my", "so", "ca", "te", "li", "pho", "ne", "dro", "xe", "la", "ti", "mo", "gal", "ser", "pel", "ory"]
+EPITHETS = ["alpha", "viridis", "major", "minor", "vulgaris", "montana", "sylvatica", "aquatica", "borealis", "australis",
+            "orientalis", "occidentalis", "elegans", "gracilis", "robusta", "nigra", "alba", "rufa", "flava", "maculata",
+            "striata", "punctata", "longipes", "brevipes", "magna", "parva", "tenuis", "crassa", "obscura", "lucida"]
+INFRASPECIFIC_EPITHETS = ["typica", "insularis", "remota"]
+GENUS_COUNT = 600
+SOURCE_COUNT = 25
+
+# Building the synthetic taxonomy: genera with their families, and the species and subspecies names of each genus.
+# Some name combinations are left out (they fall back to family-level matching), some are synonyms of another species,
+# and some are ambiguous.
+def synthetic_taxonomy(seed=1):
+    rng = random.Random(seed)
+    genera = {}
+    while len(genera) < GENUS_COUNT:
+        genus = "".join(rng.choice(GENUS_SYLLABLES) for syllable in range(rng.randrange(2, 4))).capitalize()
+        genera.setdefault(genus, rng.randrange(len(FAMILIES)))
+
+    names = {}
+    for genus_number, (genus, family) in enumerate(genera.items()):
+        names[(genus, "genus")] = {"id": f"G{genus_number}", "family": family, "genus": genus, "status": "accepted"}
+        for epithet_number, epithet in enumerate(EPITHETS):
+            if (genus_number + epithet_number) % 4 == 0:
+                continue
+            species = f"{genus} {epithet}"
+            usage = {"id": f"S{genus_number}_{epithet_number}", "family": family, "genus": genus, "species": species, "status": "accepted"}
+            if (genus_number * 7 + epithet_number) % 13 == 0:
+                usage["status"] = "synonym"
+                usage["species"] = f"{genus} {EPITHETS[(epithet_number + 1) % len(EPITHETS)]}"
+            if (genus_number + epithet_number * 3) % 41 == 0:
+                usage["match_type"] = "ambiguous"
+            names[(species, "species")] = usage
+            for infraspecific_number, infraspecific_epithet in enumerate(INFRASPECIFIC_EPITHETS):
+                if (genus_number + epithet_number + infraspecific_number) % 5 == 0:
+                    names[(f"{species} {infraspecific_epithet}", "subspecies")] = {
+                        "id": f"SS{genus_number}_{epithet_number}_{infraspecific_number}", "family": family, "genus": genus,
+                        "species": species, "subspecies": f"{species} {infraspecific_epithet}", "status": "accepted"}
+
+    for family_number, (family, order, class_name, phylum) in enumerate(FAMILIES):
+        names[(family, "family")] = {"id": f"F{family_number}", "family": family_number, "status": "accepted"}
+    return(genera, names)
+
+GENERA, NAMES = synthetic_taxonomy()
+NAMES_BY_STRING = {}
+for (name, rank) in NAMES:
+    NAMES_BY_STRING.setdefault(name, rank)
+
+# ChecklistBank match/nameusage response for a name and rank
+def match_response(name, rank):
+    if rank == "species" and len(name.split()) > 2:
+        return({"match": False, "issues": {"issues": ["subspecies assigned"]}})
+
+    usage = NAMES.get((name, rank))
+    if not usage:
+        return({"match": False, "issues": {}})
+
+    family_number = usage["family"]
+    family, order, class_name, phylum = FAMILIES[family_number]
+    classification = []
+    for classification_rank in ("subspecies", "species", "genus"):
+        if usage.get(classification_rank):
+            classification_usage = NAMES.get((usage[classification_rank], classification_rank), usage)
+            classification.append({"id": classification_usage["id"], "name": usage[classification_rank], "rank": classification_rank})
+    classification += [
+        {"id": f"F{family_number}", "name": family, "rank": "family"},
+        {"id": f"O{order}", "name": order, "rank": "order"},
+        {"id": f"C{class_name}", "name": class_name, "rank": "class"},
+        {"id": f"P{phylum}", "name": phylum, "rank": "phylum"},
+        {"id": "K1", "name": "Animalia", "rank": "kingdom"},
+        {"id": "U1", "name": "Biota", "rank": "unranked"}
+        ]
+
+    return({
+        "match": True,
+        "issues": {},
+        "usage": {
+            "id": usage["id"], "name": name, "authorship": "Author, 1900", "rank": rank, "status": usage["status"],
+            "namesIndexMatchType": usage.get("match_type", "exact"), "namesIndexId": f"N{usage['id']}", "classification": classification
+            }
+        })
+
+# GNV name result: names with one extra character (eg. "viridiss") are corrected to the name without it
+def verification_result(name):
+    candidates = [name] + [name[:position] + name[position + 1:] for position in range(len(name))]
+    for candidate in candidates:
+        rank = NAMES_BY_STRING.get(candidate)
+        if rank:
+            ranks = {"family": "kingdom|phylum|class|order|family", "genus": "kingdom|phylum|class|order|family|genus",
+                     "species": "kingdom|phylum|class|order|family|genus|species",
+                     "subspecies": "kingdom|phylum|class|order|family|genus|species|subspecies"}[rank]
+            return({"name": name, "matchType": "Exact" if candidate == name else "Fuzzy",
+                    "bestResult": {"matchedCanonicalFull": candidate, "editDistance": int(candidate != name), "classificationRanks": ranks}})
+    return({"name": name, "matchType": "NoMatch"})
+
+# Keep-alive HTTP/1.1 handler. Responses are buffered and sent in one write with Nagle's algorithm off, so keep-alive
+# connections are not held up by delayed acknowledgements.
+class MockAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wbufsize = 65536
+    disable_nagle_algorithm = True
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 503:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Applying the configured latency, and failing the request at the configured error rate
+    def simulate_conditions(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests += 1
+            failed = self.server.rng.random() < self.server.error_rate
+        if failed:
+            self.send_json({"error": "Service unavailable"}, 503)
+        return(failed)
+
+    def do_GET(self):
+        if self.simulate_conditions():
+            return
+        url = urlparse(self.path)
+        path = unquote(url.path)
+        query = parse_qs(url.query)
+        parts = path.strip("/").split("/")
+
+        if path.endswith("/match/nameusage"):
+            self.send_json(match_response(query["scientificName"][0], query["rank"][0]))
+        elif len(parts) >= 3 and parts[-1] == "source" and parts[-3] == "nameusage":
+            self.send_json({"sourceDatasetKey": 1000 + sum(map(ord, parts[-2])) % SOURCE_COUNT})
+        elif len(parts) >= 2 and parts[-2] == "source":
+            self.send_json({"key": parts[-1], "title": f"Synthetic source dataset {parts[-1]}"})
+        elif len(parts) >= 2 and parts[-2] == "verifications":
+            self.send_json({"names": [verification_result(parts[-1])]})
+        elif path.endswith("/user/me"):
+            self.send_json({"key": 1, "username": "benchmark"})
+        else:
+            self.send_json({"error": "Not found"}, 404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.simulate_conditions():
+            return
+        if self.path.rstrip("/").endswith("/verifications"):
+            payload = json.loads(body)
+            self.send_json({"metadata": {}, "names": [verification_result(name) for name in payload.get("nameStrings", [])]})
+        else:
+            self.send_json({"error": "Not found"}, 404)
+
+    def log_message(self, format, *args):
+        pass
+
+# Starting the mock server in a background thread. Returns the server and the base URLs to use in place of
+# CHECKLISTBANK_API and GNV_API.
+def start_mock_server(port=0, latency=0.0, error_rate=0.0, seed=1):
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockAPIHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.error_rate = error_rate
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    return(server, f"{base_url}/checklistbank", f"{base_url}/gnv")
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    error_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+
+    server, checklistbank_url, GNV_url = start_mock_server(port, latency, error_rate)
+    print(f"Mock ChecklistBank API at {checklistbank_url}, mock GNV API at {GNV_url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,88 @@
+# Writing synthetic AGSD genome entries .sql dumps for the benchmarks, with names drawn from the mock API taxonomy:
+# species and subspecies names, "sp." and "ssp." entries, misspelled names (corrected by the mock GNV), and unknown names.
+# Rows are written as multi-row INSERT statements of ROWS_PER_INSERT rows, or with tuple_per_line, as the AGSD dumps are laid
+# out: a single INSERT statement with one tuple per line.
+# Usage: python benchmarks/synthetic_dump.py [number of records] [output file] [tuple_per_line]
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_api import FAMILIES, NAMES
+
+AGSD_COLUMNS = ["id", "kingdom", "phylum", "sub_phylum", "class", "sub_class", "order_name", "sub_order", "family", "sub_family",
+                "genus", "species", "subspecies", "species_alt", "common_name", "c_value", "c_value_upper", "chrom_num", "method",
+                "std_sp", "entered_by", "date_entered", "date_last_modified", "comments", "refs"]
+ROWS_PER_INSERT = 1000
+
+def sql_value(value):
+    if value is None:
+        return("NULL")
+    if isinstance(value, int):
+        return(str(value))
+    return("'" + str(value).replace("\\", "\\\\").replace("'", "''") + "'")
+
+# Generating one AGSD row as a list of values in AGSD_COLUMNS order
+def synthetic_row(id, rng, species_names, subspecies_names, genera):
+    kind = rng.random()
+    subspecies = None
+    if kind < 0.70:
+        species = rng.choice(species_names)
+    elif kind < 0.78:
+        species = rng.choice(subspecies_names).rsplit(" ", 1)[0]
+        subspecies = rng.choice(subspecies_names)
+    elif kind < 0.83:
+        species = f"{rng.choice(genera)} sp."
+    elif kind < 0.86:
+        species = f"{rng.choice(species_names)} ssp."
+    elif kind < 0.93:
+        name = rng.choice(species_names)
+        position = rng.randrange(len(name.split(" ")[0]) + 1, len(name))
+        species = name[:position] + name[position] + name[position:]
+    elif kind < 0.95:
+        species = f"{rng.choice(species_names)} (4n)"
+    else:
+        species = f"{rng.choice(genera)} unknownus{rng.randrange(1000)}"
+
+    family, order, class_name, phylum = rng.choice(FAMILIES)
+    return([
+        id, None, phylum, None, class_name, None, order if rng.random() < 0.7 else None, None,
+        family if rng.random() < 0.9 else rng.choice(FAMILIES)[0], None, species.split(" ")[0] if rng.random() < 0.4 else None,
+        species, subspecies, None, None, f"{rng.random() * 10:.2f}", None, str(rng.randrange(10, 80)), rng.choice(["Feulgen", "FCM"]),
+        None, "BM", "2005-01-01", f"20{rng.randrange(10, 24)}-0{rng.randrange(1, 10)}-01 10:00:00",
+        rng.choice([None, "Note, with a comma", "It's quoted"]), "Ref. 1"
+        ])
+
+def write_synthetic_dump(output_file, record_count, seed=1, tuple_per_line=False):
+    rng = random.Random(seed)
+    species_names = [name for name, rank in NAMES if rank == "species"]
+    subspecies_names = [name for name, rank in NAMES if rank == "subspecies"]
+    genera = [name for name, rank in NAMES if rank == "genus"]
+
+    with open(output_file, "w", encoding="utf-8") as file:
+        file.write("-- Synthetic AGSD genome entries dump\n")
+        file.write("CREATE TABLE `genome_entries` (\n")
+        file.write(",\n".join(f"  `{column}` varchar(255) DEFAULT NULL" for column in AGSD_COLUMNS) + "\n")
+        file.write(") ENGINE=InnoDB DEFAULT CHARSET=utf8;\n\n")
+
+        if tuple_per_line:
+            file.write(f"INSERT INTO `genome_entries` ({', '.join(f'`{column}`' for column in AGSD_COLUMNS)}) VALUES\n")
+            rows = ("(" + ", ".join(sql_value(value) for value in synthetic_row(id, rng, species_names, subspecies_names, genera)) + ")"
+                    for id in range(1, record_count + 1))
+            file.write(",\n".join(rows) + ";\n")
+            return(output_file)
+
+        for start in range(1, record_count + 1, ROWS_PER_INSERT):
+            rows = [synthetic_row(id, rng, species_names, subspecies_names, genera) for id in range(start, min(start + ROWS_PER_INSERT, record_count + 1))]
+            file.write("INSERT INTO `genome_entries` VALUES ")
+            file.write(",".join("(" + ",".join(sql_value(value) for value in row) + ")" for row in rows))
+            file.write(";\n")
+
+    return(output_file)
+
+if __name__ == "__main__":
+    record_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    output_file = sys.argv[2] if len(sys.argv) > 2 else f"synthetic_AGSD_{record_count}.sql"
+    tuple_per_line = len(sys.argv) > 3 and sys.argv[3] == "tuple_per_line"
+    write_synthetic_dump(output_file, record_count, tuple_per_line=tuple_per_line)
+    print(f"{record_count} synthetic records saved to {output_file}")
@@ -0,0 +1,123 @@
+# Checks of the API client: the wait before a throttled (429/503) request is re-sent, with and without a Retry-After header,
+# the pause and rate decrease of the adaptive rate limiter, the bound on a request's total throttling wait, the cache hits
+# recorded in the run metrics, and the hedge budget.
+import email.utils
+import json
+import os
+import sys
+import time
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AGSD_tax_updater import AdaptiveRateLimiter, APIClient, ResponseCache, RunMetrics, global_names_batch_verifier, retry_after_seconds
+
+def fake_response(status_code, retry_after=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = "https://api.checklistbank.org/dataset/3LR/match/nameusage"
+    if retry_after is not None:
+        response.headers["Retry-After"] = retry_after
+    return(response)
+
+# Rate limiter that records the throttling waits it is given instead of sleeping
+class RecordingLimiter:
+    def __init__(self):
+        self.waits = []
+
+    def acquire(self):
+        pass
+
+    def success(self):
+        pass
+
+    def throttled(self, retry_after):
+        self.waits.append(retry_after)
+
+def test_backoff_without_retry_after_is_capped():
+    response = fake_response(503)
+    assert retry_after_seconds(response, 0, backoff=0.5, max_wait=60) == 0.5
+    assert retry_after_seconds(response, 3, backoff=0.5, max_wait=60) == 4
+    assert retry_after_seconds(response, 19, backoff=0.5, max_wait=60) == 60
+
+def test_retry_after_seconds_is_capped():
+    assert retry_after_seconds(fake_response(429, "12"), 0, max_wait=60) == 12
+    assert retry_after_seconds(fake_response(429, "86400"), 0, max_wait=60) == 60
+
+def test_retry_after_http_date():
+    soon = email.utils.formatdate(time.time() + 20, usegmt=True)
+    assert 15 <= retry_after_seconds(fake_response(503, soon), 0, max_wait=60) <= 20
+    next_week = email.utils.formatdate(time.time() + 7 * 86400, usegmt=True)
+    assert retry_after_seconds(fake_response(503, next_week), 0, max_wait=60) == 60
+    past = email.utils.formatdate(time.time() - 60, usegmt=True)
+    assert retry_after_seconds(fake_response(503, past), 0, max_wait=60) == 0
+
+def test_limiter_pauses_and_slows_down():
+    limiter = AdaptiveRateLimiter(10, min_rate=1, max_rate=20, decrease=0.5)
+    limiter.throttled(retry_after_seconds(fake_response(503), 19, max_wait=60))
+    assert limiter.rate == 5
+    assert limiter.paused_until - time.monotonic() <= 60
+    # A second throttled response during the pause only extends it, without slowing down again
+    limiter.throttled(2)
+    assert limiter.rate == 5
+
+def test_throttled_request_fails_after_total_wait():
+    limiter = RecordingLimiter()
+    client = APIClient(rate_limiter=limiter, retry_backoff=10, max_throttle_retries=20, max_throttle_wait=60, max_throttle_total_wait=100)
+    try:
+        with pytest.raises(requests.HTTPError):
+            client.timed_request("match/nameusage", lambda url: fake_response(503), "https://api.checklistbank.org/match")
+    finally:
+        client.close()
+
+    assert limiter.waits == [10, 20, 40]
+    counts = client.metrics.endpoints["match/nameusage"]
+    assert counts["throttled"] == 3 and counts["errors"] == 1
+
+def test_throttled_request_is_sent_again():
+    limiter = RecordingLimiter()
+    responses = [fake_response(429, "1"), fake_response(200)]
+    responses[1]._content = b'{"match": true}'
+    client = APIClient(rate_limiter=limiter)
+    try:
+        assert client.timed_request("match/nameusage", lambda url: responses.pop(0), "https://api.checklistbank.org/match") == {"match": True}
+    finally:
+        client.close()
+    assert limiter.waits == [1]
+
+# GNV names answered from the response cache are recorded as cache hits, like ChecklistBank responses, with the names sent to
+# GNV counted per name
+def test_GNV_cache_hits_are_recorded(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    client = APIClient(cache=cache, rate_limiter=RecordingLimiter())
+    sent = []
+    def post(url, **kwargs):
+        names = kwargs["json"]["nameStrings"]
+        sent.append(names)
+        response = fake_response(200)
+        response._content = json.dumps({"names": [{"name": name, "matchType": "NoMatch"} for name in names]}).encode()
+        return(response)
+    client.session.post = post
+    try:
+        global_names_batch_verifier([("Bufo bufo", "species"), ("Rana temporaria", "species")], client)
+        global_names_batch_verifier([("Bufo bufo", "species"), ("Mus musculus", "species")], client)
+    finally:
+        client.close()
+        cache.close()
+
+    assert sent == [["Bufo bufo", "Rana temporaria"], ["Mus musculus"]]
+    report = client.metrics.report()["endpoints"]["verifications"]
+    assert (report["requests"], report["names"], report["cache_hits"], report["cache_hit_ratio"]) == (2, 3, 1, 0.25)
+
+# The hedge budget and hedge rate are fractions of the primary requests, so sent hedges do not raise the budget
+def test_hedge_budget_leaves_out_hedges():
+    metrics = RunMetrics()
+    for request in range(1000):
+        metrics.record_request("match/nameusage", 0.1)
+    hedges = 0
+    while metrics.record_hedge("match/nameusage", 0.05):
+        metrics.record_request("match/nameusage", 0.1)
+        hedges += 1
+    assert hedges == 50
+    assert metrics.report()["endpoints"]["match/nameusage"]["hedge_rate"] == 0.05
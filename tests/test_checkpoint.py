@@ -0,0 +1,31 @@
+# Checks of the checkpoint journal of matched chunks: resuming from the entries of an interrupted run, including one whose last
+# entry was only partially written.
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AGSD_tax_updater import CheckpointJournal
+
+def test_resume_after_a_truncated_entry(tmp_path):
+    path = str(tmp_path / "checkpoints" / "AGSD_3LR.jsonl")
+    journal = CheckpointJournal(path, interval=1)
+    journal.record("chunk-0", {"matches": [{"id": "1", "species": "Bufo bufo"}]})
+    journal.record("chunk-1", {"matches": [{"id": "2", "species": "Rana temporaria"}]})
+    journal.close()
+
+    # A run interrupted while writing an entry
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(json.dumps({"key": "chunk-2", "value": {"matches": []}})[:20])
+
+    journal = CheckpointJournal(path)
+    assert list(journal.completed) == ["chunk-0", "chunk-1"]
+    assert journal.completed["chunk-1"]["matches"][0]["species"] == "Rana temporaria"
+
+    # New entries start on a line of their own, so the resumed run's entries are read back
+    journal.record("chunk-2", {"matches": [{"id": "3", "species": "Bufo viridis"}]})
+    journal.close()
+    journal = CheckpointJournal(path)
+    assert list(journal.completed) == ["chunk-0", "chunk-1", "chunk-2"]
+    journal.remove()
+    assert not os.path.exists(path)
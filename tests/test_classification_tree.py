@@ -0,0 +1,69 @@
+# Checks of the classification tree: answering genus and family match requests from the classifications of earlier species
+# matches, per dataset, and leaving ambiguous names and other ranks to the API.
+import json
+import os
+import sys
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AGSD_tax_updater import APIClient, ClassificationTree
+
+AMPHIBIA = [("O", "order", "Anura"), ("C", "class", "Amphibia"), ("P", "phylum", "Chordata"), ("K", "kingdom", "Animalia")]
+
+# match/nameusage response for a species, with its classification from the species up to the root
+def match_response(species_id, species, classification):
+    groups = [(species_id, "species", species)] + classification
+    return({"match": True, "issues": {}, "usage": {"id": species_id, "name": species, "rank": "species", "status": "accepted",
+                                                   "classification": [{"id": id, "rank": rank, "name": name} for id, rank, name in groups]}})
+
+BUFO_BUFO = match_response("SB", "Bufo bufo", [("GB", "genus", "Bufo"), ("FB", "family", "Bufonidae")] + AMPHIBIA)
+RANA_ARVALIS = match_response("RA", "Rana arvalis", [("GR", "genus", "Rana"), ("FR", "family", "Ranidae")] + AMPHIBIA)
+
+def test_genus_and_family_queries():
+    tree = ClassificationTree()
+    tree.add("3LR", BUFO_BUFO)
+    tree.add("3LR", RANA_ARVALIS)
+
+    genus = tree.get("match/nameusage", "3LR", "Bufo", "genus")
+    assert (genus["usage"]["id"], genus["usage"]["rank"], genus["usage"]["status"]) == ("GB", "genus", "accepted")
+    assert [group["name"] for group in genus["usage"]["classification"]] == ["Bufo", "Bufonidae", "Anura", "Amphibia", "Chordata", "Animalia"]
+
+    family = tree.get("match/nameusage", "3LR", "Ranidae", "family")
+    assert family["usage"]["id"] == "FR"
+    assert [group["rank"] for group in family["usage"]["classification"]] == ["family", "order", "class", "phylum", "kingdom"]
+
+# Species and higher ranks, names of another dataset, other endpoints and names without a single node are not answered
+def test_queries_left_to_the_API():
+    tree = ClassificationTree()
+    tree.add("3LR", BUFO_BUFO)
+    tree.add("3LR", match_response("XB", "Bufo homonymus", [("XG", "genus", "Bufo"), ("XF", "family", "Bufonidae")] + AMPHIBIA))
+    tree.add("3LR", RANA_ARVALIS)
+
+    assert tree.get("match/nameusage", "3LR", "Bufo", "genus") is None
+    assert tree.get("match/nameusage", "3LR", "Rana arvalis", "species") is None
+    assert tree.get("match/nameusage", "3LR", "Anura", "order") is None
+    assert tree.get("match/nameusage", "310463", "Rana", "genus") is None
+    assert tree.get("nameusage/source", "3LR", "Rana", "genus") is None
+
+# The API client adds the classifications of its match responses to the tree, and answers later genus queries from it
+def test_client_answers_from_the_tree():
+    client = APIClient(classification_tree=ClassificationTree())
+    sent = []
+    def get(url, **kwargs):
+        sent.append(url)
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = json.dumps(BUFO_BUFO).encode()
+        return(response)
+    client.session.get = get
+    try:
+        client.get("https://api.checklistbank.org/dataset/3LR/match/nameusage?q=Bufo%20bufo", ("match/nameusage", "3LR", "Bufo bufo", "species"))
+        genus = client.get("https://api.checklistbank.org/dataset/3LR/match/nameusage?q=Bufo", ("match/nameusage", "3LR", "Bufo", "genus"))
+    finally:
+        client.close()
+
+    assert len(sent) == 1 and genus["usage"]["id"] == "GB"
+    counts = client.metrics.endpoints["match/nameusage"]
+    assert (counts["requests"], counts["tree"]) == (1, 1)
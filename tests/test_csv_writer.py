@@ -0,0 +1,54 @@
+# Checks of the streaming .csv writer: rows written in one pass, the second pass adding columns first seen in a later row and
+# swapping in replaced rows, and gzip compressed output.
+import csv
+import gzip
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AGSD_tax_updater import CSVStreamWriter
+
+def read_rows(csv_file):
+    with (gzip.open(csv_file, "rt", newline="", encoding="utf-8") if csv_file.endswith(".gz") else open(csv_file, newline="", encoding="utf-8")) as file:
+        reader = csv.DictReader(file)
+        return(reader.fieldnames, list(reader))
+
+def test_rows_in_the_header_are_written_in_one_pass(tmp_path):
+    output_file = str(tmp_path / "genome_entries_updated.csv")
+    writer = CSVStreamWriter(output_file, ("id", "species"))
+    writer.writerows([{"id": "1", "species": "Bufo bufo", "genus": "Bufo"}, {"id": "2", "species": "Rana temporaria"}])
+    assert writer.extra_values == {}
+    writer.close()
+
+    columns, rows = read_rows(output_file)
+    assert columns == ["genus", "id", "species"]
+    assert rows == [{"genus": "Bufo", "id": "1", "species": "Bufo bufo"}, {"genus": "", "id": "2", "species": "Rana temporaria"}]
+
+# A column first seen in a later row is added to the header on close, with the earlier rows left empty
+def test_later_column_rewrites_the_file(tmp_path):
+    output_file = str(tmp_path / "low_order_matches.csv")
+    writer = CSVStreamWriter(output_file)
+    writer.writerow({"id": "1", "species": "Bufo bufo"})
+    writer.writerow({"id": "2", "species": "Bufo viridis", "species_synonyms": "Bufotes viridis"})
+    writer.writerow({"id": "3", "species": "Rana temporaria"})
+    writer.replace([{"id": "3", "species": "Rana arvalis", "GNV_edit_distance": 1}])
+    writer.close()
+
+    columns, rows = read_rows(output_file)
+    assert columns == ["GNV_edit_distance", "id", "species", "species_synonyms"]
+    assert [(row["id"], row["species"], row["species_synonyms"], row["GNV_edit_distance"]) for row in rows] == [
+        ("1", "Bufo bufo", "", ""), ("2", "Bufo viridis", "Bufotes viridis", ""), ("3", "Rana arvalis", "", "1")]
+    assert os.listdir(tmp_path) == ["low_order_matches.csv"]
+
+def test_gzip_output(tmp_path):
+    writer = CSVStreamWriter(str(tmp_path / "genome_entries_updated.csv"), ("id", "species"), compress=True)
+    assert writer.output_file.endswith("genome_entries_updated.csv.gz")
+    writer.writerow({"id": "1", "species": "Bufo bufo"})
+    writer.writerow({"id": "2", "species": "Bufo viridis", "species_synonyms": "Bufotes viridis"})
+    writer.close()
+
+    # The rewrite pass keeps the output compressed
+    columns, rows = read_rows(writer.output_file)
+    assert columns == ["id", "species", "species_synonyms"]
+    assert [row["species_synonyms"] for row in rows] == ["", "Bufotes viridis"]
+    assert os.listdir(tmp_path) == ["genome_entries_updated.csv.gz"]
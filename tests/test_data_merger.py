@@ -0,0 +1,150 @@
+# Checks of data_merger and its merge rules (MERGE_RULES): accepted and synonym species matches, genus-only, subspecies and
+# family matches, matches that are not merged (ambiguous, outside Animalia, or of another rank than the query), reclassifications,
+# and AGSD names kept with their qualifiers. Every case is merged both as plain dict records and as compact records.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AGSD_tax_updater import CompactRecord, data_merger, match_result, record_dict
+
+MERGE_DATE = "2026-01-01 00:00"
+AMPHIBIA = [("class", "Amphibia"), ("phylum", "Chordata"), ("kingdom", "Animalia")]
+
+# AGSD record with the given names, and every other rank empty
+def AGSD_record(id, query_name, query_rank, raw_name=None, **names):
+    record = {"id": id, "kingdom": "Animalia", "phylum": "Chordata", "class": "Amphibia", "order": "Anura", "family": None, "genus": None,
+              "species": None, "subspecies": None, "c_value": "0.76", "date_last_modified": "2020-01-01 10:00:00"}
+    record.update(names)
+    record.update({"query_name": query_name, "query_rank": query_rank, "raw_name": raw_name or query_name})
+    return(record)
+
+# Matched record built from a ChecklistBank-style match response, with the classification running from the matched name up
+def matched_record(record, rank, status, classification, match_type="exact"):
+    data = {"usage": {"id": f"{record['id']}-match", "namesIndexMatchType": match_type, "status": status, "rank": rank,
+                      "authorship": "Author, 1800", "namesIndexId": "1",
+                      "classification": [{"rank": tax_rank, "name": tax_name, "id": f"{tax_rank}:{tax_name}"} for tax_rank, tax_name in classification]},
+            "issues": {}}
+    results = match_result(data, record["query_name"], record["query_rank"])[0].as_dict()
+    results["id"] = record["id"]
+    results["raw_name"] = record["raw_name"]
+    return(results)
+
+@pytest.fixture(params=[False, True], ids=["dict", "compact"])
+def merge(request):
+    def merge(record, match):
+        if request.param:
+            record, match = CompactRecord.from_dict(record), CompactRecord.from_dict(match)
+        merged_data, updates, fills, high_updates, reclassifications = data_merger([record], [match], MERGE_DATE, report=False)
+        logs = [log.get(record["id"], []) for log in (updates, fills, high_updates, reclassifications)]
+        return((merged_data[0] if merged_data[0] is record else record_dict(merged_data[0])), *logs)
+    return(merge)
+
+def test_accepted_species(merge):
+    record = AGSD_record("1", "Bufo bufo", "species", species="Bufo bufo")
+    match = matched_record(record, "species", "accepted", [("species", "Bufo bufo"), ("genus", "Bufo"), ("family", "Bufonidae"), ("order", "Anura")] + AMPHIBIA)
+    merged, updates, fills, high_updates, reclassifications = merge(record, match)
+
+    assert (merged["species"], merged["genus"], merged["family"]) == ("Bufo bufo", "Bufo", "Bufonidae")
+    assert merged["species_COL_code"] == "1-match" and merged["genus_COL_code"] == "genus:Bufo"
+    assert merged["tax_filled"] == ["genus", "family"] and merged["tax_updated"] == []
+    assert merged["date_last_modified"] == MERGE_DATE and merged["c_value"] == "0.76"
+    assert fills == ["genus classification 'Bufo' added", "family classification 'Bufonidae' added"]
+    assert updates == high_updates == reclassifications == []
+
+# The old name moves to the synonym column, and the bracketed designation of the old name is kept
+def test_synonym_species(merge):
+    record = AGSD_record("2", "Bufo viridis", "species", raw_name="Bufo viridis (4n)", species="Bufo viridis (4n)", genus="Bufo", family="Bufonidae")
+    match = matched_record(record, "species", "synonym", [("species", "Bufotes viridis"), ("genus", "Bufotes"), ("family", "Bufonidae"),
+                                                          ("order", "Anura")] + AMPHIBIA)
+    merged, updates, fills, high_updates, reclassifications = merge(record, match)
+
+    assert merged["species_synonyms"] == "Bufo viridis (4n)"
+    assert (merged["species"], merged["genus"]) == ("Bufotes viridis (4n)", "Bufotes")
+    assert merged["tax_updated"] == ["species", "genus"]
+    assert updates == ["species changed from 'Bufo viridis (4n)' to 'Bufotes viridis (4n)'", "genus changed from 'Bufo' to 'Bufotes'"]
+
+# Subspecies returned with a species synonym match are dropped rather than recorded as a synonym
+def test_synonym_species_drops_subspecies(merge):
+    record = AGSD_record("3", "Bufo viridis", "species", species="Bufo viridis", genus="Bufo")
+    match = matched_record(record, "species", "synonym", [("subspecies", "Bufotes viridis viridis"), ("species", "Bufotes viridis"),
+                                                          ("genus", "Bufotes")] + AMPHIBIA)
+    merged = merge(record, match)[0]
+
+    assert merged["subspecies"] is None and merged["subspecies_COL_code"] is None
+    assert "species_synonyms" not in merged
+    assert merged["species"] == "Bufotes viridis"
+
+# Names queried at genus rank (eg. "sp." names) keep the AGSD name as the species
+def test_genus_only_match(merge):
+    record = AGSD_record("4", "Bufo", "genus", raw_name="Bufo sp.", species="Bufo sp.")
+    match = matched_record(record, "genus", "accepted", [("genus", "Bufo"), ("family", "Bufonidae"), ("order", "Anura")] + AMPHIBIA)
+    merged, updates, fills = merge(record, match)[:3]
+
+    assert (merged["genus"], merged["species"], merged["family"]) == ("Bufo", "Bufo sp.", "Bufonidae")
+    assert merged["genus_COL_code"] == "4-match"
+    assert updates == [] and merged["tax_filled"] == ["genus", "family"]
+
+def test_subspecies_match(merge):
+    record = AGSD_record("5", "Bufo viridis minor", "subspecies", species="Bufo viridis", subspecies="Bufo viridis minor", genus="Bufo")
+    match = matched_record(record, "subspecies", "accepted", [("subspecies", "Bufo viridis minor"), ("species", "Bufo viridis"), ("genus", "Bufo")] + AMPHIBIA)
+    merged = merge(record, match)[0]
+
+    assert merged["subspecies"] == "Bufo viridis minor"
+    assert merged["subspecies_COL_code"] == "5-match" and merged["species_COL_code"] == "species:Bufo viridis"
+    assert merged["tax_updated"] == [] and merged["tax_filled"] == []
+
+# Family matches (made for records without a species match) fill in the ranks above the family
+def test_family_match(merge):
+    record = AGSD_record("6", "Bufonidae", "family", raw_name="Bufo nonexistens", species="Bufo nonexistens", family="Bufonidae", order=None)
+    match = matched_record(record, "family", "accepted", [("family", "Bufonidae"), ("order", "Anura")] + AMPHIBIA)
+    merged, updates, fills = merge(record, match)[:3]
+
+    assert (merged["family"], merged["order"], merged["species"]) == ("Bufonidae", "Anura", "Bufo nonexistens")
+    assert merged["family_COL_code"] == "6-match"
+    assert fills == ["order classification 'Anura' added"] and updates == []
+
+def test_family_synonym_match(merge):
+    record = AGSD_record("7", "Discoglossidae", "family", raw_name="Alytes obstetricans", family="Discoglossidae")
+    match = matched_record(record, "family", "synonym", [("family", "Alytidae"), ("order", "Anura")] + AMPHIBIA)
+    merged = merge(record, match)[0]
+
+    assert merged["family_synonyms"] == "Discoglossidae"
+    assert merged["family_COL_code"] == "7-match"
+
+# A match without qualifiers keeps the AGSD name with its qualifiers, without logging an update
+def test_qualified_name_is_kept(merge):
+    record = AGSD_record("8", "Bufo viridis", "species", raw_name="Bufo viridis (4n)", species="Bufo viridis (4n)", genus="Bufo")
+    match = matched_record(record, "species", "accepted", [("species", "Bufo viridis"), ("genus", "Bufo")] + AMPHIBIA)
+    merged, updates = merge(record, match)[:2]
+
+    assert merged["species"] == "Bufo viridis (4n)"
+    assert updates == [] and merged["tax_updated"] == []
+
+# A name moving to another rank is removed from its old rank and logged as a reclassification
+def test_reclassification(merge):
+    record = AGSD_record("9", "Rana temporaria", "species", species="Rana temporaria", order="Ranidae")
+    match = matched_record(record, "species", "accepted", [("species", "Rana temporaria"), ("genus", "Rana"), ("family", "Ranidae"),
+                                                           ("order", "Anura")] + AMPHIBIA)
+    merged, updates, fills, high_updates, reclassifications = merge(record, match)
+
+    assert (merged["family"], merged["order"]) == ("Ranidae", "Anura")
+    assert reclassifications == ["Ranidae reclassified from order to family"]
+    assert fills == ["genus classification 'Rana' added", "family classification 'Ranidae' added", "order classification 'Anura' added"]
+    assert high_updates == []
+
+@pytest.mark.parametrize("match_type, status, kingdom, match_rank", [
+    ("ambiguous", "accepted", "Animalia", "species"),
+    ("exact", "ambiguous synonym", "Animalia", "species"),
+    ("exact", "accepted", "Plantae", "species"),
+    ("exact", "accepted", "Animalia", "genus"), # A genus match for a name queried at species rank
+    ])
+def test_matches_that_are_not_merged(merge, match_type, status, kingdom, match_rank):
+    record = AGSD_record("10", "Bufo bufo", "species", species="Bufo bufo")
+    match = matched_record(record, match_rank, status, [(match_rank, "Bufo bufo" if match_rank == "species" else "Bufo"), ("genus", "Bufo"),
+                                                        ("kingdom", kingdom)], match_type=match_type)
+    merged, updates, fills, high_updates, reclassifications = merge(record, match)
+
+    assert "tax_filled" not in merged and merged["genus"] is None
+    assert updates == fills == high_updates == reclassifications == []
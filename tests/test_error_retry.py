@@ -0,0 +1,56 @@
+# Checks of AGSD_error_retry.py: finding the AGSD records of logged match errors (by id, or by raw name for error logs written
+# before record ids were logged), and replacing the rows of re-matched records in the other outputs of a run in record order.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AGSD_error_retry import failed_AGSD_records, load_csv_rows, update_output
+from AGSD_tax_updater import results_to_csv
+
+DUMP = """-- AGSD genome entries
+INSERT INTO `genome_entries` (`id`, `kingdom`, `phylum`, `class`, `family`, `genus`, `species`, `subspecies`, `c_value`) VALUES
+(1, NULL, 'Chordata', 'Amphibia', 'Bufonidae', 'Bufo', 'Bufo bufo', NULL, '0.76'),
+(2, NULL, 'Chordata', 'Amphibia', 'Ranidae', 'Rana', 'Rana temporaria', NULL, '0.45'),
+(3, NULL, 'Chordata', 'Amphibia', 'Bufonidae', 'Bufo', 'Bufo viridis', 'Bufo viridis minor', '0.54'),
+(4, NULL, 'Chordata', 'Amphibia', 'Bufonidae', 'Bufo', 'Bufo bufo', NULL, '0.80');
+"""
+
+def write_dump(tmp_path):
+    dump_file = tmp_path / "AGSD.sql"
+    dump_file.write_text(DUMP, encoding="utf-8")
+    return(str(dump_file))
+
+def test_failed_records_by_id(tmp_path):
+    error_rows = [{"id": "3", "raw_name": "Bufo viridis minor", "query_name": "Bufo viridis minor", "error": "503"},
+                  {"id": "2", "raw_name": "Rana temporaria", "query_name": "Rana temporaria", "error": "503"}]
+    records = failed_AGSD_records(write_dump(tmp_path), error_rows)
+    assert [record["id"] for record in records] == ["2", "3"]
+    assert records[1]["raw_name"] == "Bufo viridis minor"
+
+# Error logs without record ids match every record with a logged raw name
+def test_failed_records_by_raw_name(tmp_path):
+    error_rows = [{"raw_name": "Bufo bufo", "query_name": "Bufo bufo", "error": "503"},
+                  {"id": "", "raw_name": "Bufo viridis minor", "query_name": "Bufo viridis minor", "error": "503"}]
+    records = failed_AGSD_records(write_dump(tmp_path), error_rows)
+    assert [record["id"] for record in records] == ["1", "3", "4"]
+
+def test_unknown_errors_match_no_records(tmp_path):
+    error_rows = [{"id": "9", "raw_name": "Bufo bufo", "error": "503"}, {"id": "", "raw_name": "Mus musculus", "error": "503"}]
+    assert failed_AGSD_records(write_dump(tmp_path), error_rows) == []
+
+# Re-matched rows take the place of the old rows with the same id, and rows new to the output are put in record order
+def test_update_output_keeps_record_order(tmp_path):
+    output_file = str(tmp_path / "low_order_matches.csv")
+    results_to_csv(output_file, [{"id": id, "scientific_name": f"old {id}"} for id in ("1", "3", "5", "7")], compress=False)
+
+    new_rows = [{"id": "6", "scientific_name": "new 6"}, {"id": "3", "scientific_name": "new 3"}, {"id": "2", "scientific_name": "new 2"}]
+    update_output(output_file, {"2", "3", "5", "6"}, new_rows, record_order=[str(id) for id in range(1, 9)])
+    assert [(row["id"], row["scientific_name"]) for row in load_csv_rows(output_file)] == [
+        ("1", "old 1"), ("2", "new 2"), ("3", "new 3"), ("6", "new 6"), ("7", "old 7")]
+
+def test_update_output_without_record_order(tmp_path):
+    output_file = str(tmp_path / "unmatched_records.csv")
+    results_to_csv(output_file, [{"id": id, "species": f"old {id}"} for id in ("1", "3", "5")], compress=False)
+
+    update_output(output_file, {"2", "3"}, [{"id": "2", "species": "new 2"}, {"id": "3", "species": "new 3"}])
+    assert [row["id"] for row in load_csv_rows(output_file)] == ["1", "3", "5", "2"]
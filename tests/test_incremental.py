@@ -0,0 +1,43 @@
+# Checks of incremental runs: finding the records that are new or changed since the previous run through the manifest of record
+# content hashes (or by modification date without one), and merging their rows into the previous output, dropping deleted records.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AGSD_tax_updater import CSVStreamWriter, iter_changed_records, load_manifest, load_previous_output, record_hash, save_manifest
+
+def AGSD_record(id, species, date_last_modified="2024-01-01 10:00:00"):
+    return({"id": id, "genus": species.split()[0], "species": species, "date_last_modified": date_last_modified})
+
+PREVIOUS_RECORDS = [AGSD_record("1", "Bufo bufo"), AGSD_record("2", "Bufo viridis"), AGSD_record("3", "Rana temporaria")]
+
+def test_manifest_finds_changed_records(tmp_path):
+    manifest_file = str(tmp_path / "AGSD_manifest_3LR.json")
+    assert load_manifest(manifest_file) is None
+    save_manifest(manifest_file, {record["id"]: record_hash(record) for record in PREVIOUS_RECORDS})
+    previous_rows = {record["id"]: dict(record, species_COL_code="old") for record in PREVIOUS_RECORDS}
+
+    # Record 2 changed without a new modification date, record 3 was deleted and record 4 is new
+    records = [AGSD_record("1", "Bufo bufo"), AGSD_record("2", "Bufotes viridis"), AGSD_record("4", "Rana arvalis")]
+    record_hashes = {}
+    changed = list(iter_changed_records(records, record_hashes, previous_rows, load_manifest(manifest_file)))
+    assert [record["id"] for record in changed] == ["2", "4"]
+    assert list(record_hashes) == ["1", "2", "4"] and record_hashes["1"] == record_hash(PREVIOUS_RECORDS[0])
+
+    # The new output holds the unchanged row from the previous output and the new rows, without the deleted record
+    output_file = str(tmp_path / "genome_entries_updated.csv")
+    writer = CSVStreamWriter(output_file, ("id", "genus", "species", "date_last_modified"))
+    writer.writerows(dict(record, species_COL_code="new") for record in changed)
+    writer.close(record_hashes, previous_rows)
+    rows = load_previous_output(output_file)
+    assert [(id, row["species"], row["species_COL_code"]) for id, row in rows.items()] == [
+        ("1", "Bufo bufo", "old"), ("2", "Bufotes viridis", "new"), ("4", "Rana arvalis", "new")]
+
+# Without a manifest, records are compared by their modification date
+def test_changed_records_by_date_without_manifest():
+    previous_rows = {record["id"]: record for record in PREVIOUS_RECORDS}
+    records = [AGSD_record("1", "Bufo bufo"), AGSD_record("2", "Bufotes viridis"), AGSD_record("3", "Rana temporaria", "2025-06-01 09:00:00")]
+    assert [record["id"] for record in iter_changed_records(records, {}, previous_rows)] == ["3"]
+
+    # Without previous rows, every record is passed on
+    assert len(list(iter_changed_records(records, {}))) == 3
@@ -0,0 +1,96 @@
+# Checks of the offline checklist: indexing a ColDP archive (as an extracted folder), re-indexing it when one of its files
+# is replaced with a new release, and the local fuzzy matching of misspelled names.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AGSD_tax_updater import GNV_best_match, LocalChecklist
+
+HEADER = "col:ID\tcol:parentID\tcol:status\tcol:rank\tcol:scientificName\tcol:authorship\tcol:sourceID\n"
+USAGES = [
+    ("K", "", "accepted", "kingdom", "Animalia", ""),
+    ("P", "K", "accepted", "phylum", "Chordata", ""),
+    ("C", "P", "accepted", "class", "Amphibia", ""),
+    ("O", "C", "accepted", "order", "Anura", ""),
+    ("FB", "O", "accepted", "family", "Bufonidae", "Gray, 1825"),
+    ("FR", "O", "accepted", "family", "Ranidae", "Batsch, 1796"),
+    ("GB", "FB", "accepted", "genus", "Bufo", "Garsault, 1764"),
+    ("GT", "FB", "accepted", "genus", "Bufotes", "Rafinesque, 1815"),
+    ("GR", "FR", "accepted", "genus", "Rana", "Linnaeus, 1758"),
+    ("SB", "GB", "accepted", "species", "Bufo bufo", "(Linnaeus, 1758)"),
+    ("SS", "GB", "accepted", "species", "Bufo spinosus", "Daudin, 1803"),
+    ("SV", "GT", "accepted", "species", "Bufotes viridis", "(Laurenti, 1768)"),
+    ("SY", "SV", "synonym", "species", "Bufo viridis", "Laurenti, 1768"),
+    ("RT", "GR", "accepted", "species", "Rana temporaria", "Linnaeus, 1758"),
+    ("RA", "GR", "accepted", "species", "Rana arvalis", "Nilsson, 1842"),
+    ]
+
+def write_archive(folder, usages):
+    os.makedirs(folder / "source", exist_ok=True)
+    with open(folder / "NameUsage.tsv", "w", encoding="utf-8") as file:
+        file.write(HEADER + "".join("\t".join(usage + ("1000",)) + "\n" for usage in usages))
+    (folder / "source" / "1000.yaml").write_text("key: 1000\ntitle: 'Amphibian Species of the World'\n", encoding="utf-8")
+    return(str(folder))
+
+def indexed_names(checklist):
+    return({row[0] for row in checklist.connection.execute("SELECT name FROM usages")})
+
+def test_folder_is_reindexed_when_a_file_is_replaced(tmp_path):
+    archive = write_archive(tmp_path / "coldp", USAGES)
+    checklist = LocalChecklist(archive)
+    version = checklist.archive_version()
+    assert "Rana arvalis" in indexed_names(checklist)
+    checklist.close()
+
+    # Re-opening the unchanged folder re-uses the index
+    checklist = LocalChecklist(archive)
+    assert checklist.archive_version() == version
+    checklist.close()
+
+    # A new release written in place, with the folder's own size and modification time unchanged
+    folder_stat = os.stat(archive)
+    usages = [usage if usage[0] != "RA" else ("RA", "GR", "accepted", "species", "Rana dalmatina", "Fitzinger, 1839") for usage in USAGES]
+    write_archive(tmp_path / "coldp", usages)
+    usage_file = os.path.join(archive, "NameUsage.tsv")
+    os.utime(usage_file, (folder_stat.st_atime, folder_stat.st_mtime + 10))
+    os.utime(archive, (folder_stat.st_atime, folder_stat.st_mtime))
+
+    checklist = LocalChecklist(archive)
+    assert checklist.archive_version() != version
+    assert "Rana dalmatina" in indexed_names(checklist) and "Rana arvalis" not in indexed_names(checklist)
+    checklist.close()
+
+@pytest.fixture
+def checklist(tmp_path):
+    checklist = LocalChecklist(write_archive(tmp_path / "coldp", USAGES))
+    yield checklist
+    checklist.close()
+
+# Misspellings within two edits in total, split between the genus and the epithet
+@pytest.mark.parametrize("name, matched_name, distance", [
+    ("Bufo bufo", "Bufo bufo", 0),
+    ("Bufo bufoo", "Bufo bufo", 1),
+    ("Rana temporia", "Rana temporaria", 2),
+    ("Rama arvalis", "Rana arvalis", 1),
+    ("Ranna temporaia", "Rana temporaria", 2),
+    ("Bufonidea", "Bufonidae", 2),
+    ("Ranx", "Rana", 1),
+    ])
+def test_fuzzy_match(checklist, name, matched_name, distance):
+    result = checklist.verify(name)
+    assert result["matchType"] == ("Exact" if distance == 0 else "Fuzzy")
+    assert (result["bestResult"]["matchedCanonicalFull"], result["bestResult"]["editDistance"]) == (matched_name, distance)
+
+# The edit distances of the genus and the epithet add up, so a name more than two edits away is not matched
+@pytest.mark.parametrize("name", ["Ranna temporia", "Hyla arborea", ""])
+def test_no_fuzzy_match(checklist, name):
+    assert checklist.verify(name) is None
+
+# Local results are only used for the rank they were queried at, as GNV results are
+def test_fuzzy_match_rank_check(checklist):
+    assert GNV_best_match(checklist.verify("Bufo bufoo"), "species") == ("Bufo bufo", 1)
+    assert GNV_best_match(checklist.verify("Bufo bufoo"), "genus") == (None, None)
+    assert GNV_best_match(checklist.verify("Bufonidea"), "family") == ("Bufonidae", 2)
+    assert GNV_best_match(checklist.verify("Bufonidea"), "genus") == (None, None)
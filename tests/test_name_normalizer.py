@@ -0,0 +1,67 @@
+# Checks of the canonical names, qualifiers and query names and ranks given by AGSD_name_normalizer for the name forms found in
+# AGSD records: bracketed designations, open nomenclature markers, subgenera, author strings, capitalisation and whitespace.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AGSD_name_normalizer import canonical_name, name_key, normalize_name, normalize_query, query_key
+
+@pytest.mark.parametrize("name, canonical, qualifiers", [
+    ("Bufo viridis (4n)", "Bufo viridis", ("(4n)",)),
+    ("Bufo viridis (2n) ssp. minor", "Bufo viridis", ("(2n)", "ssp. minor")),
+    ("Bufo cf. viridis", "Bufo viridis", ("cf.",)),
+    ("Bufo cf viridis", "Bufo viridis", ("cf",)),
+    ("Bufo aff. viridis", "Bufo", ("aff. viridis",)),
+    ("Bufo nr. viridis", "Bufo", ("nr. viridis",)),
+    ("Bufo sp.", "Bufo", ("sp.",)),
+    ("Bufo sp. nov.", "Bufo", ("sp. nov.",)),
+    ("Bufo sp. A", "Bufo", ("sp. A",)),
+    ("Bufo sp.1", "Bufo", ("sp.1",)),
+    ("Bufo viridis ssp. minor", "Bufo viridis", ("ssp. minor",)),
+    ("Bufo viridis subsp. minor", "Bufo viridis", ("subsp. minor",)),
+    ("Mus (Mus) musculus", "Mus musculus", ("(Mus)",)),
+    ("Mus musculus Linnaeus, 1758", "Mus musculus", ()),
+    ("Rana temporaria Linnaeus 1758", "Rana temporaria", ()),
+    ("Bufo bufo (Linnaeus, 1758)", "Bufo bufo", ()),
+    ("Ichthyosaura alpestris de Filippi, 1861", "Ichthyosaura alpestris", ()),
+    ("Pelophylax lessonae Camerano & Boulenger, 1882", "Pelophylax lessonae", ()),
+    ("Bufo viridis viridis Laurenti, 1768", "Bufo viridis viridis", ()),
+    ("Bufonidae Gray, 1825", "Bufonidae", ()),
+    ("Bufo Viridis", "Bufo viridis", ()),
+    ("bufo VIRIDIS", "Bufo viridis", ()),
+    ("  Bufo   viridis\t", "Bufo viridis", ()),
+    ])
+def test_normalize_name(name, canonical, qualifiers):
+    assert normalize_name(name) == (canonical, qualifiers)
+    assert canonical_name(name) == canonical
+
+def test_empty_name():
+    assert normalize_name("") == (None, ())
+    assert normalize_name(None) == (None, ())
+
+@pytest.mark.parametrize("species, subspecies, query", [
+    ("Bufo viridis", None, ("Bufo viridis", "species")),
+    ("Bufo viridis (4n)", None, ("Bufo viridis", "species")),
+    ("Bufo cf. viridis", None, ("Bufo viridis", "species")),
+    ("Bufo aff. viridis", None, ("Bufo", "genus")),
+    ("Bufo nr. viridis", None, ("Bufo", "genus")),
+    ("Bufo sp.", None, ("Bufo", "genus")),
+    ("Bufo sp. nov.", None, ("Bufo", "genus")),
+    ("Bufo", None, ("Bufo", "genus")),
+    ("Bufo viridis ssp. minor", None, ("Bufo viridis", "species")),
+    ("Bufo viridis", "Bufo viridis subsp. minor", ("Bufo viridis", "species")),
+    ("Bufo viridis", "Bufo viridis minor", ("Bufo viridis minor", "subspecies")),
+    ("Bufo viridis minor", None, ("Bufo viridis minor", "species")),
+    ("Mus (Mus) musculus Linnaeus, 1758", None, ("Mus musculus", "species")),
+    ("  bufo   Viridis ", None, ("Bufo viridis", "species")),
+    ])
+def test_normalize_query(species, subspecies, query):
+    assert normalize_query(species, subspecies)[:2] == query
+
+# Names that differ only in qualifiers, authors, case or whitespace send the same query
+def test_query_key_groups_name_variants():
+    names = ["Bufo viridis", "Bufo viridis (4n)", "Bufo cf. viridis", "bufo  Viridis", "Bufo viridis Laurenti, 1768"]
+    assert len({query_key(*normalize_query(name)[:2]) for name in names}) == 1
+    assert name_key(" Bufo  Viridis ") == "bufo viridis"
@@ -0,0 +1,45 @@
+# Checks of the compact records used for AGSD records and match results: dict behaviour, shared shapes, and setting several keys
+# at once through a cached update plan.
+import os
+import pickle
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AGSD_tax_updater import CompactRecord, RecordShape
+
+def test_behaves_like_a_dict():
+    record = CompactRecord.from_dict({"id": "1", "genus": "Bufo", "species": None})
+    record["family"] = "Bufonidae"
+    del record["species"]
+    assert record == {"id": "1", "genus": "Bufo", "family": "Bufonidae"}
+    assert list(record) == ["id", "genus", "family"]
+    assert record.get("species", "missing") == "missing"
+    assert record.pop("family") == "Bufonidae" and "family" not in record
+    assert pickle.loads(pickle.dumps(record)).as_dict() == {"id": "1", "genus": "Bufo"}
+
+def test_records_built_the_same_way_share_shapes():
+    first = CompactRecord.from_dict({"id": "1", "genus": "Bufo"})
+    second = CompactRecord.from_dict({"id": "2", "genus": "Rana"})
+    first["family"] = "Bufonidae"
+    second["family"] = "Ranidae"
+    assert first.shape is second.shape
+    assert first.shape is RecordShape.for_keys(("id", "genus", "family"))
+
+def test_update_sets_existing_and_new_keys():
+    record = CompactRecord.from_dict({"id": "1", "genus": "Bufo", "species": "Bufo bufo"})
+    copy = record.copy()
+    record.update([("species", "Bufo viridis"), ("status", "accepted"), ("genus", "Bufotes"), ("status", "synonym")], tax_filled=["genus"])
+    assert record.as_dict() == {"id": "1", "genus": "Bufotes", "species": "Bufo viridis", "status": "synonym", "tax_filled": ["genus"]}
+    assert copy.as_dict() == {"id": "1", "genus": "Bufo", "species": "Bufo bufo"}
+
+    # The same sequence of keys re-uses the cached plan, and records updated the same way share a shape
+    copy.update([("species", "Bufo viridis"), ("status", "accepted"), ("genus", "Bufotes"), ("status", "synonym")], tax_filled=[])
+    assert copy.shape is record.shape
+    assert copy["status"] == "synonym"
+
+def test_update_of_a_single_key():
+    record = CompactRecord.from_dict({})
+    record.update({"id": "1"})
+    assert record.as_dict() == {"id": "1"}
+    record.update({"id": "2"})
+    assert record.as_dict() == {"id": "2"}
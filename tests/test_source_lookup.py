@@ -0,0 +1,74 @@
+# Checks of the source key and name lookups of matched records: failed lookups are logged as errors for every record they
+# leave without a source, and are not cached, so a later call sends them again.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AGSD_tax_updater import resolve_sources
+
+# API client answering source lookups from dicts, failing each lookup in "failing" the first time it is sent
+class FakeSourceClient:
+    def __init__(self, source_keys, source_names, failing=()):
+        self.source_keys = source_keys
+        self.source_names = source_names
+        self.failing = set(failing)
+        self.requests = []
+
+    def get(self, url, cache_key=None, authenticate=False):
+        endpoint, dataset, name, rank = cache_key
+        self.requests.append((endpoint, name))
+        if name in self.failing:
+            self.failing.discard(name)
+            raise ConnectionError("transient")
+        if endpoint == "nameusage/source":
+            return({"sourceDatasetKey": self.source_keys.get(name)})
+        return({"title": self.source_names[name]})
+
+def matched_records():
+    return([{"id": "1", "match_id": "A", "raw_name": "Bufo bufo", "query_name": "Bufo bufo", "query_rank": "species"},
+            {"id": "2", "match_id": "A", "raw_name": "Bufo bufo (4n)", "query_name": "Bufo bufo", "query_rank": "species"},
+            {"id": "3", "match_id": "B", "raw_name": "Rana temporaria", "query_name": "Rana temporaria", "query_rank": "species"},
+            {"id": "4", "match_id": "C", "raw_name": "Mus musculus", "query_name": "Mus musculus", "query_rank": "species"}])
+
+def test_sources_are_resolved_once():
+    client = FakeSourceClient({"A": 1000, "B": 1000, "C": None}, {"1000": "Amphibian Species of the World"})
+    records = matched_records()
+    errors = []
+    resolve_sources("3LR", [records], client, report=False, errors=errors)
+
+    assert errors == []
+    assert [record["source_key"] for record in records] == ["1000", "1000", "1000", "None"]
+    assert [record["tax_source_name"] for record in records] == ["Amphibian Species of the World"] * 3 + [None]
+    assert sorted(client.requests) == [("nameusage/source", "A"), ("nameusage/source", "B"), ("nameusage/source", "C"), ("source", "1000")]
+
+def test_failed_key_lookup_is_not_cached():
+    client = FakeSourceClient({"A": 1000, "B": 1000, "C": 2000}, {"1000": "ASW", "2000": "MDD"}, failing=["A"])
+    key_cache, name_cache = {}, {}
+    records = matched_records()
+    errors = []
+    resolve_sources("3LR", [records], client, key_cache=key_cache, name_cache=name_cache, report=False, errors=errors)
+
+    assert [error["id"] for error in errors] == ["1", "2"]
+    assert errors[1]["raw_name"] == "Bufo bufo (4n)" and isinstance(errors[1]["error"], ConnectionError)
+    assert "A" not in key_cache
+    assert (records[0]["source_key"], records[0]["tax_source_name"]) == ("None", None)
+    assert (records[2]["source_key"], records[2]["tax_source_name"]) == ("1000", "ASW")
+
+    # The next call (eg. a retry pass) sends the failed lookup again, and re-uses the cached ones
+    client.requests = []
+    records = matched_records()
+    errors = []
+    resolve_sources("3LR", [records], client, key_cache=key_cache, name_cache=name_cache, report=False, errors=errors)
+    assert errors == []
+    assert client.requests == [("nameusage/source", "A")]
+    assert [record["tax_source_name"] for record in records] == ["ASW", "ASW", "ASW", "MDD"]
+
+def test_failed_name_lookup_is_not_cached():
+    client = FakeSourceClient({"A": 1000, "B": 1000, "C": 2000}, {"1000": "ASW", "2000": "MDD"}, failing=["1000"])
+    key_cache, name_cache = {}, {}
+    errors = []
+    resolve_sources("3LR", [matched_records()], client, key_cache=key_cache, name_cache=name_cache, report=False, errors=errors)
+
+    assert [error["id"] for error in errors] == ["1", "2", "3"]
+    assert key_cache == {"A": "1000", "B": "1000", "C": "2000"}
+    assert name_cache == {"2000": "MDD"}
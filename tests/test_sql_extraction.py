@@ -0,0 +1,44 @@
+# Checks of the .sql dump parsing: parallel extraction against a sequential pass, for multi-row INSERT statements and for the
+# AGSD layout of a single INSERT statement with one tuple per line, and the handling of malformed and double-quoted tuples.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AGSD_tax_updater import iter_AGSD_records, iter_AGSD_records_parallel, parse_sql_tuples, sql_chunks
+from synthetic_dump import write_synthetic_dump
+
+@pytest.mark.parametrize("tuple_per_line", [False, True])
+def test_parallel_extraction_matches_sequential(tmp_path, tuple_per_line):
+    dump_file = write_synthetic_dump(str(tmp_path / "synthetic_AGSD.sql"), 5000, tuple_per_line=tuple_per_line)
+    chunk_bytes = os.path.getsize(dump_file) // 8
+
+    assert len(sql_chunks(dump_file, chunk_bytes)) >= 4
+    sequential = [record.as_dict() for record in iter_AGSD_records(dump_file)]
+    parallel = [record.as_dict() for record in iter_AGSD_records_parallel(dump_file, processes=2, chunk_bytes=chunk_bytes)]
+    assert len(sequential) == 5000
+    assert parallel == sequential
+
+def test_tuple_per_line_ranges_start_inside_the_insert(tmp_path):
+    dump_file = write_synthetic_dump(str(tmp_path / "synthetic_AGSD.sql"), 1000, tuple_per_line=True)
+    chunks = sql_chunks(dump_file, os.path.getsize(dump_file) // 4)
+
+    assert chunks[0][4] is False
+    for start, end, table_columns, insert_columns, in_values in chunks[1:]:
+        assert in_values and insert_columns[0] == "id"
+
+def test_double_quoted_values():
+    rows, position, statement_end = parse_sql_tuples('(6, NULL, "Bufonidae", "Bufo aff. bufo", \'it\'\'s\', "a""b"),\n')
+    assert rows == [["6", None, "Bufonidae", "Bufo aff. bufo", "it's", 'a"b']]
+    assert not statement_end
+
+def test_incomplete_tuple_waits_for_more_text():
+    rows, position, statement_end = parse_sql_tuples("(1, 'a'),\n(2, 'an unfinished\n")
+    assert rows == [["1", "a"]]
+    assert position == len("(1, 'a')")
+
+def test_malformed_tuple_raises():
+    with pytest.raises(ValueError, match="Bufo bufo"):
+        parse_sql_tuples("(1, 'a'),\n(2, Bufo bufo, NULL),\n(3, 'b');\n")